@@ -1 +1,6 @@
-from costometer.agents.vanilla import SymmetricMouselabParticipant
+from costometer.agents.compiled_traces import CompiledTraces
+from costometer.agents.softmax_simulation import simulate_softmax_traces
+from costometer.agents.vanilla import (
+    SoftmaxLikelihoodParticipant,
+    SymmetricMouselabParticipant,
+)
@@ -0,0 +1,313 @@
+"""Provides a columnar container for traces, so likelihoods can be computed without looping over Python lists."""  # noqa: E501
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+from costometer.agents.likelihood import (
+    get_action_values,
+    get_trace_decisions,
+    match_num_actions,
+    softmax_log_likelihoods,
+)
+from costometer.planning_algorithms.q_table import QTable, StateInterner
+
+# per-trial trace fields kept by compiled traces, if every trace has them
+TRIAL_FIELDS = ["ground_truth", "trial_id"]
+
+
+class CompiledTraces:
+    """
+    Traces stored as flat arrays: one entry per decision (state id, action), with offsets marking trials and participants.
+
+    Iterating over compiled traces gives, for each participant, a small dictionary with the non-decision fields of their trace ("pid", "block" and any "sim_" fields) so it can stand in for the original traces when summarizing results.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        interner: StateInterner,
+        state_ids: np.ndarray,
+        actions: np.ndarray,
+        trial_offsets: np.ndarray,
+        participant_offsets: np.ndarray,
+        pids: np.ndarray,
+        blocks: np.ndarray = None,
+        rewards: np.ndarray = None,
+        episodes: np.ndarray = None,
+        trace_info: List[Dict[str, Any]] = None,
+        trial_info: Dict[str, np.ndarray] = None,
+    ):
+        """
+        Compiled traces, usually made with CompiledTraces.from_traces.
+
+        :param interner: state interner the state ids refer to
+        :param state_ids: state id for each decision
+        :param actions: action for each decision
+        :param trial_offsets: start of each trial in the decision arrays, plus total number of decisions
+        :param participant_offsets: start of each participant in the trial arrays, plus total number of trials
+        :param pids: pid for each participant
+        :param blocks: block label for each trial (if they exist)
+        :param rewards: reward for each decision (if they exist)
+        :param episodes: episode number (i_episode) for each trial (if they exist)
+        :param trace_info: for each participant, any "sim_" fields used to simulate their data
+        :param trial_info: arrays with a value for each trial, for the fields in TRIAL_FIELDS (e.g. ground truths and trial ids of human data)
+        """  # noqa: E501
+        self.interner = interner
+        self.state_ids = state_ids
+        self.actions = actions
+        self.trial_offsets = trial_offsets
+        self.participant_offsets = participant_offsets
+        self.pids = pids
+        self.blocks = blocks
+        self.rewards = rewards
+        self.episodes = episodes
+
+        if trace_info is None:
+            self.trace_info = [{} for _ in pids]
+        else:
+            self.trace_info = trace_info
+        if trial_info is None:
+            self.trial_info = {}
+        else:
+            self.trial_info = trial_info
+
+        # trial index of each decision, used to sum decisions into trials
+        self.decision_trials = np.repeat(
+            np.arange(self.num_trials), np.diff(self.trial_offsets)
+        )
+
+    @classmethod
+    def from_traces(
+        cls, traces: List[Dict[str, List]], interner: StateInterner = None
+    ) -> "CompiledTraces":
+        """
+        Compile list of traces (as outputted by simulate_trajectory or get_trajectories_from_participant_data)
+
+        :param traces: list of traces, each must at least include states, actions and pid
+        :param interner: state interner to add states to (e.g. that of a QTable), if None a new interner is made
+        :return: compiled traces
+        """  # noqa: E501
+        if interner is None:
+            interner = StateInterner()
+
+        states = []
+        actions = []
+        trial_lengths = []
+        participant_lengths = []
+        for trace in traces:
+            trace_states, trace_actions, trace_trial_lengths = get_trace_decisions(
+                trace
+            )
+            states.extend(trace_states)
+            actions.extend(trace_actions)
+            trial_lengths.extend(trace_trial_lengths)
+            participant_lengths.append(len(trace_trial_lengths))
+
+        # optional fields are only kept if all traces have them
+        blocks = None
+        if all("block" in trace for trace in traces):
+            blocks = np.asarray([block for trace in traces for block in trace["block"]])
+        rewards = None
+        if all("rewards" in trace for trace in traces):
+            rewards = np.asarray(
+                [
+                    reward
+                    for trace in traces
+                    for trial_rewards in trace["rewards"]
+                    for reward in trial_rewards
+                ],
+                dtype=float,
+            )
+            # e.g. partially finished trials, rewards wouldn't match decisions
+            if len(rewards) != len(actions):
+                rewards = None
+        episodes = None
+        if all("i_episode" in trace for trace in traces):
+            episodes = np.asarray(
+                [episode for trace in traces for episode in trace["i_episode"]]
+            )
+        trial_info = {}
+        for field in TRIAL_FIELDS:
+            # e.g. simulated traces have None as ground truths if they were sampled
+            trial_values = [
+                value for trace in traces for value in trace.get(field, [None])
+            ]
+            if all(value is not None for value in trial_values):
+                try:
+                    trial_values = np.asarray(trial_values)
+                except ValueError:
+                    # e.g. trials with differently sized ground truths
+                    continue
+                # only numbers and strings, e.g. not ground truths with distributions
+                if trial_values.dtype != object:
+                    trial_info[field] = trial_values
+
+        return cls(
+            interner=interner,
+            state_ids=interner.intern_many(states),
+            actions=np.asarray(actions, dtype=np.int64),
+            trial_offsets=np.concatenate([[0], np.cumsum(trial_lengths)]).astype(
+                np.int64
+            ),
+            participant_offsets=np.concatenate(
+                [[0], np.cumsum(participant_lengths)]
+            ).astype(np.int64),
+            pids=np.asarray([trace["pid"][0] for trace in traces]),
+            blocks=blocks,
+            rewards=rewards,
+            episodes=episodes,
+            trace_info=[
+                {key: trace[key] for key in trace.keys() if "sim_" in key}
+                for trace in traces
+            ],
+            trial_info=trial_info,
+        )
+
+    @property
+    def num_participants(self) -> int:
+        return len(self.participant_offsets) - 1
+
+    @property
+    def num_trials(self) -> int:
+        return len(self.trial_offsets) - 1
+
+    @property
+    def num_decisions(self) -> int:
+        return len(self.actions)
+
+    @property
+    def max_num_trials(self) -> int:
+        return int(np.max(np.diff(self.participant_offsets), initial=0))
+
+    def __len__(self) -> int:
+        return self.num_participants
+
+    def __getitem__(self, participant_idx: int) -> Dict[str, Any]:
+        """
+        Non-decision fields of a participant's trace
+
+        :param participant_idx: index of participant
+        :return: dictionary with "pid", "block" (if they exist) and "sim_" fields
+        """
+        trial_slice = self._get_trial_slice(participant_idx)
+        pid = self.pids[participant_idx : participant_idx + 1].tolist()[0]
+        trace = {"pid": [pid] * (trial_slice.stop - trial_slice.start)}
+        if self.blocks is not None:
+            trace["block"] = self.blocks[trial_slice].tolist()
+        return {**trace, **self.trace_info[participant_idx]}
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for participant_idx in range(self.num_participants):
+            yield self[participant_idx]
+
+    def _get_trial_slice(self, participant_idx: int) -> slice:
+        return slice(
+            self.participant_offsets[participant_idx],
+            self.participant_offsets[participant_idx + 1],
+        )
+
+    def get_action_values(
+        self,
+        preference: Union[Dict[Tuple[Any, int], float], QTable],
+        num_actions: int,
+    ) -> np.ndarray:
+        """
+        Gathers Q values for every decision, looking each distinct state up only once
+
+        :param preference: Q dictionary keyed by (state, action), or Q table
+        :param num_actions: size of action space
+        :return: array of shape (number of decisions, number of actions)
+        """  # noqa: E501
+        if (
+            isinstance(preference, QTable)
+            and preference.interner is self.interner
+            and preference.symmetry is None
+        ):
+            # state ids are already rows of the Q table, so no lookups are needed
+            return match_num_actions(
+                preference.get_action_values_for_ids(self.state_ids), num_actions
+            )
+        else:
+            return get_action_values(self.interner.states, preference, num_actions)[
+                self.state_ids
+            ]
+
+    def compute_trial_likelihoods(
+        self,
+        preference: Union[Dict[Tuple[Any, int], float], QTable],
+        temps: Union[float, np.ndarray],
+        num_actions: int,
+    ) -> np.ndarray:
+        """
+        Get summed (log) likelihood of each trial under a softmax policy
+
+        :param preference: Q dictionary keyed by (state, action), or Q table
+        :param temps: softmax temperature, or array of temperatures
+        :param num_actions: size of action space
+        :return: array of shape (number of trials,) or (number of trials, number of temperatures)
+        """  # noqa: E501
+        logliks = softmax_log_likelihoods(
+            self.get_action_values(preference, num_actions), self.actions, temps
+        )
+        trial_logliks = np.zeros((self.num_trials,) + logliks.shape[1:])
+        np.add.at(trial_logliks, self.decision_trials, logliks)
+        return trial_logliks
+
+    def split_trials(self, trial_values: np.ndarray) -> List[np.ndarray]:
+        """
+        Split an array with an entry per trial into one array per participant
+
+        :param trial_values: array with trials as first dimension
+        :return: list of arrays, one per participant
+        """
+        return np.split(trial_values, self.participant_offsets[1:-1])
+
+    def compute_batch_likelihood(
+        self,
+        preference: Union[Dict[Tuple[Any, int], float], QTable],
+        temp: float,
+        num_actions: int,
+    ) -> List[List[List[float]]]:
+        """
+        Get (log) likelihood of each action under a softmax policy
+
+        :param preference: Q dictionary keyed by (state, action), or Q table
+        :param temp: softmax temperature
+        :param num_actions: size of action space
+        :return: for each participant, list of lists containing log likelihoods for an action in a trial
+        """  # noqa: E501
+        logliks = softmax_log_likelihoods(
+            self.get_action_values(preference, num_actions), self.actions, temp
+        )
+        trial_logliks = np.split(logliks, self.trial_offsets[1:-1])
+        return [
+            [trial.tolist() for trial in trial_logliks[self._get_trial_slice(idx)]]
+            for idx in range(self.num_participants)
+        ]
+
+    def to_traces(self) -> List[Dict[str, List]]:
+        """
+        Convert back to list of traces, e.g. for traces_to_df
+
+        :return: list of traces with states, actions and any other compiled fields
+        """  # noqa: E501
+        states = [
+            [self.interner[state_id] for state_id in trial_state_ids]
+            for trial_state_ids in np.split(self.state_ids, self.trial_offsets[1:-1])
+        ]
+        actions = np.split(self.actions, self.trial_offsets[1:-1])
+        if self.rewards is not None:
+            rewards = np.split(self.rewards, self.trial_offsets[1:-1])
+
+        traces = []
+        for participant_idx, trace in enumerate(self):
+            trial_slice = self._get_trial_slice(participant_idx)
+            trace["states"] = states[trial_slice]
+            trace["actions"] = [trial.tolist() for trial in actions[trial_slice]]
+            if self.rewards is not None:
+                trace["rewards"] = [trial.tolist() for trial in rewards[trial_slice]]
+            if self.episodes is not None:
+                trace["i_episode"] = self.episodes[trial_slice].tolist()
+            for field, trial_values in self.trial_info.items():
+                trace[field] = trial_values[trial_slice].tolist()
+            traces.append(trace)
+        return traces
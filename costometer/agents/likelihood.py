@@ -0,0 +1,201 @@
+"""Provides functions to calculate softmax log likelihoods for many actions at once."""
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+from scipy.special import logsumexp
+
+from costometer.planning_algorithms.q_table import QTable
+
+
+def get_trace_decisions(
+    trace: Dict[str, List],
+) -> Tuple[List[Any], List[int], List[int]]:
+    """
+    Gets the (state, action) pairs in a trace that are scored by a policy
+
+    :param trace: trajectory trace as dictionary, must at least include states and actions
+    :return: states, actions and number of decisions in each trial
+    """  # noqa: E501
+    states = []
+    actions = []
+    trial_lengths = []
+    for trial_idx, trial_states in enumerate(trace["states"]):
+        trial_actions = trace["actions"][trial_idx]
+        trial_length = 0
+        for action_idx, state in enumerate(trial_states):
+            # if last state is terminal state, it isn't a decision
+            if state != "__term_state__":
+                states.append(state)
+                actions.append(trial_actions[action_idx])
+                trial_length += 1
+        trial_lengths.append(trial_length)
+    return states, actions, trial_lengths
+
+
+def _get_decisions(
+    traces: List[Dict[str, List]],
+) -> Tuple[List[Any], np.ndarray, List[List[int]]]:
+    """
+    Gets scored (state, action) pairs for many traces, flattened over traces and trials
+
+    :param traces: list of traces, each must at least include states and actions
+    :return: states, actions and number of decisions in each trial of each trace
+    """  # noqa: E501
+    all_states = []
+    all_actions = []
+    all_trial_lengths = []
+    for trace in traces:
+        states, actions, trial_lengths = get_trace_decisions(trace)
+        all_states.extend(states)
+        all_actions.extend(actions)
+        all_trial_lengths.append(trial_lengths)
+    return all_states, np.asarray(all_actions, dtype=int), all_trial_lengths
+
+
+def match_num_actions(action_values: np.ndarray, num_actions: int) -> np.ndarray:
+    """
+    Pads action values from a Q table with -inf, since Q tables only have as many columns as actions seen when building them
+
+    :param action_values: array of shape (number of states, number of actions in Q table)
+    :param num_actions: size of action space
+    :return: array of shape (number of states, number of actions)
+    """  # noqa: E501
+    if action_values.shape[1] < num_actions:
+        action_values = np.pad(
+            action_values,
+            ((0, 0), (0, num_actions - action_values.shape[1])),
+            constant_values=-np.inf,
+        )
+    return action_values
+
+
+def get_action_values(
+    states: List[Any],
+    preference: Union[Dict[Tuple[Any, int], float], QTable],
+    num_actions: int,
+) -> np.ndarray:
+    """
+    Gathers Q values for states into an array, actions not available in a state are -inf
+
+    :param states: list of states
+    :param preference: Q dictionary keyed by (state, action), or Q table
+    :param num_actions: size of action space
+    :return: array of shape (number of states, number of actions)
+    """  # noqa: E501
+    if isinstance(preference, QTable):
+        return match_num_actions(preference.get_action_values(states), num_actions)
+
+    action_values = np.full((len(states), num_actions), -np.inf)
+    for state_idx, state in enumerate(states):
+        for action in range(num_actions):
+            action_values[state_idx, action] = preference.get((state, action), -np.inf)
+    return action_values
+
+
+def softmax_log_likelihoods(
+    action_values: np.ndarray,
+    actions: np.ndarray,
+    temp: Union[float, np.ndarray],
+) -> np.ndarray:
+    """
+    Log likelihood of actions according to softmax over Q values, as in mouselab's SoftmaxPolicy
+
+    :param action_values: array of shape (number of decisions, number of actions)
+    :param actions: action taken at each decision
+    :param temp: softmax temperature, or array of temperatures
+    :return: log likelihood of each action, of shape (number of decisions, number of temperatures) if several temperatures are provided
+    """  # noqa: E501
+    temps = np.atleast_1d(temp)
+    # shape (number of decisions, number of actions, number of temperatures)
+    scaled_values = action_values[:, :, np.newaxis] / temps
+    chosen_values = scaled_values[np.arange(len(actions)), actions]
+    logliks = chosen_values - logsumexp(scaled_values, axis=1)
+
+    if np.ndim(temp) == 0:
+        return logliks[:, 0]
+    else:
+        return logliks
+
+
+def compute_trial_likelihoods(
+    traces: List[Dict[str, List]],
+    preference: Union[Dict[Tuple[Any, int], float], QTable],
+    temps: np.ndarray,
+    num_actions: int,
+) -> List[np.ndarray]:
+    """
+    Get summed (log) likelihood of each trial, for many softmax temperatures at once
+
+    Q values are gathered once for all traces, so the cost barely grows with the number of temperatures.
+
+    :param traces: list of traces, each must at least include states and actions
+    :param preference: Q dictionary keyed by (state, action), or Q table
+    :param temps: array of softmax temperatures
+    :param num_actions: size of action space
+    :return: for each trace, array of shape (number of trials, number of temperatures)
+    """  # noqa: E501
+    all_states, all_actions, all_trial_lengths = _get_decisions(traces)
+
+    logliks = softmax_log_likelihoods(
+        get_action_values(all_states, preference, num_actions),
+        all_actions,
+        np.asarray(temps, dtype=float),
+    )
+
+    # sum decisions into trials (add.at so empty trials are 0)
+    flat_trial_lengths = [length for lengths in all_trial_lengths for length in lengths]
+    trial_logliks = np.zeros((len(flat_trial_lengths), len(temps)))
+    np.add.at(
+        trial_logliks,
+        np.repeat(np.arange(len(flat_trial_lengths)), flat_trial_lengths),
+        logliks,
+    )
+
+    return np.split(trial_logliks, np.cumsum([len(t) for t in all_trial_lengths])[:-1])
+
+
+def compute_batch_likelihood(
+    traces: Union[Dict[str, List], List[Dict[str, List]]],
+    preference: Union[Dict[Tuple[Any, int], float], QTable],
+    temp: float,
+    num_actions: int,
+) -> Union[List[List[float]], List[List[List[float]]]]:
+    """
+    Get (log) likelihood of trace(s) under a softmax policy, in one pass over all actions
+
+    :param traces: one trace or a list of traces, each must at least include states and actions
+    :param preference: Q dictionary keyed by (state, action), or Q table
+    :param temp: softmax temperature
+    :param num_actions: size of action space
+    :return: for each trace, list of lists containing log likelihoods for an action in a trial (same as Participant.compute_likelihood)
+    """  # noqa: E501
+    single_trace = isinstance(traces, dict)
+    if single_trace:
+        traces = [traces]
+
+    all_states, all_actions, all_trial_lengths = _get_decisions(traces)
+
+    logliks = softmax_log_likelihoods(
+        get_action_values(all_states, preference, num_actions),
+        all_actions,
+        temp,
+    )
+
+    # split flat log likelihoods back into traces and trials
+    trial_logliks = iter(
+        np.split(
+            logliks,
+            np.cumsum([length for lengths in all_trial_lengths for length in lengths])[
+                :-1
+            ],
+        )
+    )
+    trace_logliks = [
+        [next(trial_logliks).tolist() for _ in trial_lengths]
+        for trial_lengths in all_trial_lengths
+    ]
+
+    if single_trace:
+        return trace_logliks[0]
+    else:
+        return trace_logliks
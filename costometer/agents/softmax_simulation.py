@@ -0,0 +1,177 @@
+"""Provides batched simulation of softmax policies on Mouselab environments, sampling actions for many participants and trials at once from Q tables."""  # noqa: E501
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+from scipy.special import softmax
+
+from costometer.agents.compiled_traces import CompiledTraces
+from costometer.agents.likelihood import match_num_actions
+from costometer.planning_algorithms.q_table import (
+    EncodedStateInterner,
+    QTable,
+    encode_states,
+)
+
+
+def _get_encoded_interner(q_table: QTable) -> Tuple[EncodedStateInterner, np.ndarray]:
+    """
+    Get an encoded interner for the states of a Q table, so encoded states can be looked up without decoding them
+
+    :param q_table: Q table
+    :return: encoded state interner, and for each of its ids the state id in the Q table's interner
+    """  # noqa: E501
+    if isinstance(q_table.interner, EncodedStateInterner):
+        return q_table.interner, np.arange(len(q_table.interner))
+
+    # e.g. the terminal state can't be encoded, and has no Q values anyway
+    table_ids = [
+        state_id
+        for state_id in range(len(q_table.values))
+        if isinstance(q_table.interner[state_id], tuple)
+    ]
+    encoded_interner, order = EncodedStateInterner.from_states(
+        [q_table.interner[state_id] for state_id in table_ids]
+    )
+    return encoded_interner, np.asarray(table_ids, dtype=np.int64)[order]
+
+
+def sample_ground_truths(
+    init: Tuple[Any, ...], num_episodes: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Sample ground truth values of every node, as new_symmetric_registered does for each environment
+
+    :param init: initial Mouselab state, the distribution (or value) of each node
+    :param num_episodes: number of ground truths to sample
+    :param rng: random generator
+    :return: array of shape (number of episodes, number of nodes)
+    """  # noqa: E501
+    ground_truths = np.empty((num_episodes, len(init)))
+    for node_idx, node in enumerate(init):
+        if hasattr(node, "sample"):
+            ground_truths[:, node_idx] = rng.choice(
+                np.asarray(node.vals, dtype=float), size=num_episodes, p=node.probs
+            )
+        else:
+            ground_truths[:, node_idx] = node
+    return ground_truths
+
+
+def simulate_softmax_traces(
+    q_table: QTable,
+    init: Tuple[Any, ...],
+    num_participants: int,
+    num_trials: int,
+    temps: Union[float, np.ndarray],
+    noises: Union[float, np.ndarray] = 0,
+    ground_truths: np.ndarray = None,
+    pids: List[Any] = None,
+    sim_kwargs: Dict[str, Any] = None,
+    seed: Union[int, np.random.Generator] = None,
+) -> CompiledTraces:
+    """
+    Simulate softmax policy participants on a Mouselab environment, all participants and trials at once
+
+    Every step looks up the current belief state of all unfinished trials in the Q table, samples their actions as mouselab's SoftmaxPolicy.act does (softmax over Q values, plus uniform noise scaled by noise) and reveals the clicked nodes' ground truth values.
+    Only states and actions are simulated (not rewards), which is all the inference classes need.
+    Q tables with a symmetry are not supported, since their lookups canonicalize states one at a time.
+
+    :param q_table: Q table with every reachable state of the environment, e.g. loaded by load_q_file from a Q file saved with q_format="qtable"
+    :param init: initial Mouselab state, e.g. env.init for an environment from new_symmetric_registered
+    :param num_participants: number of participants
+    :param num_trials: number of trials per participant
+    :param temps: softmax temperature, or array with one per participant
+    :param noises: softmax noise, or array with one per participant
+    :param ground_truths: ground truth node values of shape (number of participants * number of trials, number of nodes), if None sampled from init
+    :param pids: pid of each participant, if None 0 to number of participants - 1
+    :param sim_kwargs: other parameters used to simulate (e.g. cost parameters), saved with the temperature and noise as "sim_" fields of each participant
+    :param seed: seed or random generator, for reproducible simulations
+    :return: compiled traces (states are interned by the Q table's interner, so likelihoods need no further lookups)
+    """  # noqa: E501
+    if q_table.symmetry is not None:
+        raise ValueError("Q tables with a symmetry can not be simulated from.")
+
+    rng = np.random.default_rng(seed)
+    num_episodes = num_participants * num_trials
+    num_actions = len(init) + 1
+    term_action = len(init)
+
+    temps = np.broadcast_to(np.asarray(temps, dtype=float), num_participants)
+    noises = np.broadcast_to(np.asarray(noises, dtype=float), num_participants)
+    if pids is None:
+        pids = np.arange(num_participants)
+    if sim_kwargs is None:
+        sim_kwargs = {}
+    if ground_truths is None:
+        ground_truths = sample_ground_truths(init, num_episodes, rng)
+    else:
+        ground_truths = np.asarray(ground_truths, dtype=float)
+
+    encoded_interner, table_ids = _get_encoded_interner(q_table)
+    episode_temps = np.repeat(temps, num_trials)[:, np.newaxis]
+    episode_noises = np.repeat(noises, num_trials)[:, np.newaxis]
+
+    # belief states of every episode, encoded as in QTable.save
+    states = np.repeat(encode_states([init]), num_episodes, axis=0)
+    active = np.arange(num_episodes)
+    decision_episodes = []
+    decision_state_ids = []
+    decision_actions = []
+    while len(active) > 0:
+        encoded_ids = encoded_interner.get_ids_for_encoded(states[active])
+        if np.any(encoded_ids < 0):
+            raise KeyError(
+                f"{np.sum(encoded_ids < 0)} state(s) are not in the Q table."
+            )
+        state_ids = table_ids[encoded_ids]
+
+        probabilities = softmax(
+            match_num_actions(q_table.values[state_ids], num_actions)
+            / episode_temps[active],
+            axis=1,
+        )
+        probabilities += rng.random(probabilities.shape) * episode_noises[active]
+        cumulative_probabilities = np.cumsum(probabilities, axis=1)
+        # first action whose cumulative probability is above a uniform sample
+        actions = np.minimum(
+            np.sum(
+                cumulative_probabilities
+                < rng.random((len(active), 1)) * cumulative_probabilities[:, -1:],
+                axis=1,
+            ),
+            num_actions - 1,
+        )
+
+        decision_episodes.append(active)
+        decision_state_ids.append(state_ids)
+        decision_actions.append(actions)
+
+        # clicks reveal the node's ground truth, the termination action ends the trial
+        clicked = actions != term_action
+        active = active[clicked]
+        states[active, actions[clicked]] = ground_truths[active, actions[clicked]]
+
+    decision_episodes = np.concatenate(decision_episodes)
+    # decisions were added step by step, stable sort keeps them in order in each trial
+    order = np.argsort(decision_episodes, kind="stable")
+
+    return CompiledTraces(
+        interner=q_table.interner,
+        state_ids=np.concatenate(decision_state_ids)[order],
+        actions=np.concatenate(decision_actions)[order],
+        trial_offsets=np.concatenate(
+            [[0], np.cumsum(np.bincount(decision_episodes, minlength=num_episodes))]
+        ).astype(np.int64),
+        participant_offsets=np.arange(num_participants + 1, dtype=np.int64)
+        * num_trials,
+        pids=np.asarray(pids),
+        episodes=np.tile(np.arange(num_trials), num_participants),
+        trace_info=[
+            {
+                **{f"sim_{key}": value for key, value in sim_kwargs.items()},
+                "sim_temp": temp,
+                "sim_noise": noise,
+            }
+            for temp, noise in zip(temps.tolist(), noises.tolist())
+        ],
+    )
@@ -1,5 +1,6 @@
 """Provides participant classes for use with gym environments."""
 from copy import deepcopy
+from functools import lru_cache
 from typing import Any, Callable, Dict, List, Union
 
 import gym
@@ -7,6 +8,72 @@ import numpy as np
 from mouselab.agents import Agent
 from mouselab.distributions import Categorical
 from mouselab.mouselab import MouselabEnv
+from mouselab.policies import SoftmaxPolicy
+
+from costometer.agents.compiled_traces import CompiledTraces
+from costometer.agents.likelihood import (
+    compute_batch_likelihood,
+    compute_trial_likelihoods,
+)
+
+
+def _compute_softmax_batch_likelihood(
+    traces: Union[Dict[str, List], List[Dict[str, List]], CompiledTraces],
+    policy: SoftmaxPolicy,
+    num_actions: int,
+) -> Union[List[List[float]], List[List[List[float]]]]:
+    if isinstance(traces, CompiledTraces):
+        return traces.compute_batch_likelihood(
+            preference=policy.preference, temp=policy.temp, num_actions=num_actions
+        )
+    else:
+        return compute_batch_likelihood(
+            traces,
+            preference=policy.preference,
+            temp=policy.temp,
+            num_actions=num_actions,
+        )
+
+
+def _compute_softmax_temperature_likelihoods(
+    traces: Union[List[Dict[str, List]], CompiledTraces],
+    policy: SoftmaxPolicy,
+    temps: List[float],
+    num_actions: int,
+) -> List[np.ndarray]:
+    if isinstance(traces, CompiledTraces):
+        return traces.split_trials(
+            traces.compute_trial_likelihoods(
+                preference=policy.preference,
+                temps=np.asarray(temps, dtype=float),
+                num_actions=num_actions,
+            )
+        )
+    else:
+        return compute_trial_likelihoods(
+            traces,
+            preference=policy.preference,
+            temps=np.asarray(temps, dtype=float),
+            num_actions=num_actions,
+        )
+
+
+@lru_cache()
+def _get_registered_num_actions(experiment_setting: str) -> int:
+    return MouselabEnv.new_symmetric_registered(experiment_setting).action_space.n
+
+
+def _get_num_actions(
+    experiment_setting: str, additional_mouselab_kwargs: Dict[str, Any] = None
+) -> int:
+    if additional_mouselab_kwargs:
+        # e.g. a different structure changes the action space, and the keyword
+        # arguments may not be hashable, so the environment is constructed each time
+        return MouselabEnv.new_symmetric_registered(
+            experiment_setting, **additional_mouselab_kwargs
+        ).action_space.n
+    else:
+        return _get_registered_num_actions(experiment_setting)
 
 
 class Participant:
@@ -116,6 +183,45 @@ class Participant:
 
         return logliks
 
+    def compute_batch_likelihood(
+        self, traces: Union[Dict[str, List], List[Dict[str, List]], CompiledTraces]
+    ) -> Union[List[List[float]], List[List[List[float]]]]:
+        """
+        Get (log) likelihood of one or many traces, scoring all actions at once for softmax policies
+
+        :param traces: trajectory trace as dictionary (or list of them, or compiled traces), must at least include states and actions
+        :return: same as compute_likelihood (or a list of those, if many traces are provided)
+        """  # noqa: E501
+        if not isinstance(self.agent.policy, SoftmaxPolicy):
+            # no Q values to vectorize over, use the per-state path
+            if isinstance(traces, dict):
+                return self.compute_likelihood(traces)
+            elif isinstance(traces, CompiledTraces):
+                return [self.compute_likelihood(trace) for trace in traces.to_traces()]
+            else:
+                return [self.compute_likelihood(trace) for trace in traces]
+
+        return _compute_softmax_batch_likelihood(
+            traces, self.agent.policy, self.envs[0].action_space.n
+        )
+
+    def compute_temperature_likelihoods(
+        self, traces: Union[List[Dict[str, List]], CompiledTraces], temps: List[float]
+    ) -> List[np.ndarray]:
+        """
+        Get summed (log) likelihood of each trial for many softmax temperatures, ignoring the policy's own temperature
+
+        :param traces: list of trajectory traces (or compiled traces), each must at least include states and actions
+        :param temps: softmax temperatures to evaluate
+        :return: for each trace, array of shape (number of trials, number of temperatures)
+        """  # noqa: E501
+        if not isinstance(self.agent.policy, SoftmaxPolicy):
+            raise ValueError("Temperatures can only be evaluated for a softmax policy.")
+
+        return _compute_softmax_temperature_likelihoods(
+            traces, self.agent.policy, temps, self.envs[0].action_space.n
+        )
+
     def __deepcopy__(self, memo: Dict[Any, Any]):
         """from https://stackoverflow.com/a/15774013"""
         cls = self.__class__
@@ -240,3 +346,88 @@ class SymmetricMouselabParticipant(Participant):
             policy_function=policy_function,
             policy_kwargs=policy_kwargs,
         )
+
+
+class SoftmaxLikelihoodParticipant:
+    def __init__(
+        self,
+        experiment_setting: str = None,
+        num_actions: int = None,
+        num_trials: int = None,
+        ground_truths: List[List[Union[int, Categorical]]] = None,
+        trial_ids: List[Union[int, str]] = None,
+        additional_mouselab_kwargs: Dict[str, Any] = {},
+        cost_function: Callable = None,
+        cost_kwargs: Dict[str, Any] = {},
+        policy_function: Callable = SoftmaxPolicy,
+        policy_kwargs: Dict[str, Any] = {},
+    ):
+        """
+        Participant that only scores traces under a softmax policy, without constructing any environments or agent.
+
+        It can be used in place of SymmetricMouselabParticipant (or Participant) as the participant class of the inference classes, since the likelihood only depends on the Q values and temperature.
+
+        :param experiment_setting: registered experiment setting in mouselab.envs.registry registry, used to find the number of actions if num_actions is not provided
+        :param num_actions: size of action space
+        :param num_trials: not used, accepted to match SymmetricMouselabParticipant
+        :param ground_truths: not used, accepted to match SymmetricMouselabParticipant
+        :param trial_ids: not used, accepted to match SymmetricMouselabParticipant
+        :param additional_mouselab_kwargs: additional keyword arguments for constructing Mouselab MDP environments, used with experiment_setting to find the number of actions
+        :param cost_function: cost function (already reflected in the Q values)
+        :param cost_kwargs: keyword arguments for cost function
+        :param policy_function: must be a softmax policy
+        :param policy_kwargs: keyword arguments for policy function, must include preference (e.g., {'preference' : q_dictionary, 'temp' : 2})
+        """  # noqa: E501
+        if (experiment_setting is None) and (num_actions is None):
+            raise ValueError("Either experiment_setting or num_actions must be set.")
+        if not issubclass(policy_function, SoftmaxPolicy):
+            raise ValueError("Likelihoods can only be computed for a softmax policy.")
+
+        if num_actions is None:
+            self.num_actions = _get_num_actions(
+                experiment_setting, additional_mouselab_kwargs
+            )
+        else:
+            self.num_actions = num_actions
+
+        self.cost_function = cost_function
+        self.cost_kwargs = cost_kwargs
+
+        self.policy_function = policy_function
+        self.policy_kwargs = policy_kwargs
+        # no environment is attached, only preference and temperature are used
+        self.policy = self.policy_function(**self.policy_kwargs)
+
+    def compute_likelihood(self, trace: Dict[str, List]) -> List[List[float]]:
+        """
+        Get (log) likelihood of trace
+
+        :param trace: trajectory trace as dictionary, must at least include states and actions
+        :return: list of lists containing log likelihoods for an action in a trial
+        """  # noqa: E501
+        return self.compute_batch_likelihood(trace)
+
+    def compute_batch_likelihood(
+        self, traces: Union[Dict[str, List], List[Dict[str, List]], CompiledTraces]
+    ) -> Union[List[List[float]], List[List[List[float]]]]:
+        """
+        See Participant.compute_batch_likelihood
+
+        :param traces: trajectory trace as dictionary (or list of them, or compiled traces), must at least include states and actions
+        :return: same as compute_likelihood (or a list of those, if many traces are provided)
+        """  # noqa: E501
+        return _compute_softmax_batch_likelihood(traces, self.policy, self.num_actions)
+
+    def compute_temperature_likelihoods(
+        self, traces: Union[List[Dict[str, List]], CompiledTraces], temps: List[float]
+    ) -> List[np.ndarray]:
+        """
+        See Participant.compute_temperature_likelihoods
+
+        :param traces: list of trajectory traces (or compiled traces), each must at least include states and actions
+        :param temps: softmax temperatures to evaluate
+        :return: for each trace, array of shape (number of trials, number of temperatures)
+        """  # noqa: E501
+        return _compute_softmax_temperature_likelihoods(
+            traces, self.policy, temps, self.num_actions
+        )
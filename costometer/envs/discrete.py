@@ -7,6 +7,7 @@ import numpy as np
 from gym import utils
 from gym.envs.toy_text import CliffWalkingEnv
 from gym.envs.toy_text.discrete import DiscreteEnv
+from scipy import ndimage
 
 
 class ExactSolveMixin:
@@ -216,6 +217,192 @@ class VerySimpleGridWorld(DiscreteEnv):
         super().__init__(nS, nA, P, isd)
 
 
+class GridWorld(DiscreteEnv):
+    """
+    Parameterized grid world, for measuring how planning and inference scale with the number of states.
+
+    The agent moves up, right, down or left (actions 0 to 3, as in VerySimpleGridWorld) and with probability slip moves to either side of the intended direction instead.
+    Moving into a wall or off the grid leaves the agent in place, moving into a cliff costs cliff_reward and returns the agent to the start, and moving into a goal ends the episode.
+    Walls and goals have no moves of their own (they end the episode), so every state has a finite value as long as a goal can be reached.
+    Transitions are computed with numpy, so grids with 10^5 to 10^6 states can be built, although then P itself takes a few gigabytes.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        shape: Tuple[int, int] = (4, 12),
+        start: Tuple[int, int] = None,
+        goals: List[Tuple[int, int]] = None,
+        goal_rewards: List[float] = None,
+        walls: List[Tuple[int, int]] = None,
+        cliffs: List[Tuple[int, int]] = None,
+        slip: float = 0.0,
+        step_reward: float = -1.0,
+        cliff_reward: float = -100.0,
+    ):
+        """
+        Grid world.
+
+        :param shape: number of rows and columns
+        :param start: start position, if None the bottom left corner
+        :param goals: goal positions, if None the bottom right corner
+        :param goal_rewards: reward for moving into each goal, if None step_reward
+        :param walls: positions that can't be moved into
+        :param cliffs: positions that send the agent back to the start
+        :param slip: probability of moving to one of the sides of the intended direction
+        :param step_reward: reward for every other move
+        :param cliff_reward: reward for moving into a cliff
+        """  # noqa: E501
+        nrow, ncol = shape
+        self.shape = (nrow, ncol)
+        nS = nrow * ncol
+        nA = 4
+
+        if start is None:
+            start = (nrow - 1, 0)
+        if goals is None:
+            goals = [(nrow - 1, ncol - 1)]
+        if goal_rewards is None:
+            goal_rewards = [step_reward] * len(goals)
+
+        self.start_state_index = np.ravel_multi_index(start, self.shape)
+        isd = np.zeros(nS)
+        isd[self.start_state_index] = 1.0
+
+        self.goal_states = np.ravel_multi_index(tuple(np.transpose(goals)), self.shape)
+        self._goal_reward = np.zeros(self.shape)
+        self._goal_reward[np.unravel_index(self.goal_states, self.shape)] = goal_rewards
+        self._goal = np.zeros(self.shape, dtype=bool)
+        self._goal[np.unravel_index(self.goal_states, self.shape)] = True
+        self._wall = np.zeros(self.shape, dtype=bool)
+        if walls:
+            self._wall[tuple(np.transpose(walls))] = True
+        self._cliff = np.zeros(self.shape, dtype=bool)
+        if cliffs:
+            self._cliff[tuple(np.transpose(cliffs))] = True
+
+        # (probability, direction relative to intended action) of each outcome
+        outcomes = [(1.0 - slip, 0)]
+        if slip > 0:
+            outcomes.extend([(slip / 2, -1), (slip / 2, 1)])
+
+        rows, cols = np.unravel_index(np.arange(nS), self.shape)
+        displacements = np.array([(-1, 0), (0, 1), (1, 0), (0, -1)])
+        # next state, reward and done for each state, action and outcome
+        next_states = np.empty((nS, nA, len(outcomes)), dtype=np.int64)
+        rewards = np.empty((nS, nA, len(outcomes)))
+        dones = np.empty((nS, nA, len(outcomes)), dtype=bool)
+        for action in range(nA):
+            for outcome_idx, (_, direction) in enumerate(outcomes):
+                displacement = displacements[(action + direction) % nA]
+                new_rows = np.clip(rows + displacement[0], 0, nrow - 1)
+                new_cols = np.clip(cols + displacement[1], 0, ncol - 1)
+
+                blocked = self._wall[new_rows, new_cols]
+                new_rows = np.where(blocked, rows, new_rows)
+                new_cols = np.where(blocked, cols, new_cols)
+                cliff = self._cliff[new_rows, new_cols]
+                goal = self._goal[new_rows, new_cols]
+
+                next_states[:, action, outcome_idx] = np.where(
+                    cliff,
+                    self.start_state_index,
+                    np.ravel_multi_index((new_rows, new_cols), self.shape),
+                )
+                rewards[:, action, outcome_idx] = np.select(
+                    [cliff, goal],
+                    [cliff_reward, self._goal_reward[new_rows, new_cols]],
+                    step_reward,
+                )
+                dones[:, action, outcome_idx] = goal
+
+        # walls and goals end the episode, like the goal in CliffWalkingEnv
+        absorbing = (self._wall | self._goal)[rows, cols]
+        next_states[absorbing] = np.arange(nS)[absorbing, np.newaxis, np.newaxis]
+        rewards[absorbing] = 0
+        dones[absorbing] = True
+
+        probabilities = [probability for probability, _ in outcomes]
+        P = {
+            s: {
+                a: list(
+                    zip(probabilities, action_next_states, action_rewards, action_dones)
+                )
+                for a, (action_next_states, action_rewards, action_dones) in enumerate(
+                    zip(state_next_states, state_rewards, state_dones)
+                )
+            }
+            for s, (state_next_states, state_rewards, state_dones) in enumerate(
+                zip(next_states.tolist(), rewards.tolist(), dones.tolist())
+            )
+        }
+
+        super().__init__(nS, nA, P, isd)
+
+    @classmethod
+    def new_random(
+        cls,
+        shape: Tuple[int, int],
+        num_goals: int = 1,
+        wall_fraction: float = 0.0,
+        cliff_fraction: float = 0.0,
+        seed: Union[int, np.random.Generator] = None,
+        **kwargs,
+    ) -> "GridWorld":
+        """
+        Grid world with goals, walls and cliffs at random positions
+
+        Open cells that can't reach a goal (e.g. enclosed by walls) are made walls, so every state has a finite value.
+
+        :param shape: number of rows and columns
+        :param num_goals: number of goals
+        :param wall_fraction: fraction of cells that are walls
+        :param cliff_fraction: fraction of cells that are cliffs
+        :param seed: seed or random generator
+        :param kwargs: any other arguments (e.g. slip, or cost_function for ModifiedGridWorld)
+        :return: grid world
+        """  # noqa: E501
+        rng = np.random.default_rng(seed)
+        nrow, ncol = shape
+        start = kwargs.pop("start", (nrow - 1, 0))
+
+        cells = rng.permutation(
+            np.setdiff1d(np.arange(nrow * ncol), np.ravel_multi_index(start, shape))
+        )
+        num_walls = int(wall_fraction * nrow * ncol)
+        num_cliffs = int(cliff_fraction * nrow * ncol)
+        goals = cells[:num_goals]
+        walls = cells[num_goals : num_goals + num_walls]
+        cliffs = cells[num_goals + num_walls : num_goals + num_walls + num_cliffs]
+
+        is_wall = np.zeros(nrow * ncol, dtype=bool)
+        is_wall[walls] = True
+        is_open = ~is_wall
+        is_open[cliffs] = False
+
+        # moves are reversible, so cells can reach a goal if they are connected to one
+        labels, _ = ndimage.label(is_open.reshape(shape))
+        labels = labels.ravel()
+        reachable = np.isin(labels, labels[goals]) & is_open
+        if not reachable[np.ravel_multi_index(start, shape)]:
+            raise ValueError(
+                "No goal can be reached from the start, try fewer walls and cliffs "
+                "or another seed."
+            )
+        walls = np.flatnonzero(is_wall | (is_open & ~reachable))
+
+        def to_positions(states):
+            return list(zip(*(idx.tolist() for idx in np.unravel_index(states, shape))))
+
+        return cls(
+            shape=shape,
+            start=start,
+            goals=to_positions(goals),
+            walls=to_positions(walls),
+            cliffs=to_positions(cliffs),
+            **kwargs,
+        )
+
+
 class ModifiedVerySimpleGridWorld(
     ExactSolveMixin, VerySimpleGridWorld, RenderGridPolicyMixin
 ):
@@ -235,6 +422,31 @@ class ModifiedVerySimpleGridWorld(
         RenderGridPolicyMixin.__init__(self)
 
 
+class ModifiedGridWorld(ExactSolveMixin, GridWorld, RenderGridPolicyMixin):
+    def __init__(
+        self,
+        cost_function: Callable = None,
+        cost_kwargs: Dict[str, Any] = {},
+        **grid_kwargs,
+    ):
+        """
+        Grid world for planning algorithms.
+
+        :param cost_function: cost function constructor, e.g. distance_bonus
+        :param cost_kwargs: keyword arguments for cost function (env_shape should match shape)
+        :param grid_kwargs: GridWorld arguments, e.g. shape, goals, walls, cliffs or slip
+        """  # noqa: E501
+        GridWorld.__init__(self, **grid_kwargs)
+        # need exact solve mixin init
+        # second for initial states
+        if cost_function:
+            cost = cost_function(**cost_kwargs)
+        else:
+            cost = lambda old_state, action, curr_state, done: 0  # noqa: E731
+        ExactSolveMixin.__init__(self, cost=cost)
+        RenderGridPolicyMixin.__init__(self)
+
+
 class ModifiedCliffWalkingEnv(ExactSolveMixin, CliffWalkingEnv, RenderGridPolicyMixin):
     def __init__(
         self, cost_function: Callable = None, cost_kwargs: Dict[str, Any] = {}
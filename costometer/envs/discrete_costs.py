@@ -3,6 +3,36 @@ import numpy as np
 from scipy.spatial import distance
 
 
+def get_distance_costs(
+    distance_cost_weight=None,
+    positions_in_question=None,
+    env_shape=None,
+    distance_function=distance.euclidean,
+):
+    """
+    Precomputes the distance cost of being in each state of a grid environment
+
+    :param distance_cost_weight: cost weight for being further from the end position
+    :param positions_in_question: positions we bonus being close to (or far away from)
+    :param env_shape: needed for getting position in these discrete environments
+    :param distance_function: distance function to use
+    :return: array with the (negative) weighted distance of each state to the closest position in question
+    """  # noqa: E501
+    # positions in the same order as states, i.e. np.unravel_index(state, env_shape)
+    positions = np.indices(env_shape).reshape(len(env_shape), -1).T
+    # scipy's own distance functions are passed by name, so cdist uses its C version
+    if getattr(distance, distance_function.__name__, None) is distance_function:
+        metric = distance_function.__name__
+    else:
+        metric = distance_function
+    # called as distance_function(position_in_question, position), so asymmetric
+    # distance functions give the same costs as computing them state by state
+    distances = distance.cdist(
+        np.atleast_2d(positions_in_question), positions, metric=metric
+    )
+    return -np.min(distances, axis=0) * distance_cost_weight
+
+
 def distance_bonus(
     distance_cost_weight=None,
     positions_in_question=None,
@@ -12,26 +42,33 @@ def distance_bonus(
     """
     Constructs distance bonus cost function
 
+    Costs of every state are computed once, the cost function (and its vectorized attribute, which takes arrays of transitions) only looks them up.
+
     :param distance_cost_weight: cost weight for being further from the end position
     :param positions_in_question: positions we bonus being close to (or far away from)
     :param env_shape: needed for getting position in these discrete environments
     :param distance_function: distance function to use
     :return: cost function to use
-    """
+    """  # noqa: E501
+    state_costs = get_distance_costs(
+        distance_cost_weight=distance_cost_weight,
+        positions_in_question=positions_in_question,
+        env_shape=env_shape,
+        distance_function=distance_function,
+    )
 
     def cost_function(old_state, action, curr_state, done):
         if not done:
-            curr_position = np.unravel_index(curr_state, env_shape)
-            return (
-                -min(
-                    distance_function(position_in_question, curr_position)
-                    for position_in_question in positions_in_question
-                )
-                * distance_cost_weight
-            )
+            return state_costs[curr_state]
         else:
             return 0
 
+    def vectorized_cost_function(old_states, actions, curr_states, dones):
+        # terminal states can't index state_costs, their cost is 0 anyway
+        return np.where(dones, 0, state_costs[np.where(dones, 0, curr_states)])
+
+    cost_function.state_costs = state_costs
+    cost_function.vectorized = vectorized_cost_function
     return cost_function
 
 
@@ -44,30 +81,36 @@ def potential_distance_bonus(
     """
     Constructs distance bonus cost function
 
+    Costs of every state are computed once, the cost function (and its vectorized attribute, which takes arrays of transitions) only looks them up.
+
     :param distance_cost_weight: cost weight for being further from the end position
     :param positions_in_question: positions we bonus being close to (or far away from)
     :param env_shape: needed for getting position in these discrete environments
     :param distance_function: distance function to use
     :return: cost function to use
-    """
+    """  # noqa: E501
+    state_costs = get_distance_costs(
+        distance_cost_weight=distance_cost_weight,
+        positions_in_question=positions_in_question,
+        env_shape=env_shape,
+        distance_function=distance_function,
+    )
 
     def cost_function(old_state, action, curr_state, done):
         if not done:
-            curr_position = np.unravel_index(curr_state, env_shape)
-            old_position = np.unravel_index(old_state, env_shape)
-            return (
-                -min(
-                    distance_function(position_in_question, curr_position)
-                    for position_in_question in positions_in_question
-                )
-                * distance_cost_weight
-                + min(
-                    distance_function(position_in_question, old_position)
-                    for position_in_question in positions_in_question
-                )
-                * distance_cost_weight
-            )
+            return state_costs[curr_state] - state_costs[old_state]
         else:
             return 0
 
+    def vectorized_cost_function(old_states, actions, curr_states, dones):
+        # terminal states can't index state_costs, their cost is 0 anyway
+        return np.where(
+            dones,
+            0,
+            state_costs[np.where(dones, 0, curr_states)]
+            - state_costs[np.where(dones, 0, old_states)],
+        )
+
+    cost_function.state_costs = state_costs
+    cost_function.vectorized = vectorized_cost_function
     return cost_function
@@ -1,10 +1,105 @@
 """Modifies MouselabEnv so it works like the Open AI gym discrete environments."""
-import itertools
-from typing import Callable, Union
+from collections.abc import Mapping
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
 
 from mouselab.mouselab import MouselabEnv
 
 
+class MouselabTransitions(Mapping):
+    """
+    Lazy version of the Open AI gym discrete environments' P for a Mouselab environment.
+
+    Only states reachable from the initial state are enumerated (once, when first iterated over), and the transitions of a state are generated from the environment's results when it is looked up.
+    Transitions are in the gym format, P[state][action] = [(probability, next state, reward, done), ...], where the reward includes the environment's cost as in results.
+    """  # noqa: E501
+
+    def __init__(self, env: MouselabEnv, symmetry: Any = None):
+        """
+        Lazy transitions.
+
+        :param env: Mouselab environment with terminal_state
+        :param symmetry: if provided (e.g. a MouselabSymmetry), next states are replaced by their canonical representative
+        """  # noqa: E501
+        self.env = env
+        self.symmetry = symmetry
+        self._states = None
+
+    @property
+    def states(self) -> Dict[Any, None]:
+        """
+        States reachable from env.init, in the order they are found
+
+        :return: dictionary with states as keys, used as an ordered set
+        """
+        if self._states is None:
+            states = {self.env.init: None}
+            # states are added to the end of the dictionary as they are found,
+            # so this visits each reachable state once
+            frontier = [self.env.init]
+            while frontier:
+                next_frontier = []
+                for state in frontier:
+                    for next_state in self.get_next_states(state):
+                        if next_state not in states:
+                            states[next_state] = None
+                            next_frontier.append(next_state)
+                frontier = next_frontier
+            self._states = states
+        return self._states
+
+    def get_next_states(self, state: Any) -> List[Any]:
+        """
+        States that can follow a state, without computing rewards
+
+        :param state: current state
+        :return: list of next states
+        """
+        if state == self.env.terminal_state:
+            return []
+
+        next_states = []
+        for action in self.env.actions(state):
+            if action == self.env.term_action:
+                next_states.append(self.env.terminal_state)
+            else:
+                # clicking reveals one of the node's possible values
+                next_states.extend(
+                    state[:action] + (value,) + state[action + 1 :]
+                    for value in state[action].vals
+                )
+
+        if self.symmetry is not None:
+            next_states = [
+                self.symmetry.canonicalize(next_state)[0] for next_state in next_states
+            ]
+        return next_states
+
+    def __getitem__(
+        self, state: Any
+    ) -> Dict[int, List[Tuple[float, Any, float, bool]]]:
+        if state == self.env.terminal_state:
+            return {}
+        if not isinstance(state, tuple) or len(state) != len(self.env.init):
+            raise KeyError(state)
+
+        return {
+            action: [
+                (p, s1, r, s1 == self.env.terminal_state)
+                for p, s1, r in self.env.results(state, action)
+            ]
+            for action in self.env.actions(state)
+        }
+
+    def __contains__(self, state: Any) -> bool:
+        return state in self.states
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.states)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+
 class ModifiedMouseLabEnv(MouselabEnv):
     """This class adds the necessary variables for applying the planning_algorithms in the costometer package."""  # noqa: E501
 
@@ -15,6 +110,8 @@ class ModifiedMouseLabEnv(MouselabEnv):
         """
         Add variables to make the Mouselab environment mimic the Open AI gym discrete environments.
 
+        P is lazy (see MouselabTransitions), so states are only enumerated if a planning algorithm iterates over them.
+
         :param experiment_setting: experiment setting on the mouselab "registry"
         :param seed: random seed
         :param kwargs: any other MouseLabEnv arguments
@@ -24,11 +121,6 @@ class ModifiedMouseLabEnv(MouselabEnv):
             experiment_setting, seed=seed, **kwargs
         )
 
-        possibilities = [
-            node.vals + tuple([node]) if hasattr(node, "sample") else tuple([node])
-            for node in instance.init
-        ]
-        instance.P = {state: None for state in list(itertools.product(*possibilities))}
-        instance.P["__term_state__"] = None
         instance.terminal_state = "__term_state__"
+        instance.P = MouselabTransitions(instance)
         return instance
@@ -0,0 +1,163 @@
+"""Provides canonical representatives of Mouselab states under the symmetries of the tree, so symmetric states are only planned for once."""  # noqa: E501
+from typing import Any, Generator, List, Tuple, Union
+
+import numpy as np
+from mouselab.mouselab import MouselabEnv
+
+from costometer.envs.modified_mouselab import MouselabTransitions
+
+
+class MouselabSymmetry:
+    """
+    Maps Mouselab states to a canonical representative under the automorphisms of the tree.
+
+    Sibling subtrees are interchangeable if they have the same shape and the same initial distribution at each node (e.g. every sibling subtree in new_symmetric_registered environments).
+    The canonical state sorts interchangeable subtrees by their (partly) revealed values, so states that only differ by swapping them share one representative.
+    This assumes the environment's cost is also unchanged by swapping them (e.g. costs that depend on depth, but not on where nodes are displayed).
+    """  # noqa: E501
+
+    def __init__(self, tree: List[List[int]], init: Tuple[Any, ...]):
+        """
+        Mouselab symmetry.
+
+        :param tree: children of each node, as in MouselabEnv.tree
+        :param init: initial state, the distribution (or value) of each node
+        """
+        self.tree = tree
+        self.init = init
+
+        # node indices in depth-first order, following the order of children
+        self.preorder = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            self.preorder.append(node)
+            stack.extend(reversed(self.tree[node]))
+
+        # shape of subtree below each node, including initial distributions
+        shapes = {}
+        for node in reversed(self.preorder):
+            shapes[node] = (
+                self._get_initial_key(init[node]),
+                tuple(shapes[child] for child in self.tree[node]),
+            )
+
+        # for each node, children in groups of interchangeable subtrees
+        self.child_groups = []
+        for node in range(len(self.tree)):
+            groups = {}
+            for child in self.tree[node]:
+                groups.setdefault(shapes[child], []).append(child)
+            self.child_groups.append(list(groups.values()))
+
+    @staticmethod
+    def _get_initial_key(node: Any) -> Tuple[Any, ...]:
+        if hasattr(node, "sample"):
+            return ("distribution", tuple(node.vals), tuple(node.probs))
+        else:
+            return ("value", node)
+
+    def _canonicalize_subtree(
+        self, state: Tuple[Any, ...], node: int
+    ) -> Tuple[Tuple[Tuple[int, float], ...], List[int]]:
+        """
+        Canonical order of a subtree's nodes
+
+        :param state: Mouselab state
+        :param node: root of subtree
+        :return: sort key of subtree, and its nodes in the order they take in the canonical state
+        """  # noqa: E501
+        # unobserved nodes sort after observed ones
+        key = [(1, 0.0) if hasattr(state[node], "sample") else (0, state[node])]
+        nodes = [node]
+
+        slots = {}
+        for group in self.child_groups[node]:
+            for child, canonical_subtree in zip(
+                group,
+                sorted(self._canonicalize_subtree(state, member) for member in group),
+            ):
+                slots[child] = canonical_subtree
+
+        for child in self.tree[node]:
+            child_key, child_nodes = slots[child]
+            key.extend(child_key)
+            nodes.extend(child_nodes)
+        return tuple(key), nodes
+
+    def canonicalize(
+        self, state: Union[Tuple[Any, ...], str]
+    ) -> Tuple[Union[Tuple[Any, ...], str], Tuple[int, ...]]:
+        """
+        Get the canonical representative of a state
+
+        :param state: Mouselab state (the terminal state is returned as is)
+        :return: canonical state, and for each node of state the node it becomes in the canonical state (clicking node i in state is clicking node_map[i] in the canonical state)
+        """  # noqa: E501
+        if not isinstance(state, tuple):
+            return state, tuple(range(len(self.init)))
+
+        _, nodes = self._canonicalize_subtree(state, 0)
+        canonical_state = list(state)
+        node_map = [0] * len(state)
+        for position, node in zip(self.preorder, nodes):
+            canonical_state[position] = state[node]
+            node_map[node] = position
+        return tuple(canonical_state), tuple(node_map)
+
+    def canonicalize_many(
+        self, states: List[Any], num_actions: int
+    ) -> Tuple[List[Any], np.ndarray]:
+        """
+        Canonicalize states and get where each of their actions is in the canonical state
+
+        :param states: list of Mouselab states
+        :param num_actions: size of action space (number of nodes, plus the termination action)
+        :return: canonical states, and array of shape (number of states, number of actions) with the action in the canonical state for each action
+        """  # noqa: E501
+        canonical_states = []
+        action_maps = np.tile(np.arange(num_actions), (len(states), 1))
+        for state_idx, state in enumerate(states):
+            canonical_state, node_map = self.canonicalize(state)
+            canonical_states.append(canonical_state)
+            action_maps[state_idx, : len(node_map)] = node_map
+        return canonical_states, action_maps
+
+
+class CanonicalMouselabEnv:
+    """
+    View of a Mouselab environment where every state is canonical (see MouselabSymmetry), for planning algorithms.
+
+    The state space shrinks by the symmetry factor of the tree, and the Q values of any state can be found from those of its canonical state.
+    This is only for planning: states and actions are relabelled, so trajectories should be simulated in the original environment.
+    """  # noqa: E501
+
+    def __init__(self, env: MouselabEnv):
+        """
+        Canonical Mouselab environment.
+
+        :param env: Mouselab environment, e.g. from ModifiedMouseLabEnv.new_symmetric_registered
+        """  # noqa: E501
+        self.env = env
+        self.symmetry = MouselabSymmetry(env.tree, env.init)
+
+        self.init = self.symmetry.canonicalize(env.init)[0]
+        self.terminal_state = getattr(env, "terminal_state", "__term_state__")
+        self.term_action = env.term_action
+        self.P = MouselabTransitions(self, symmetry=self.symmetry)
+
+    def actions(self, state: Any) -> Generator[int, None, None]:
+        return self.env.actions(state)
+
+    def results(
+        self, state: Any, action: int
+    ) -> Generator[Tuple[float, Any, float], None, None]:
+        """
+        Results of an action, with canonical next states
+
+        :param state: canonical state
+        :param action: action
+        :return: all possible results in the form (probability, next_state, reward)
+        """
+        for p, s1, r in self.env.results(state, action):
+            yield p, self.symmetry.canonicalize(s1)[0], r
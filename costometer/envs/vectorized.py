@@ -0,0 +1,143 @@
+"""Provides a vectorized version of the modified discrete gym environments, stepping many copies at once."""  # noqa: E501
+from typing import Tuple, Union
+
+import numpy as np
+from gym.envs.toy_text.discrete import DiscreteEnv
+
+from costometer.planning_algorithms.compiled_mdp import CompiledMDP
+
+
+class VectorizedDiscreteEnv:
+    """
+    Steps many copies of a discrete environment with integer states (e.g. ModifiedCliffWalkingEnv) at once.
+
+    Transitions are compiled once (with the environment's cost, as in results), so each step samples every copy's next state with one search over cumulative transition probabilities.
+    States are the environment's integer states, with -1 for the terminal state.
+    Copies that have reached the terminal state stay there with a reward of 0 until reset.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        env: Union[DiscreteEnv, CompiledMDP],
+        num_envs: int,
+        seed: Union[int, np.random.Generator] = None,
+    ):
+        """
+        Vectorized environment.
+
+        :param env: discrete gym environment with P, actions, results and initial_states (e.g. with ExactSolveMixin), or compiled MDP (reset then needs initial states)
+        :param num_envs: number of copies to step
+        :param seed: seed or random generator, for reproducible simulations
+        """  # noqa: E501
+        if isinstance(env, CompiledMDP):
+            compiled_mdp = env
+            self.initial_states = None
+            self.initial_state_probabilities = None
+        else:
+            compiled_mdp = CompiledMDP.from_env(env)
+            self.initial_states = np.asarray(env.initial_states, dtype=np.int64)
+            self.initial_state_probabilities = np.asarray(
+                env.initial_state_probabilities, dtype=float
+            )
+
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+        self.num_actions = compiled_mdp.num_actions
+
+        # integer state of each state id, and state id of each integer state
+        self.state_labels = np.fromiter(
+            (
+                -1 if state == compiled_mdp.terminal_state else state
+                for state in compiled_mdp.interner.states
+            ),
+            dtype=np.int64,
+            count=compiled_mdp.num_states,
+        )
+        # one extra entry at the end, so the terminal state's -1 indexes it
+        self.label_ids = np.full(np.max(self.state_labels, initial=-1) + 2, -1)
+        self.label_ids[self.state_labels] = np.arange(compiled_mdp.num_states)
+
+        # state-action row of each (state id, action), -1 if not available
+        self.state_action_rows = np.full(
+            (compiled_mdp.num_states, self.num_actions), -1, dtype=np.int64
+        )
+        self.state_action_rows[
+            compiled_mdp.state_action_states, compiled_mdp.state_action_actions
+        ] = np.arange(compiled_mdp.num_state_actions)
+
+        # transitions are sorted by state-action row, cumulative probabilities
+        # are offset by the row so all rows can be searched at once
+        order = np.argsort(compiled_mdp.transition_state_actions, kind="stable")
+        transition_rows = compiled_mdp.transition_state_actions[order]
+        probabilities = compiled_mdp.transition_probabilities[order]
+        self.row_ends = np.searchsorted(
+            transition_rows, np.arange(compiled_mdp.num_state_actions), side="right"
+        )
+        row_starts = np.concatenate([[0], self.row_ends[:-1]])
+        cumulative_probabilities = np.cumsum(probabilities)
+        row_totals = np.concatenate([[0], cumulative_probabilities])[row_starts]
+        self.cumulative_probabilities = transition_rows + (
+            cumulative_probabilities - row_totals[transition_rows]
+        )
+        self.next_states = compiled_mdp.transition_next_states[order]
+        self.rewards = compiled_mdp.transition_rewards[order]
+        self.terminal_state_id = compiled_mdp.interner.get_id(
+            compiled_mdp.terminal_state
+        )
+
+        self.states = np.full(num_envs, self.terminal_state_id, dtype=np.int64)
+
+    @property
+    def dones(self) -> np.ndarray:
+        return self.states == self.terminal_state_id
+
+    def reset(self, initial_states: np.ndarray = None) -> np.ndarray:
+        """
+        Reset every copy to an initial state
+
+        :param initial_states: integer state for each copy, if None sampled from the environment's initial state distribution
+        :return: array of states
+        """  # noqa: E501
+        if initial_states is None:
+            if self.initial_states is None:
+                raise ValueError(
+                    "Initial states are needed for environments built from a "
+                    "compiled MDP."
+                )
+            initial_states = self.rng.choice(
+                self.initial_states,
+                size=self.num_envs,
+                p=self.initial_state_probabilities,
+            )
+
+        self.states = self.label_ids[np.asarray(initial_states, dtype=np.int64)]
+        return self.state_labels[self.states]
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Take one action in every copy
+
+        :param actions: action for each copy (ignored for copies that are done)
+        :return: next states, rewards and dones, each an array with one entry per copy
+        """  # noqa: E501
+        actions = np.broadcast_to(np.asarray(actions, dtype=np.int64), self.num_envs)
+        active = ~self.dones
+        rows = self.state_action_rows[self.states[active], actions[active]]
+        if np.any(rows < 0):
+            raise ValueError(f"{np.sum(rows < 0)} action(s) are not available.")
+
+        # first transition whose cumulative probability is above a uniform sample,
+        # the minimum guards against probabilities summing to slightly under 1
+        transitions = np.minimum(
+            np.searchsorted(
+                self.cumulative_probabilities,
+                rows + self.rng.random(len(rows)),
+                side="right",
+            ),
+            self.row_ends[rows] - 1,
+        )
+
+        rewards = np.zeros(self.num_envs)
+        rewards[active] = self.rewards[transitions]
+        self.states[active] = self.next_states[transitions]
+        return self.state_labels[self.states], rewards, self.dones
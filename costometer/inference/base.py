@@ -1,23 +1,37 @@
 """Base inference class."""
 from copy import deepcopy
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Union
 
 import pandas as pd
 
-from costometer.utils import traces_to_df
+from costometer.agents.compiled_traces import CompiledTraces
+from costometer.utils import TraceShards, traces_to_df
 
 
 class BaseInference:
     """Base inference class"""
 
-    def __init__(self, traces: List[Dict[str, List]]):
+    def __init__(
+        self, traces: Union[List[Dict[str, List]], CompiledTraces, TraceShards]
+    ):
         """
 
-        :param traces: the traces for which we are inferring parameters, each a dictionary with at least "actions" and "states" as fields
+        :param traces: the traces for which we are inferring parameters, each a dictionary with at least "actions" and "states" as fields (or compiled traces, or trace shards)
         """  # noqa: E501
         # save inputs
         self.traces = traces
 
+    def get_traces(self) -> List[Dict[str, List]]:
+        """
+        Copy of traces as list of dictionaries, compiled traces (and trace shards) are converted back
+
+        :return: list of traces
+        """  # noqa: E501
+        if isinstance(self.traces, (CompiledTraces, TraceShards)):
+            return self.traces.to_traces()
+        else:
+            return deepcopy(self.traces)
+
     def run(self) -> None:
         """
         Finds best parameters
@@ -41,7 +55,7 @@ class BaseInference:
 
         :return: dataframe of length actions * learners
         """  # noqa: E501
-        traces = deepcopy(self.traces)
+        traces = self.get_traces()
         trace_df = traces_to_df(traces)
 
         return trace_df
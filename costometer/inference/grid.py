@@ -1,16 +1,16 @@
 """Grid inference class"""
 import itertools
-from copy import deepcopy
-from typing import Any, Callable, Dict, List, Type
+from typing import Any, Callable, Dict, List, Type, Union
 
 import numpy as np
 import pandas as pd
 from mouselab.distributions import Categorical
 from tqdm import tqdm
 
+from costometer.agents.compiled_traces import CompiledTraces
 from costometer.agents.vanilla import Participant
 from costometer.inference.base import BaseInference
-from costometer.utils import get_param_string, load_q_file, traces_to_df
+from costometer.utils import QFileCache, TraceShards, traces_to_df
 
 
 class GridInference(BaseInference):
@@ -18,13 +18,15 @@ class GridInference(BaseInference):
 
     def __init__(
         self,
-        traces: List[Dict[str, List]],
+        traces: Union[List[Dict[str, List]], CompiledTraces, TraceShards],
         participant_class: Type[Participant],
         participant_kwargs: Dict[str, Any],
         cost_function: Callable,
         cost_parameters: Dict[str, Categorical],
         held_constant_policy_kwargs: Dict[str, Categorical] = None,
         policy_parameters: Dict[str, Categorical] = None,
+        batch_temperatures: bool = False,
+        q_cache_bytes: int = None,
     ):
         """
         Grid inference class.
@@ -36,7 +38,9 @@ class GridInference(BaseInference):
         :param cost_parameters:
         :param held_constant_policy_kwargs:
         :param policy_parameters:
-        """
+        :param batch_temperatures: whether to evaluate all temperatures ("temp" in policy_parameters) at once for each other setting, only for softmax policies
+        :param q_cache_bytes: budget in bytes for the memory used by loaded Q values (if "q_path" is in held_constant_policy_kwargs, see QFileCache), least recently used Q files are evicted beyond it
+        """  # noqa: E501
         super().__init__(traces)
 
         self.participant_class = participant_class
@@ -54,6 +58,12 @@ class GridInference(BaseInference):
         else:
             self.policy_parameters = policy_parameters
 
+        self.batch_temperatures = batch_temperatures
+        if self.batch_temperatures and "temp" not in self.policy_parameters:
+            raise ValueError(
+                "Temperatures can only be batched if temp is a policy parameter."
+            )
+
         self.optimization_results = None
 
         self.prior_probability_dict = {
@@ -69,92 +79,129 @@ class GridInference(BaseInference):
         self.optimization_space = self.get_optimization_space()
 
         if "q_path" in self.held_constant_policy_kwargs:
-            all_cost_kwargs = [
-                dict(zip(self.cost_parameters.keys(), curr_val))
-                for curr_val in itertools.product(
-                    *[val.vals for val in self.cost_parameters.values()]
-                )
-            ]
-
-            self.q_files = {
-                get_param_string(cost_kwargs): load_q_file(
-                    self.participant_kwargs["experiment_setting"],
-                    self.cost_function,
-                    cost_kwargs,
-                    self.held_constant_policy_kwargs["q_path"],
-                )
-                for cost_kwargs in all_cost_kwargs
-            }
+            # Q files are loaded on first use
+            self.q_files = QFileCache(
+                self.participant_kwargs["experiment_setting"],
+                self.cost_function,
+                self.held_constant_policy_kwargs["q_path"],
+                max_bytes=q_cache_bytes,
+            )
 
-    def function_to_optimize(self, config, traces, optimize=True):
+    def get_participant(self, config, traces):
         """
 
         :param config:
         :param traces:
-        :param optimize:
         :return:
         """
-
-        policy_kwargs = {key: config[key] for key in self.policy_parameters.keys()}
+        policy_kwargs = {
+            key: config[key] for key in self.policy_parameters.keys() if key in config
+        }
         cost_kwargs = {key: config[key] for key in self.cost_parameters.keys()}
 
         for key in self.held_constant_policy_kwargs.keys():
             if key == "q_path":
-                policy_kwargs["preference"] = self.q_files[
-                    get_param_string(cost_kwargs)
-                ]
+                policy_kwargs["preference"] = self.q_files[cost_kwargs]
             else:
                 policy_kwargs[key] = self.held_constant_policy_kwargs[key]
 
+        if isinstance(traces, CompiledTraces):
+            num_trials = traces.max_num_trials
+        else:
+            num_trials = max([len(trace["actions"]) for trace in traces])
+
         participant = self.participant_class(
             **self.participant_kwargs,
-            num_trials=max([len(trace["actions"]) for trace in traces]),
+            num_trials=num_trials,
             cost_function=self.cost_function,
             cost_kwargs=cost_kwargs,
             policy_kwargs=policy_kwargs,
         )
+        return participant
 
-        result = []
-        for trace in traces:
-            participant_likelihood = participant.compute_likelihood(trace)
+    def get_result(self, trace, trial_mles, config):
+        """
+
+        :param trace:
+        :param trial_mles:
+        :param config:
+        :return:
+        """
+        mle = np.sum(trial_mles)
+        map_val = mle + np.sum(
+            [
+                np.log(prior_dict[config[param]])
+                for param, prior_dict in self.prior_probability_dict.items()
+            ]
+        )
 
+        # save mles for blocks (if they exist)
+        block_mles = {}
+        if "block" in trace:
+            block_indices = {
+                block: [curr_block == block for curr_block in trace["block"]]
+                for block in np.unique(trace["block"])
+            }
+            block_mles = {
+                f"{block}_mle": np.sum(trial_mles[block_indices[block]])
+                for block in block_indices.keys()
+            }
+        # simulated trace, save info used to simulate data
+        trace_info = {key: trace[key] for key in trace.keys() if "sim_" in key}
+        return {
+            "loss": -mle,
+            "map": map_val,
+            "mle": mle,
+            "trace_pid": trace["pid"][0],
+            **block_mles,
+            **trace_info,
+            **config,
+        }
+
+    def function_to_optimize(self, config, traces, optimize=True):
+        """
+
+        :param config:
+        :param traces:
+        :param optimize:
+        :return:
+        """
+        participant = self.get_participant(config, traces)
+
+        result = []
+        for trace, participant_likelihood in zip(
+            traces, participant.compute_batch_likelihood(traces)
+        ):
             if optimize is True:
                 # sum over actions in trial, then trials
                 trial_mles = np.fromiter(map(sum, participant_likelihood), dtype=float)
-                mle = np.sum(trial_mles)
-                map_val = mle + np.sum(
-                    [
-                        np.log(prior_dict[config[param]])
-                        for param, prior_dict in self.prior_probability_dict.items()
-                    ]
-                )
+                result.append(self.get_result(trace, trial_mles, config))
+            else:
+                result.append(participant_likelihood)
+        return result
 
-                # save mles for blocks (if they exist)
-                block_mles = {}
-                if "block" in trace:
-                    block_indices = {
-                        block: [curr_block == block for curr_block in trace["block"]]
-                        for block in np.unique(trace["block"])
-                    }
-                    block_mles = {
-                        f"{block}_mle": np.sum(trial_mles[block_indices[block]])
-                        for block in block_indices.keys()
-                    }
-                # simulated trace, save info used to simulate data
-                trace_info = {key: trace[key] for key in trace.keys() if "sim_" in key}
+    def function_to_optimize_over_temperatures(self, config, traces):
+        """
+        Same as function_to_optimize, but for all temperatures at once
+
+        :param config: all parameters except temp
+        :param traces:
+        :return:
+        """
+        temps = list(self.policy_parameters["temp"].vals)
+        participant = self.get_participant(config, traces)
+
+        result = []
+        # each has shape (trials, temperatures)
+        for trace, trial_mles in zip(
+            traces, participant.compute_temperature_likelihoods(traces, temps)
+        ):
+            for temp_idx, temp in enumerate(temps):
                 result.append(
-                    {
-                        "loss": -mle,
-                        "map": map_val,
-                        "mle": mle,
-                        "trace_pid": trace["pid"][0],
-                        **block_mles,
-                        **trace_info,
-                        **config,
-                    }
+                    self.get_result(
+                        trace, trial_mles[:, temp_idx], {**config, "temp": temp}
+                    )
                 )
-            else:
-                result.append(participant_likelihood)
         return result
 
     def get_optimization_space(self):
@@ -162,12 +209,14 @@ class GridInference(BaseInference):
 
         :return:
         """
+        parameters = {**self.policy_parameters, **self.cost_parameters}
+        # all temperatures are evaluated in each function call instead
+        if self.batch_temperatures:
+            del parameters["temp"]
+
         possible_parameters = [
             [{cost_parameter: val} for val in cost_prior.vals]
-            for cost_parameter, cost_prior in {
-                **self.policy_parameters,
-                **self.cost_parameters,
-            }.items()
+            for cost_parameter, cost_prior in parameters.items()
         ]
         config_dicts = list(itertools.product(*possible_parameters))
 
@@ -179,6 +228,14 @@ class GridInference(BaseInference):
                 curr_params = {**curr_params, **param}
             search_space.append(curr_params)
 
+        # group configs by cost setting, so each Q file is only loaded once
+        search_space = sorted(
+            search_space,
+            key=lambda config: [
+                list(cost_prior.vals).index(config[cost_parameter])
+                for cost_parameter, cost_prior in self.cost_parameters.items()
+            ],
+        )
         return search_space
 
     def run(self):
@@ -187,10 +244,41 @@ class GridInference(BaseInference):
         :return:
         """
         self.optimization_results = []
-        for config in tqdm(self.optimization_space):
-            self.optimization_results.extend(
-                self.function_to_optimize(config, traces=self.traces)
+        # configs are grouped by cost setting (see get_optimization_space), each
+        # group's Q file is scored against every trace shard before moving on, so
+        # Q files are loaded once and only one shard is in memory at a time
+        cost_groups = [
+            list(configs)
+            for _, configs in itertools.groupby(
+                self.optimization_space,
+                key=lambda config: [config[key] for key in self.cost_parameters],
             )
+        ]
+        if isinstance(self.traces, TraceShards):
+            num_batches = self.traces.num_shards
+        else:
+            num_batches = 1
+
+        with tqdm(total=len(self.optimization_space) * num_batches) as pbar:
+            for configs in cost_groups:
+                if isinstance(self.traces, TraceShards):
+                    trace_batches = self.traces.iter_shards()
+                else:
+                    trace_batches = [self.traces]
+
+                for traces in trace_batches:
+                    for config in configs:
+                        if self.batch_temperatures:
+                            self.optimization_results.extend(
+                                self.function_to_optimize_over_temperatures(
+                                    config, traces=traces
+                                )
+                            )
+                        else:
+                            self.optimization_results.extend(
+                                self.function_to_optimize(config, traces=traces)
+                            )
+                        pbar.update()
 
     def get_best_parameters(self):
         """
@@ -229,7 +317,7 @@ class GridInference(BaseInference):
 
         :return:
         """
-        traces = deepcopy(self.traces)
+        traces = self.get_traces()
         for best_params, trace in zip(self.get_best_parameters(), traces):
             trace["pi"] = self.function_to_optimize(
                 best_params, traces=[trace], optimize=False
@@ -1,8 +1,8 @@
 """Optimization with ray[tune]."""
 import itertools
 import logging
-from copy import deepcopy
-from typing import Any, Callable, Dict, List, Type
+from copy import copy
+from typing import Any, Callable, Dict, List, Type, Union
 
 import numpy as np
 import pandas as pd
@@ -10,9 +10,16 @@ import ray
 from mouselab.distributions import Categorical
 from ray import tune
 
+from costometer.agents.compiled_traces import CompiledTraces
 from costometer.agents.vanilla import Participant
 from costometer.inference.base import BaseInference
-from costometer.utils import get_param_string, load_q_file, traces_to_df
+from costometer.utils import (
+    QFileCache,
+    get_param_string,
+    get_q_values_bytes,
+    load_q_file,
+    traces_to_df,
+)
 
 
 class BaseRayInference(BaseInference):
@@ -20,7 +27,7 @@ class BaseRayInference(BaseInference):
 
     def __init__(
         self,
-        traces: List[Dict[str, List]],
+        traces: Union[List[Dict[str, List]], CompiledTraces],
         participant_class: Type[Participant],
         participant_kwargs: Dict[str, Any],
         cost_function: Callable,
@@ -103,7 +110,7 @@ class BaseRayInference(BaseInference):
 
         :return:
         """
-        traces = deepcopy(self.traces)
+        traces = self.get_traces()
         for best_params, trace in zip(self.get_best_parameters(), traces):
             trace["pi"] = self.function_to_optimize(best_params, trace, optimize=False)
         trace_df = traces_to_df(traces)
@@ -128,7 +135,7 @@ class GridRayInference(BaseRayInference):
 
     def __init__(
         self,
-        traces: List[Dict[str, List]],
+        traces: Union[List[Dict[str, List]], CompiledTraces],
         participant_class: Type[Participant],
         participant_kwargs: Dict[str, Any],
         cost_function: Callable,
@@ -137,6 +144,7 @@ class GridRayInference(BaseRayInference):
         policy_parameters: Dict[str, Categorical] = None,
         local_mode: bool = False,
         optimization_settings: Dict[str, Any] = None,
+        q_cache_bytes: int = None,
     ):
         """
 
@@ -149,7 +157,8 @@ class GridRayInference(BaseRayInference):
         :param policy_parameters:
         :param local_mode:
         :param optimization_settings:
-        """
+        :param q_cache_bytes: budget in bytes for the memory used by loaded Q values (if "q_path" is in held_constant_policy_kwargs, see QFileCache), least recently used Q files are evicted beyond it, also limits the Q tables put in the Ray object store at once (see put_q_table_groups)
+        """  # noqa: E501
         super().__init__(
             traces,
             participant_class,
@@ -175,55 +184,56 @@ class GridRayInference(BaseRayInference):
         self.optimization_space = self.get_optimization_space()
 
         if "q_path" in self.held_constant_policy_kwargs:
-            all_cost_kwargs = [
-                dict(zip(self.cost_parameters.keys(), curr_val))
-                for curr_val in itertools.product(
-                    *[val.vals for val in self.cost_parameters.values()]
-                )
-            ]
-
-            self.q_files = {
-                get_param_string(cost_kwargs): load_q_file(
-                    self.participant_kwargs["experiment_setting"],
-                    self.cost_function,
-                    cost_kwargs,
-                    self.held_constant_policy_kwargs["q_path"],
-                )
-                for cost_kwargs in all_cost_kwargs
-            }
-
-    def function_to_optimize(self, config, traces, optimize=True):
+            # Q files are loaded on first use
+            self.q_files = QFileCache(
+                self.participant_kwargs["experiment_setting"],
+                self.cost_function,
+                self.held_constant_policy_kwargs["q_path"],
+                max_bytes=q_cache_bytes,
+            )
+
+    def function_to_optimize(self, config, traces, optimize=True, q_refs=None):
         """
 
         :param config:
         :param traces:
         :param optimize:
+        :param q_refs: Ray object references to Q tables, by parameter string (see put_q_table_groups), if None Q files are loaded from q_path
         :return:
-        """
+        """  # noqa: E501
 
         policy_kwargs = {key: config[key] for key in self.policy_parameters.keys()}
         cost_kwargs = {key: config[key] for key in self.cost_parameters.keys()}
 
         for key in self.held_constant_policy_kwargs.keys():
             if key == "q_path":
-                policy_kwargs["preference"] = self.q_files[
-                    get_param_string(cost_kwargs)
-                ]
+                if q_refs is not None:
+                    # Q values arrays are read from the object store without copying
+                    policy_kwargs["preference"] = ray.get(
+                        q_refs[get_param_string(cost_kwargs)]
+                    )
+                else:
+                    policy_kwargs["preference"] = self.q_files[cost_kwargs]
             else:
                 policy_kwargs[key] = self.held_constant_policy_kwargs[key]
 
+        if isinstance(traces, CompiledTraces):
+            num_trials = traces.max_num_trials
+        else:
+            num_trials = max([len(trace["actions"]) for trace in traces])
+
         participant = self.participant_class(
             **self.participant_kwargs,
-            num_trials=max([len(trace["actions"]) for trace in traces]),
+            num_trials=num_trials,
             cost_function=self.cost_function,
             cost_kwargs=cost_kwargs,
             policy_kwargs=policy_kwargs,
         )
 
         result = []
-        for trace in traces:
-            participant_likelihood = participant.compute_likelihood(trace)
-
+        for trace, participant_likelihood in zip(
+            traces, participant.compute_batch_likelihood(traces)
+        ):
             if optimize is True:
                 # sum over actions in trial, then trials
                 trial_mles = np.fromiter(map(sum, participant_likelihood), dtype=float)
@@ -292,20 +302,91 @@ class GridRayInference(BaseRayInference):
         :return:
         """
         ray.init(logging_level=logging.ERROR, local_mode=self.local_mode)
-        opt_results = tune.run(
-            lambda config: self.function_to_optimize(config, traces=self.traces),
-            config=self.optimization_space,
-            metric="map_val",
-            mode="max",
-            **self.optimization_settings,
-        )
-        self.optimization_results = [
-            item
-            for opt_result in opt_results.results.values()
-            for item in opt_result["result"]
-        ]
+
+        # traces are put in the object store once, trials only receive references
+        # instead of a copy of this object
+        trial_inference = copy(self)
+        trial_inference.traces = None
+        trial_inference.q_files = None
+        traces_ref = ray.put(self.traces)
+
+        policy_search_space = {
+            policy_parameter: tune.grid_search(list(policy_prior.vals))
+            for policy_parameter, policy_prior in self.policy_parameters.items()
+        }
+
+        self.optimization_results = []
+        # only one group of Q tables is in the object store at a time
+        for cost_group, q_refs in self.put_q_table_groups():
+            opt_results = tune.run(
+                tune.with_parameters(
+                    _run_trial,
+                    inference=trial_inference,
+                    object_refs={"traces": traces_ref, "q_tables": q_refs},
+                ),
+                config={
+                    **policy_search_space,
+                    "cost_kwargs": tune.grid_search(cost_group),
+                },
+                metric="map_val",
+                mode="max",
+                **self.optimization_settings,
+            )
+            self.optimization_results.extend(
+                item
+                for opt_result in opt_results.results.values()
+                for item in opt_result["result"]
+            )
+            # released from the object store once no trial refers to them
+            del q_refs
         ray.shutdown()
 
+    def put_q_table_groups(self):
+        """
+        Put Q tables for all cost settings in the Ray object store, loading one at a time, in groups whose Q tables fit within q_cache_bytes (see get_q_values_bytes)
+
+        Q tables are put with an EncodedStateInterner, so trials read their arrays without deserializing a dictionary of all states.
+
+        :return: generator of cost groups (lists of cost parameters), each with Ray object references to its Q tables by parameter string (None if Q values are not needed)
+        """  # noqa: E501
+        all_cost_kwargs = [
+            dict(zip(self.cost_parameters.keys(), curr_val))
+            for curr_val in itertools.product(
+                *[val.vals for val in self.cost_parameters.values()]
+            )
+        ]
+        if "q_path" not in self.held_constant_policy_kwargs:
+            yield all_cost_kwargs, None
+            return
+
+        cost_group = []
+        q_refs = {}
+        group_bytes = 0
+        for cost_kwargs in all_cost_kwargs:
+            q_table = load_q_file(
+                self.participant_kwargs["experiment_setting"],
+                self.cost_function,
+                cost_kwargs,
+                self.held_constant_policy_kwargs["q_path"],
+                q_table=True,
+            ).to_encoded_q_table()
+            q_table_bytes = get_q_values_bytes(q_table)
+            # as in QFileCache, a Q table larger than the budget still gets a group
+            if (
+                len(cost_group) > 0
+                and self.q_files.max_bytes is not None
+                and group_bytes + q_table_bytes > self.q_files.max_bytes
+            ):
+                yield cost_group, q_refs
+                cost_group = []
+                q_refs = {}
+                group_bytes = 0
+
+            cost_group.append(cost_kwargs)
+            q_refs[get_param_string(cost_kwargs)] = ray.put(q_table)
+            group_bytes += q_table_bytes
+        yield cost_group, q_refs
+
     def get_best_parameters(self):
         """
 
@@ -343,7 +424,7 @@ class GridRayInference(BaseRayInference):
 
         :return:
         """
-        traces = deepcopy(self.traces)
+        traces = self.get_traces()
         for best_params, trace in zip(self.get_best_parameters(), traces):
             trace["pi"] = self.function_to_optimize(
                 best_params, traces=[trace], optimize=False
@@ -357,3 +438,23 @@ class GridRayInference(BaseRayInference):
         :return:
         """
         return pd.DataFrame(self.optimization_results)
+
+
+def _run_trial(config, inference=None, object_refs=None):
+    """
+    Ray Tune trainable for GridRayInference, arguments other than config are passed through tune.with_parameters
+
+    :param config: parameters for trial, with cost parameters under "cost_kwargs"
+    :param inference: GridRayInference object without traces or Q files
+    :param object_refs: Ray object references to traces ("traces") and to Q tables by parameter string ("q_tables", see put_q_table_groups)
+    :return: result of GridRayInference.function_to_optimize
+    """  # noqa: E501
+    config = {
+        **{key: val for key, val in config.items() if key != "cost_kwargs"},
+        **config["cost_kwargs"],
+    }
+    return inference.function_to_optimize(
+        config,
+        traces=ray.get(object_refs["traces"]),
+        q_refs=object_refs["q_tables"],
+    )
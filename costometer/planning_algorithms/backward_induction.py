@@ -0,0 +1,184 @@
+"""Provides backward induction for acyclic environments, such as Mouselab, where clicks only reveal nodes."""  # noqa: E501
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+
+from costometer.envs.modified_mouselab import ModifiedMouseLabEnv
+from costometer.planning_algorithms.compiled_mdp import CompiledMDP
+from costometer.planning_algorithms.q_table import StateInterner
+
+
+def explore_reachable_states(
+    env: ModifiedMouseLabEnv, verbose: bool = False
+) -> Tuple[CompiledMDP, List[int]]:
+    """
+    Compile the states reachable from the initial states, ordered in layers so every transition leads to a later layer
+
+    Each state is only expanded once, however many paths lead to it.
+
+    :param env: acyclic environment with init (or initial_states), actions and results (e.g. ModifiedMouseLabEnv)
+    :param verbose: whether to print the number of states in each layer
+    :return: compiled MDP (state ids ordered by layer) and the first state id of each layer, plus the number of states
+    """  # noqa: E501
+    terminal_state = getattr(env, "terminal_state", "__term_state__")
+
+    if hasattr(env, "initial_states"):
+        interner = StateInterner(env.initial_states)
+    else:
+        interner = StateInterner([env.init])
+
+    state_action_states = []
+    state_action_actions = []
+    transition_state_actions = []
+    transition_next_states = []
+    transition_probabilities = []
+    transition_rewards = []
+
+    # states are expanded in the order they are found
+    state_id = 0
+    while state_id < len(interner):
+        state = interner[state_id]
+        if state != terminal_state:
+            for action in env.actions(state):
+                state_action_idx = len(state_action_states)
+                state_action_states.append(state_id)
+                state_action_actions.append(action)
+                for p, s1, r in env.results(state, action):
+                    transition_state_actions.append(state_action_idx)
+                    transition_next_states.append(interner.intern(s1))
+                    transition_probabilities.append(p)
+                    transition_rewards.append(r)
+        state_id += 1
+
+    state_action_states = np.asarray(state_action_states, dtype=np.int64)
+    transition_next_states = np.asarray(transition_next_states, dtype=np.int64)
+    transition_state_actions = np.asarray(transition_state_actions, dtype=np.int64)
+
+    # layer of each state is its longest path from an initial state (Kahn's algorithm)
+    edges = np.unique(
+        np.stack(
+            [state_action_states[transition_state_actions], transition_next_states]
+        ),
+        axis=1,
+    )
+    num_parents = np.bincount(edges[1], minlength=len(interner))
+    state_layers = np.full(len(interner), -1)
+    frontier = num_parents == 0
+    layer = 0
+    while np.any(frontier):
+        state_layers[frontier] = layer
+        np.subtract.at(num_parents, edges[1][frontier[edges[0]]], 1)
+        frontier = (num_parents == 0) & (state_layers < 0)
+        layer += 1
+    if np.any(state_layers < 0):
+        raise ValueError(
+            "Backward induction needs an acyclic environment, "
+            f"{np.sum(state_layers < 0)} states are on or after a cycle."
+        )
+
+    # order state ids by layer (stable, so state-action rows stay sorted by state)
+    order = np.argsort(state_layers, kind="stable")
+    new_ids = np.empty_like(order)
+    new_ids[order] = np.arange(len(order))
+
+    state_action_states = new_ids[state_action_states]
+    state_action_order = np.argsort(state_action_states, kind="stable")
+    new_state_action_ids = np.empty_like(state_action_order)
+    new_state_action_ids[state_action_order] = np.arange(len(state_action_order))
+
+    compiled_mdp = CompiledMDP(
+        interner=StateInterner(interner[state_id] for state_id in order.tolist()),
+        state_action_states=state_action_states[state_action_order],
+        state_action_actions=np.asarray(state_action_actions, dtype=np.int64)[
+            state_action_order
+        ],
+        transition_state_actions=new_state_action_ids[transition_state_actions],
+        transition_next_states=new_ids[transition_next_states],
+        transition_probabilities=np.asarray(transition_probabilities, dtype=float),
+        transition_rewards=np.asarray(transition_rewards, dtype=float),
+        terminal_state=terminal_state,
+    )
+    layer_offsets = np.searchsorted(
+        state_layers[order], np.arange(np.max(state_layers) + 2)
+    ).tolist()
+
+    if verbose:
+        for layer, (layer_start, layer_end) in enumerate(
+            zip(layer_offsets[:-1], layer_offsets[1:])
+        ):
+            print(f"Layer {layer}: {layer_end - layer_start} states")
+    return compiled_mdp, layer_offsets
+
+
+def backward_induction(
+    env: ModifiedMouseLabEnv,
+    gamma: float = 1.0,
+    verbose: bool = False,
+) -> Tuple[
+    Dict[Any, Dict[int, Union[int, float]]],
+    Dict[Any, float],
+    Dict[Any, int],
+    Dict[str, Any],
+]:
+    """
+    Solve an acyclic environment exactly, exploring only states reachable from the initial states and processing them from the last layer back.
+
+    Each layer is solved with one vectorized backup, since the states it leads to are all in later layers.
+
+    :param env: acyclic environment with init (or initial_states), actions and results (e.g. ModifiedMouseLabEnv)
+    :param gamma: discount factor
+    :param verbose: whether to print progress for each layer
+    :return: Q, V, pi (same format as value_iteration, for reachable states), info (number of states, layer sizes and timings)
+    """  # noqa: E501
+    start_time = time.perf_counter()
+    compiled_mdp, layer_offsets = explore_reachable_states(env, verbose=verbose)
+    explore_time = time.perf_counter() - start_time
+
+    # state-action rows of each layer
+    state_action_offsets = np.searchsorted(
+        compiled_mdp.state_action_states, layer_offsets
+    )
+
+    V = np.zeros(compiled_mdp.num_states)
+    Q = np.zeros(compiled_mdp.num_state_actions)
+    for layer in reversed(range(len(layer_offsets) - 1)):
+        layer_start_time = time.perf_counter()
+        state_start, state_end = layer_offsets[layer], layer_offsets[layer + 1]
+        row_start, row_end = (
+            state_action_offsets[layer],
+            state_action_offsets[layer + 1],
+        )
+        if row_start == row_end:
+            continue
+
+        Q[row_start:row_end] = compiled_mdp.rewards[row_start:row_end] + gamma * (
+            compiled_mdp.transitions[row_start:row_end] @ V
+        )
+
+        # states in layer with actions, and where their rows start
+        layer_action_states, layer_action_offsets = np.unique(
+            compiled_mdp.state_action_states[row_start:row_end], return_index=True
+        )
+        V[layer_action_states] = np.maximum.reduceat(
+            Q[row_start:row_end], layer_action_offsets
+        )
+
+        if verbose:
+            print(
+                f"Layer {layer}: {state_end - state_start} states solved in "
+                f"{time.perf_counter() - layer_start_time:.2f}s"
+            )
+
+    Q, V, pi = compiled_mdp.to_nested(Q, V)
+    return (
+        Q,
+        V,
+        pi,
+        {
+            "num_states": compiled_mdp.num_states,
+            "layer_sizes": np.diff(layer_offsets).tolist(),
+            "explore_time": explore_time,
+            "solve_time": time.perf_counter() - start_time - explore_time,
+        },
+    )
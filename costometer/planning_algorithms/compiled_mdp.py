@@ -0,0 +1,315 @@
+"""Provides a compiled, array-based version of a discrete environment's transitions and rewards for vectorized planning."""  # noqa: E501
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from costometer.planning_algorithms.q_table import QTable, StateInterner
+
+
+class CompiledMDP:
+    """
+    Transitions of a discrete environment stored as arrays, with one row for each available (state, action) pair.
+
+    The transition matrix (CSR, of shape (number of state-action pairs, number of states)) and the expected reward of each state-action pair are built once, so Bellman backups are a sparse matrix product.
+    State-action rows are ordered by state, and within a state by the order of env.actions(state).
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        interner: StateInterner,
+        state_action_states: np.ndarray,
+        state_action_actions: np.ndarray,
+        transition_state_actions: np.ndarray,
+        transition_next_states: np.ndarray,
+        transition_probabilities: np.ndarray,
+        transition_rewards: np.ndarray,
+        transition_dones: np.ndarray = None,
+        terminal_state: Any = None,
+    ):
+        """
+        Compiled MDP, usually made with CompiledMDP.from_env.
+
+        :param interner: state interner, state ids are columns of the transition matrix
+        :param state_action_states: state id of each state-action row (sorted)
+        :param state_action_actions: action of each state-action row
+        :param transition_state_actions: state-action row of each transition
+        :param transition_next_states: next state id of each transition
+        :param transition_probabilities: probability of each transition
+        :param transition_rewards: reward (including cost, unless compiled with include_cost=False) of each transition
+        :param transition_dones: done flag of each transition (only if compiled with include_cost=False)
+        :param terminal_state: terminal state, which has no policy
+        """  # noqa: E501
+        self.interner = interner
+        self.state_action_states = state_action_states
+        self.state_action_actions = state_action_actions
+        self.transition_state_actions = transition_state_actions
+        self.transition_next_states = transition_next_states
+        self.transition_probabilities = transition_probabilities
+        self.transition_rewards = transition_rewards
+        self.transition_dones = transition_dones
+        self.terminal_state = terminal_state
+
+        self.transitions = csr_matrix(
+            (
+                transition_probabilities,
+                (transition_state_actions, transition_next_states),
+            ),
+            shape=(self.num_state_actions, self.num_states),
+        )
+        self.rewards = self.get_expected_rewards(transition_rewards)
+
+        # states with at least one action, and where their state-action rows start
+        self.action_states, self.action_offsets = np.unique(
+            state_action_states, return_index=True
+        )
+
+    @classmethod
+    def from_env(cls, discrete_environment, include_cost: bool = True) -> "CompiledMDP":
+        """
+        Compile a discrete environment with P, actions and results (e.g. with ExactSolveMixin, or ModifiedMouseLabEnv)
+
+        :param discrete_environment: discrete gym environment
+        :param include_cost: whether to include the environment's cost in rewards (via results), if False rewards and done flags are read from P, so other costs can be added with get_transition_costs
+        :return: compiled MDP
+        """  # noqa: E501
+        interner = StateInterner(discrete_environment.P.keys())
+
+        state_action_states = []
+        state_action_actions = []
+        transition_state_actions = []
+        transition_next_states = []
+        transition_probabilities = []
+        transition_rewards = []
+        transition_dones = []
+        for state in discrete_environment.P.keys():
+            state_id = interner.intern(state)
+            for action in discrete_environment.actions(state):
+                state_action_idx = len(state_action_states)
+                state_action_states.append(state_id)
+                state_action_actions.append(action)
+                if include_cost:
+                    transitions = discrete_environment.results(state, action)
+                else:
+                    transitions = discrete_environment.P[state][action]
+                for p, s1, r, *done in transitions:
+                    transition_state_actions.append(state_action_idx)
+                    transition_next_states.append(interner.intern(s1))
+                    transition_probabilities.append(p)
+                    transition_rewards.append(r)
+                    transition_dones.extend(done)
+
+        return cls(
+            interner=interner,
+            state_action_states=np.asarray(state_action_states, dtype=np.int64),
+            state_action_actions=np.asarray(state_action_actions, dtype=np.int64),
+            transition_state_actions=np.asarray(
+                transition_state_actions, dtype=np.int64
+            ),
+            transition_next_states=np.asarray(transition_next_states, dtype=np.int64),
+            transition_probabilities=np.asarray(transition_probabilities, dtype=float),
+            transition_rewards=np.asarray(transition_rewards, dtype=float),
+            transition_dones=(
+                None if include_cost else np.asarray(transition_dones, dtype=bool)
+            ),
+            terminal_state=getattr(discrete_environment, "terminal_state", None),
+        )
+
+    @property
+    def num_states(self) -> int:
+        return len(self.interner)
+
+    @property
+    def num_state_actions(self) -> int:
+        return len(self.state_action_states)
+
+    @property
+    def num_actions(self) -> int:
+        return int(np.max(self.state_action_actions, initial=-1)) + 1
+
+    def get_expected_rewards(self, transition_rewards: np.ndarray) -> np.ndarray:
+        """
+        Expected reward of each state-action row
+
+        :param transition_rewards: array of rewards, of shape (number of transitions,) or (number of reward settings, number of transitions)
+        :return: array of shape (number of state-action rows,) or (number of reward settings, number of state-action rows)
+        """  # noqa: E501
+        # sums probability-weighted rewards of each state-action row's transitions
+        expectation = csr_matrix(
+            (
+                self.transition_probabilities,
+                (
+                    self.transition_state_actions,
+                    np.arange(len(self.transition_state_actions)),
+                ),
+            ),
+            shape=(self.num_state_actions, len(self.transition_state_actions)),
+        )
+        return (expectation @ np.asarray(transition_rewards, dtype=float).T).T
+
+    def get_transition_costs(self, cost: Callable) -> np.ndarray:
+        """
+        Evaluate a cost function (e.g. made by distance_bonus) on every transition
+
+        If the cost function has a vectorized attribute (taking arrays of states, actions, new states and dones), it is called once on integer states, with -1 for the terminal state.
+
+        :param cost: cost function, as a function of current state, action, new state and done
+        :return: array of costs, one per transition
+        """  # noqa: E501
+        if self.transition_dones is None:
+            raise ValueError(
+                "Costs can only be added to MDPs compiled with include_cost=False."
+            )
+
+        states = self.interner.states
+        transition_states = self.state_action_states[self.transition_state_actions]
+        transition_actions = self.state_action_actions[self.transition_state_actions]
+
+        if hasattr(cost, "vectorized"):
+            state_values = np.fromiter(
+                (-1 if state == self.terminal_state else state for state in states),
+                dtype=np.int64,
+                count=len(states),
+            )
+            return np.asarray(
+                cost.vectorized(
+                    state_values[transition_states],
+                    transition_actions,
+                    state_values[self.transition_next_states],
+                    self.transition_dones,
+                ),
+                dtype=float,
+            )
+
+        return np.fromiter(
+            (
+                cost(states[state_id], action, states[next_state_id], done)
+                for state_id, action, next_state_id, done in zip(
+                    transition_states.tolist(),
+                    transition_actions.tolist(),
+                    self.transition_next_states.tolist(),
+                    self.transition_dones.tolist(),
+                )
+            ),
+            dtype=float,
+            count=len(self.transition_dones),
+        )
+
+    def bellman_backup(
+        self, V: np.ndarray, gamma: float = 1.0, rewards: np.ndarray = None
+    ) -> np.ndarray:
+        """
+        Q value of each state-action row, given state values
+
+        :param V: array of state values, of shape (number of states,) or (number of reward settings, number of states)
+        :param gamma: discount factor
+        :param rewards: expected rewards of state-action rows (same leading shape as V), if None the compiled rewards
+        :return: array of Q values, one per state-action row (for each reward setting)
+        """  # noqa: E501
+        if rewards is None:
+            rewards = self.rewards
+        return rewards + gamma * (self.transitions @ V.T).T
+
+    def get_state_values(self, Q: np.ndarray) -> np.ndarray:
+        """
+        Value of each state, the maximum Q value of its actions (0 for states without actions)
+
+        :param Q: array of Q values, one per state-action row (last dimension)
+        :return: array of state values
+        """  # noqa: E501
+        V = np.zeros(Q.shape[:-1] + (self.num_states,))
+        if len(self.action_states) > 0:
+            V[..., self.action_states] = np.maximum.reduceat(
+                Q, self.action_offsets, axis=-1
+            )
+        return V
+
+    def get_greedy_rows(self, Q: np.ndarray) -> np.ndarray:
+        """
+        First state-action row with the maximum Q value, for each state with actions
+
+        :param Q: array of Q values, one per state-action row (last dimension)
+        :return: array of state-action rows, one per state in action_states
+        """
+        V = self.get_state_values(Q)
+        rows = np.where(
+            Q == V[..., self.state_action_states],
+            np.arange(self.num_state_actions),
+            self.num_state_actions,
+        )
+        return np.minimum.reduceat(rows, self.action_offsets, axis=-1)
+
+    def get_greedy_actions(self, Q: np.ndarray) -> np.ndarray:
+        """
+        First action with the maximum Q value in each state, as in max(Q[state], key=Q[state].get)
+
+        :param Q: array of Q values, one per state-action row (last dimension)
+        :return: array of actions, -1 for states without actions
+        """  # noqa: E501
+        pi = np.full(Q.shape[:-1] + (self.num_states,), -1, dtype=np.int64)
+        if len(self.action_states) > 0:
+            pi[..., self.action_states] = self.state_action_actions[
+                self.get_greedy_rows(Q)
+            ]
+        return pi
+
+    def get_policy_transitions(
+        self, policy_rows: np.ndarray
+    ) -> Tuple[csr_matrix, np.ndarray]:
+        """
+        Transition matrix and expected rewards when following a policy
+
+        :param policy_rows: state-action row chosen in each state in action_states (e.g. from get_greedy_rows)
+        :return: transition matrix of shape (number of states, number of states) and expected rewards of each state (rows for states without actions are 0)
+        """  # noqa: E501
+        # maps policy rows onto the states they belong to
+        state_selection = csr_matrix(
+            (
+                np.ones(len(self.action_states)),
+                (self.action_states, np.arange(len(self.action_states))),
+            ),
+            shape=(self.num_states, len(self.action_states)),
+        )
+        policy_transitions = state_selection @ self.transitions[policy_rows]
+
+        policy_rewards = np.zeros(self.num_states)
+        policy_rewards[self.action_states] = self.rewards[policy_rows]
+        return policy_transitions.tocsr(), policy_rewards
+
+    def to_nested(
+        self, Q: np.ndarray, V: np.ndarray
+    ) -> Tuple[Dict[Any, Dict[int, float]], Dict[Any, float], Dict[Any, int]]:
+        """
+        Convert arrays to the dictionaries outputted by value_iteration
+
+        :param Q: array of Q values, one per state-action row
+        :param V: array of state values
+        :return: Q (as Q[s][a]), V and pi dictionaries
+        """
+        states = self.interner.states
+        Q_dict = {state: {} for state in states}
+        for state_id, action, q_value in zip(
+            self.state_action_states.tolist(),
+            self.state_action_actions.tolist(),
+            Q.tolist(),
+        ):
+            Q_dict[states[state_id]][action] = q_value
+
+        V_dict = dict(zip(states, V.tolist()))
+        pi = {
+            states[state_id]: action
+            for state_id, action in enumerate(self.get_greedy_actions(Q).tolist())
+            if action >= 0 and states[state_id] != self.terminal_state
+        }
+        return Q_dict, V_dict, pi
+
+    def to_q_table(self, Q: np.ndarray) -> QTable:
+        """
+        Convert array of Q values to a Q table sharing this MDP's state interner
+
+        :param Q: array of Q values, one per state-action row
+        :return: Q table, -inf for unavailable actions
+        """
+        values = np.full((self.num_states, self.num_actions), -np.inf)
+        values[self.state_action_states, self.state_action_actions] = Q
+        return QTable(values, self.interner)
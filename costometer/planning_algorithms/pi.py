@@ -0,0 +1,192 @@
+"""Provides functions for policy iteration and modified policy iteration in discrete Open AI gym environments."""  # noqa: E501
+import time
+import warnings
+from typing import Any, Dict, Tuple, Union
+
+import numpy as np
+from gym.envs.toy_text.discrete import DiscreteEnv
+from scipy.sparse import identity
+from scipy.sparse.linalg import MatrixRankWarning, spsolve
+
+from costometer.envs.modified_mouselab import ModifiedMouseLabEnv
+from costometer.planning_algorithms.compiled_mdp import CompiledMDP
+from costometer.planning_algorithms.vi import get_initial_values
+
+
+def _evaluate_policy_exactly(
+    policy_transitions, policy_rewards: np.ndarray, gamma: float
+) -> Union[np.ndarray, None]:
+    """
+    Solve the linear system for the values of a policy
+
+    :param policy_transitions: transition matrix of policy
+    :param policy_rewards: expected reward in each state under policy
+    :param gamma: discount factor
+    :return: values of policy, or None if the system is singular (e.g. a policy that never reaches the terminal state, with gamma = 1)
+    """  # noqa: E501
+    system = (
+        identity(policy_transitions.shape[0], format="csc")
+        - gamma * policy_transitions.tocsc()
+    )
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", MatrixRankWarning)
+        V = spsolve(system, policy_rewards)
+
+    if np.all(np.isfinite(V)) and np.allclose(system @ V, policy_rewards):
+        return V
+    else:
+        return None
+
+
+def _policy_iteration(
+    discrete_environment: Union[DiscreteEnv, ModifiedMouseLabEnv, CompiledMDP],
+    gamma: float,
+    epsilon: float,
+    num_evaluation_sweeps: int = None,
+    initial_V: Dict[Union[str, int], float] = None,
+    initial_Q: Dict[Union[str, int], Dict[int, Union[int, float]]] = None,
+) -> Tuple[
+    Dict[Union[str, int], Dict[int, Union[int, float]]],
+    Dict[Union[str, int], float],
+    Dict[Union[str, int], int],
+    Dict[str, Any],
+]:
+    """
+    Alternate greedy policy improvement and policy evaluation until the Bellman residual is below epsilon (the convergence test of value_iteration)
+
+    :param discrete_environment: discrete gym environment, or compiled MDP
+    :param gamma: discount factor
+    :param epsilon: for testing convergence
+    :param num_evaluation_sweeps: number of evaluation sweeps per iteration, if None policies are evaluated exactly (falling back to 10 sweeps if the linear system is singular)
+    :param initial_V: state values to start from, if None (and no initial_Q) all 0
+    :param initial_Q: Q values to start from, e.g. solution for a neighbouring cost setting
+    :return: Q, V, pi (same format as value_iteration), info (iteration counts and timings)
+    """  # noqa: E501
+    start_time = time.perf_counter()
+    if isinstance(discrete_environment, CompiledMDP):
+        compiled_mdp = discrete_environment
+    else:
+        compiled_mdp = CompiledMDP.from_env(discrete_environment)
+    compile_time = time.perf_counter() - start_time
+
+    V = np.fromiter(
+        get_initial_values(compiled_mdp.interner.states, initial_V, initial_Q).values(),
+        dtype=float,
+        count=compiled_mdp.num_states,
+    )
+
+    info = {
+        "num_iterations": 0,
+        "num_evaluation_sweeps": 0,
+        "num_exact_evaluations": 0,
+        "evaluation_time": 0,
+        "improvement_time": 0,
+    }
+    while True:
+        # policy improvement
+        improvement_start_time = time.perf_counter()
+        Q = compiled_mdp.bellman_backup(V, gamma=gamma)
+        new_V = compiled_mdp.get_state_values(Q)
+        info["improvement_time"] += time.perf_counter() - improvement_start_time
+        info["num_iterations"] += 1
+
+        if np.all(np.abs(new_V - V) <= epsilon):
+            V = new_V
+            break
+
+        # policy evaluation
+        evaluation_start_time = time.perf_counter()
+        policy_transitions, policy_rewards = compiled_mdp.get_policy_transitions(
+            compiled_mdp.get_greedy_rows(Q)
+        )
+
+        evaluated_V = None
+        if num_evaluation_sweeps is None:
+            evaluated_V = _evaluate_policy_exactly(
+                policy_transitions, policy_rewards, gamma
+            )
+
+        if evaluated_V is not None:
+            V = evaluated_V
+            info["num_exact_evaluations"] += 1
+        else:
+            V = new_V
+            for _ in range(
+                num_evaluation_sweeps if num_evaluation_sweeps is not None else 10
+            ):
+                V = policy_rewards + gamma * (policy_transitions @ V)
+                info["num_evaluation_sweeps"] += 1
+        info["evaluation_time"] += time.perf_counter() - evaluation_start_time
+
+    Q, V, pi = compiled_mdp.to_nested(Q, V)
+    info["compile_time"] = compile_time
+    info["solve_time"] = time.perf_counter() - start_time - compile_time
+    return Q, V, pi, info
+
+
+def policy_iteration(
+    discrete_environment: Union[DiscreteEnv, ModifiedMouseLabEnv, CompiledMDP],
+    gamma: float = 1.0,
+    epsilon: float = 1e-6,
+    initial_V: Dict[Union[str, int], float] = None,
+    initial_Q: Dict[Union[str, int], Dict[int, Union[int, float]]] = None,
+) -> Tuple[
+    Dict[Union[str, int], Dict[int, Union[int, float]]],
+    Dict[Union[str, int], float],
+    Dict[Union[str, int], int],
+    Dict[str, Any],
+]:
+    """
+    Perform policy iteration on discrete gym environment, evaluating each policy with a sparse linear solve.
+
+    With gamma = 1, policies that never reach the terminal state can't be evaluated exactly, these are evaluated with a few sweeps instead.
+
+    :param discrete_environment: discrete gym environment, or compiled MDP
+    :param gamma: discount factor
+    :param epsilon: for testing convergence
+    :param initial_V: state values to start from, if None (and no initial_Q) all 0
+    :param initial_Q: Q values to start from, e.g. solution for a neighbouring cost setting
+    :return: Q, V, pi (same format as value_iteration), info (iteration counts and timings)
+    """  # noqa: E501
+    return _policy_iteration(
+        discrete_environment,
+        gamma,
+        epsilon,
+        num_evaluation_sweeps=None,
+        initial_V=initial_V,
+        initial_Q=initial_Q,
+    )
+
+
+def modified_policy_iteration(
+    discrete_environment: Union[DiscreteEnv, ModifiedMouseLabEnv, CompiledMDP],
+    gamma: float = 1.0,
+    epsilon: float = 1e-6,
+    num_evaluation_sweeps: int = 10,
+    initial_V: Dict[Union[str, int], float] = None,
+    initial_Q: Dict[Union[str, int], Dict[int, Union[int, float]]] = None,
+) -> Tuple[
+    Dict[Union[str, int], Dict[int, Union[int, float]]],
+    Dict[Union[str, int], float],
+    Dict[Union[str, int], int],
+    Dict[str, Any],
+]:
+    """
+    Perform modified policy iteration on discrete gym environment, evaluating each policy with a fixed number of sweeps.
+
+    :param discrete_environment: discrete gym environment, or compiled MDP
+    :param gamma: discount factor
+    :param epsilon: for testing convergence
+    :param num_evaluation_sweeps: number of partial evaluation sweeps (k) per iteration, 0 is value iteration
+    :param initial_V: state values to start from, if None (and no initial_Q) all 0
+    :param initial_Q: Q values to start from, e.g. solution for a neighbouring cost setting
+    :return: Q, V, pi (same format as value_iteration), info (iteration counts and timings)
+    """  # noqa: E501
+    return _policy_iteration(
+        discrete_environment,
+        gamma,
+        epsilon,
+        num_evaluation_sweeps=num_evaluation_sweeps,
+        initial_V=initial_V,
+        initial_Q=initial_Q,
+    )
@@ -0,0 +1,499 @@
+"""Provides integer state ids and array-backed Q values for planning outputs."""
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+import dill as pickle
+import numpy as np
+
+
+class StateInterner:
+    """Maps each distinct state (e.g. a tuple of Categoricals and floats) to a compact integer id."""  # noqa: E501
+
+    def __init__(self, states: Iterable[Any] = None):
+        """
+        State interner.
+
+        :param states: states to intern, ids are given in order
+        """
+        self.states = []
+        self.state_ids = {}
+
+        if states is not None:
+            self.intern_many(states)
+
+    def __len__(self) -> int:
+        return len(self.states)
+
+    def __contains__(self, state: Any) -> bool:
+        return state in self.state_ids
+
+    def __getitem__(self, state_id: int) -> Any:
+        return self.states[state_id]
+
+    def intern(self, state: Any) -> int:
+        """
+        Get the id of a state, adding the state if it has not been seen before
+
+        :param state: state
+        :return: integer id of state
+        """
+        state_id = self.state_ids.get(state)
+        if state_id is None:
+            state_id = len(self.states)
+            self.state_ids[state] = state_id
+            self.states.append(state)
+        return state_id
+
+    def get_id(self, state: Any, missing: int = -1) -> int:
+        """
+        Get id of a state without adding it
+
+        :param state: state
+        :param missing: id to return if state has not been interned
+        :return: integer id of state
+        """
+        return self.state_ids.get(state, missing)
+
+    def intern_many(self, states: Iterable[Any]) -> np.ndarray:
+        """
+        Get ids of states, adding any states that have not been seen before
+
+        :param states: iterable of states
+        :return: array of integer ids
+        """
+        return np.fromiter((self.intern(state) for state in states), dtype=np.int64)
+
+    def get_ids(self, states: Iterable[Any], missing: int = -1) -> np.ndarray:
+        """
+        Get ids of states without adding new states
+
+        :param states: iterable of states
+        :param missing: id to use for states that have not been interned
+        :return: array of integer ids
+        """
+        return np.fromiter(
+            (self.state_ids.get(state, missing) for state in states), dtype=np.int64
+        )
+
+
+def encode_states(states: List[Any]) -> np.ndarray:
+    """
+    Encodes states as rows of floats, so they can be saved as arrays
+
+    States are either tuples (e.g. Mouselab states, where nodes that have not been observed yet are distributions, encoded as nan) or single numbers (e.g. discrete gym environments).
+
+    :param states: list of states
+    :return: array of shape (number of states, length of state)
+    """  # noqa: E501
+    encoded_states = [
+        (
+            [np.nan if hasattr(node, "sample") else node for node in state]
+            if isinstance(state, tuple)
+            else [state]
+        )
+        for state in states
+    ]
+    try:
+        # + 0.0 so -0.0 and 0.0 are encoded the same way
+        return np.asarray(encoded_states, dtype=float).reshape(len(states), -1) + 0.0
+    except (TypeError, ValueError):
+        raise ValueError(
+            "Only tuples of numbers and distributions, or numbers, can be encoded."
+        )
+
+
+def _as_keys(encoded_states: np.ndarray) -> np.ndarray:
+    # view each row of encoded states as one opaque value, which can be sorted
+    encoded_states = np.ascontiguousarray(encoded_states)
+    return encoded_states.view(
+        np.dtype((np.void, encoded_states.dtype.itemsize * encoded_states.shape[1]))
+    ).ravel()
+
+
+class EncodedStateInterner(StateInterner):
+    """
+    Read-only state interner over a sorted array of encoded states (see encode_states).
+
+    Looking states up is a binary search, so no dictionary of all states needs to be built and the array can be memory mapped.
+    """  # noqa: E501
+
+    def __init__(self, encoded_states: np.ndarray, unobserved_nodes: List[Any] = None):
+        """
+        Encoded state interner, usually made by QTable.load.
+
+        :param encoded_states: array of encoded states, sorted by encoded bytes (as saved by QTable.save)
+        :param unobserved_nodes: for tuple states, distribution of each node before it is observed (None for states that are single numbers)
+        """  # noqa: E501
+        self.encoded_states = encoded_states
+        self.unobserved_nodes = unobserved_nodes
+        self._keys = _as_keys(encoded_states)
+
+    @classmethod
+    def from_states(
+        cls, states: List[Any]
+    ) -> Tuple["EncodedStateInterner", np.ndarray]:
+        """
+        Build encoded state interner from states, e.g. those of another interner
+
+        :param states: list of states, tuples of numbers and distributions or numbers
+        :return: encoded state interner, and for each of its ids the index of the state in states
+        """  # noqa: E501
+        encoded_states = encode_states(states)
+        order = np.argsort(_as_keys(encoded_states), kind="stable")
+
+        unobserved_nodes = None
+        if len(states) > 0 and isinstance(states[0], tuple):
+            unobserved_nodes = [None] * encoded_states.shape[1]
+            for state in states:
+                for node_idx, node in enumerate(state):
+                    if unobserved_nodes[node_idx] is None and hasattr(node, "sample"):
+                        unobserved_nodes[node_idx] = node
+
+        return cls(encoded_states[order], unobserved_nodes=unobserved_nodes), order
+
+    def __len__(self) -> int:
+        return len(self.encoded_states)
+
+    def __contains__(self, state: Any) -> bool:
+        return self.get_id(state) >= 0
+
+    def __getitem__(self, state_id: int) -> Any:
+        encoded_state = self.encoded_states[state_id]
+        if self.unobserved_nodes is None:
+            return (
+                int(encoded_state[0])
+                if encoded_state[0].is_integer()
+                else encoded_state[0]
+            )
+        else:
+            return tuple(
+                unobserved_node if np.isnan(node) else node
+                for node, unobserved_node in zip(
+                    encoded_state.tolist(), self.unobserved_nodes
+                )
+            )
+
+    @property
+    def states(self) -> List[Any]:
+        # decodes every state, avoid for large tables
+        return [self[state_id] for state_id in range(len(self))]
+
+    @property
+    def state_ids(self) -> Dict[Any, int]:
+        # decodes every state, avoid for large tables
+        return {state: state_id for state_id, state in enumerate(self.states)}
+
+    def get_id(self, state: Any, missing: int = -1) -> int:
+        return int(self.get_ids([state], missing=missing)[0])
+
+    def get_ids(self, states: Iterable[Any], missing: int = -1) -> np.ndarray:
+        states = list(states)
+        if len(states) == 0 or len(self) == 0:
+            return np.full(len(states), missing, dtype=np.int64)
+
+        # e.g. the terminal state string can not be encoded and is never in the table
+        encodable = np.fromiter(
+            (
+                isinstance(state, tuple)
+                or (np.isscalar(state) and not isinstance(state, str))
+                for state in states
+            ),
+            dtype=bool,
+        )
+        state_ids = np.full(len(states), missing, dtype=np.int64)
+        if not np.any(encodable):
+            return state_ids
+
+        encoded_states = encode_states(
+            [state for state, is_encodable in zip(states, encodable) if is_encodable]
+        )
+        state_ids[encodable] = self.get_ids_for_encoded(encoded_states, missing=missing)
+        return state_ids
+
+    def get_ids_for_encoded(
+        self, encoded_states: np.ndarray, missing: int = -1
+    ) -> np.ndarray:
+        """
+        Get ids of states that are already encoded (see encode_states), without decoding them
+
+        :param encoded_states: array of shape (number of states, length of state)
+        :param missing: id to use for states that are not in the interner
+        :return: array of integer ids
+        """  # noqa: E501
+        state_ids = np.full(len(encoded_states), missing, dtype=np.int64)
+        if (
+            len(encoded_states) == 0
+            or len(self) == 0
+            or encoded_states.shape[1] != self.encoded_states.shape[1]
+        ):
+            return state_ids
+
+        # + 0.0 so -0.0 and 0.0 have the same key
+        keys = _as_keys(np.asarray(encoded_states, dtype=float) + 0.0)
+        found_ids = np.minimum(np.searchsorted(self._keys, keys), len(self) - 1)
+        return np.where(self._keys[found_ids] == keys, found_ids, missing)
+
+    def intern(self, state: Any) -> int:
+        state_id = self.get_id(state)
+        if state_id < 0:
+            raise KeyError(f"{state} can not be added to a read-only interner.")
+        return state_id
+
+    def intern_many(self, states: Iterable[Any]) -> np.ndarray:
+        state_ids = self.get_ids(states)
+        if np.any(state_ids < 0):
+            raise KeyError("States can not be added to a read-only interner.")
+        return state_ids
+
+
+class QTable:
+    """
+    Q values stored as a dense (number of states, number of actions) array, indexed by interned state ids.
+
+    Actions that are not available in a state have a value of -inf.
+    The table can be used anywhere a Q dictionary keyed by (state, action) is expected (e.g. as a SoftmaxPolicy preference).
+    If the table has a symmetry (e.g. a MouselabSymmetry), rows are only stored for canonical states and other states are looked up through their canonical state.
+    """  # noqa: E501
+
+    def __init__(
+        self, values: np.ndarray, interner: StateInterner, symmetry: Any = None
+    ):
+        """
+        Q table.
+
+        :param values: array of Q values, rows are state ids and columns actions
+        :param interner: state interner for the rows of values
+        :param symmetry: symmetry with canonicalize and canonicalize_many methods, if rows are canonical states
+        """  # noqa: E501
+        self.values = values
+        self.interner = interner
+        self.symmetry = symmetry
+
+    @classmethod
+    def from_q_dictionary(
+        cls,
+        q_dictionary: Dict[Tuple[Any, int], float],
+        num_actions: int = None,
+        interner: StateInterner = None,
+        symmetry: Any = None,
+    ) -> "QTable":
+        """
+        Build Q table from Q dictionary keyed by (state, action), as saved by save_q_values_for_cost
+
+        :param q_dictionary: Q dictionary
+        :param num_actions: size of action space, if None the largest action in q_dictionary is used
+        :param interner: state interner to add states to, if None a new interner is made
+        :param symmetry: symmetry, if q_dictionary only has canonical states
+        :return: Q table
+        """  # noqa: E501
+        if interner is None:
+            interner = StateInterner()
+
+        state_ids = interner.intern_many(state for state, _ in q_dictionary.keys())
+        actions = np.fromiter(
+            (action for _, action in q_dictionary.keys()), dtype=np.int64
+        )
+        if num_actions is None:
+            num_actions = actions.max(initial=-1) + 1
+
+        values = np.full((len(interner), num_actions), -np.inf)
+        values[state_ids, actions] = np.fromiter(q_dictionary.values(), dtype=float)
+        return cls(values, interner, symmetry=symmetry)
+
+    @classmethod
+    def from_nested_q(
+        cls,
+        outputted_q: Dict[Any, Dict[int, float]],
+        num_actions: int = None,
+        interner: StateInterner = None,
+        symmetry: Any = None,
+    ) -> "QTable":
+        """
+        Build Q table from Q as outputted by a planning algorithm like value iteration, e.g. Q[s][a]
+
+        This avoids making the (state, action) keys that flatten_q makes.
+
+        :param outputted_q: Q as outputted by a planning algorithm
+        :param num_actions: size of action space, if None the largest action in outputted_q is used
+        :param interner: state interner to add states to, if None a new interner is made
+        :param symmetry: symmetry, if outputted_q only has canonical states
+        :return: Q table
+        """  # noqa: E501
+        if interner is None:
+            interner = StateInterner()
+
+        state_ids = interner.intern_many(outputted_q.keys())
+        if num_actions is None:
+            num_actions = (
+                max(
+                    (
+                        max(state_values, default=-1)
+                        for state_values in outputted_q.values()
+                    ),
+                    default=-1,
+                )
+                + 1
+            )
+
+        values = np.full((len(interner), num_actions), -np.inf)
+        for state_id, state_values in zip(state_ids, outputted_q.values()):
+            for action, action_value in state_values.items():
+                values[state_id, action] = action_value
+        return cls(values, interner, symmetry=symmetry)
+
+    @property
+    def num_actions(self) -> int:
+        return self.values.shape[1]
+
+    def __getitem__(self, key: Tuple[Any, int]) -> float:
+        state, action = key
+        if self.symmetry is not None:
+            state, node_map = self.symmetry.canonicalize(state)
+            if action < len(node_map):
+                action = node_map[action]
+
+        state_id = self.interner.get_id(state)
+        if state_id < 0 or state_id >= len(self.values):
+            raise KeyError(key)
+
+        value = self.values[state_id, action]
+        if value == -np.inf:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key: Tuple[Any, int]) -> bool:
+        try:
+            self[key]
+            return True
+        except (KeyError, IndexError):
+            return False
+
+    def __len__(self) -> int:
+        return int(np.sum(self.values > -np.inf))
+
+    def get(self, key: Tuple[Any, int], default: Any = None) -> Any:
+        try:
+            return self[key]
+        except (KeyError, IndexError):
+            return default
+
+    def get_action_values(self, states: List[Any]) -> np.ndarray:
+        """
+        Get Q values of all actions for states, with one lookup per state
+
+        :param states: list of states
+        :return: array of shape (number of states, number of actions)
+        """
+        if self.symmetry is None:
+            return self.get_action_values_for_ids(self.interner.get_ids(states))
+
+        canonical_states, action_maps = self.symmetry.canonicalize_many(
+            states, self.num_actions
+        )
+        return np.take_along_axis(
+            self.get_action_values_for_ids(self.interner.get_ids(canonical_states)),
+            action_maps,
+            axis=1,
+        )
+
+    def get_action_values_for_ids(
+        self, state_ids: Union[List[int], np.ndarray]
+    ) -> np.ndarray:
+        """
+        Get Q values of all actions for interned state ids
+
+        :param state_ids: state ids, from this table's interner (of canonical states if the table has a symmetry)
+        :return: array of shape (number of states, number of actions)
+        """  # noqa: E501
+        state_ids = np.asarray(state_ids, dtype=np.int64)
+        unknown = (state_ids < 0) | (state_ids >= len(self.values))
+        if np.any(unknown):
+            raise KeyError(f"{np.sum(unknown)} state(s) are not in the Q table.")
+        return self.values[state_ids]
+
+    def save(self, directory: Path, info: Dict[str, Any] = None) -> None:
+        """
+        Save Q table as a directory of arrays that can be memory mapped by QTable.load
+
+        Files are values.npy (Q values), states.npy (encoded states, see encode_states) and info.pickle (any other information, e.g. the solver info dictionary without the Q dictionary).
+
+        :param directory: directory to save to (made if needed)
+        :param info: dictionary of other information to save
+        :return: None
+        """  # noqa: E501
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        # sorted so states can be looked up with a binary search when loaded
+        encoded_interner, order = EncodedStateInterner.from_states(
+            self.interner.states[: len(self.values)]
+        )
+
+        np.save(directory.joinpath("values.npy"), self.values[order])
+        np.save(directory.joinpath("states.npy"), encoded_interner.encoded_states)
+        with open(directory.joinpath("info.pickle"), "wb") as f:
+            pickle.dump(
+                {
+                    **(info if info is not None else {}),
+                    # distribution of each node before it is observed, to decode states
+                    "unobserved_nodes": encoded_interner.unobserved_nodes,
+                    "symmetry": self.symmetry,
+                },
+                f,
+            )
+
+    @classmethod
+    def load(cls, directory: Path, mmap_mode: str = "r") -> "QTable":
+        """
+        Load Q table saved by QTable.save
+
+        :param directory: directory Q table was saved to
+        :param mmap_mode: memory map mode for numpy.load, "r" shares pages between processes, None reads into memory
+        :return: Q table (its info dictionary is saved as the info attribute)
+        """  # noqa: E501
+        directory = Path(directory)
+        with open(directory.joinpath("info.pickle"), "rb") as f:
+            info = pickle.load(f)
+
+        interner = EncodedStateInterner(
+            np.load(directory.joinpath("states.npy"), mmap_mode=mmap_mode),
+            unobserved_nodes=info.pop("unobserved_nodes"),
+        )
+        q_table = cls(
+            np.load(directory.joinpath("values.npy"), mmap_mode=mmap_mode),
+            interner,
+            symmetry=info.pop("symmetry", None),
+        )
+        q_table.info = info
+        return q_table
+
+    def to_encoded_q_table(self) -> "QTable":
+        """
+        Get the Q table with an EncodedStateInterner, so it is only arrays (e.g. to send to other processes without pickling a dictionary of all states)
+
+        States without Q values (e.g. the terminal state) are dropped.
+
+        :return: Q table (this one, if its interner is already encoded)
+        """  # noqa: E501
+        if isinstance(self.interner, EncodedStateInterner):
+            return self
+
+        state_ids = np.flatnonzero(np.any(self.values > -np.inf, axis=1))
+        encoded_interner, order = EncodedStateInterner.from_states(
+            [self.interner[state_id] for state_id in state_ids]
+        )
+        return QTable(
+            self.values[state_ids[order]], encoded_interner, symmetry=self.symmetry
+        )
+
+    def to_q_dictionary(self) -> Dict[Tuple[Any, int], float]:
+        """
+        Convert back to Q dictionary keyed by (state, action)
+
+        :return: Q dictionary (of canonical states only, if the table has a symmetry)
+        """
+        state_ids, actions = np.nonzero(self.values > -np.inf)
+        return {
+            (self.interner[state_id], action): self.values[state_id, action]
+            for state_id, action in zip(state_ids.tolist(), actions.tolist())
+        }
@@ -1,14 +1,17 @@
 """Provides functions for value iteration in discrete Open AI gym environments."""
+import time
 from copy import deepcopy
-from typing import Dict, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
 
+import numpy as np
 from gym.envs.toy_text.discrete import DiscreteEnv
 
 from costometer.envs.modified_mouselab import ModifiedMouseLabEnv
+from costometer.planning_algorithms.compiled_mdp import CompiledMDP
 
 
 def flatten_q(
-    outputted_q: Dict[Union[str, int], Dict[int, Union[int, float]]]
+    outputted_q: Dict[Union[str, int], Dict[int, Union[int, float]]],
 ) -> Dict[Tuple[Union[str, int], int], Union[int, float]]:
     """
     Flattens Q so it is in dictionary format assumed by policy functions, e.g. Q[(s,a)] rather than Q[s][a]
@@ -23,10 +26,35 @@ def flatten_q(
     return new_q
 
 
+def get_initial_values(
+    states: Iterable[Union[str, int]],
+    initial_V: Dict[Union[str, int], float] = None,
+    initial_Q: Dict[Union[str, int], Dict[int, Union[int, float]]] = None,
+) -> Dict[Union[str, int], Union[int, float]]:
+    """
+    Get state values to start planning from, e.g. the solution for a neighbouring cost setting
+
+    :param states: states of environment
+    :param initial_V: state values to start from
+    :param initial_Q: Q values to start from (as outputted by a planning algorithm), only used if initial_V is None
+    :return: state values, 0 for states not in initial_V or initial_Q
+    """  # noqa: E501
+    if initial_V is None and initial_Q is not None:
+        initial_V = {
+            state: max(state_values.values(), default=0)
+            for state, state_values in initial_Q.items()
+        }
+    if initial_V is None:
+        initial_V = {}
+    return {state: initial_V.get(state, 0) for state in states}
+
+
 def value_iteration(
     discrete_environment: Union[DiscreteEnv, ModifiedMouseLabEnv],
     gamma: float = 1.0,
     epsilon: float = 1e-6,
+    initial_V: Dict[Union[str, int], float] = None,
+    initial_Q: Dict[Union[str, int], Dict[int, Union[int, float]]] = None,
 ) -> Dict[Union[str, int], Dict[int, Union[int, float]]]:
     """
     Perform value iteration on discrete gym environment.
@@ -34,9 +62,11 @@ def value_iteration(
     :param discrete_environment: discrete gym environment
     :param gamma: discount factor
     :param epsilon: for testing convergence
+    :param initial_V: state values to start from, if None (and no initial_Q) all 0
+    :param initial_Q: Q values to start from, e.g. solution for a neighbouring cost setting
     :return: Q, V, pi, info (empty)
-    """
-    V = {state: 0 for state in discrete_environment.P.keys()}
+    """  # noqa: E501
+    V = get_initial_values(discrete_environment.P.keys(), initial_V, initial_Q)
     Q = {state: {} for state in discrete_environment.P.keys()}
     policy_good_enough = False
 
@@ -67,3 +97,247 @@ def value_iteration(
             if state != discrete_environment.terminal_state
         }
     return Q, V, pi, {}
+
+
+def _iterate_values(
+    compiled_mdp: CompiledMDP,
+    V: np.ndarray,
+    gamma: float,
+    epsilon: float,
+    rewards: np.ndarray = None,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Bellman backups on a compiled MDP until state values converge
+
+    :param compiled_mdp: compiled MDP
+    :param V: state values to start from, of shape (number of states,) or (number of reward settings, number of states)
+    :param gamma: discount factor
+    :param epsilon: for testing convergence
+    :param rewards: expected rewards of state-action rows, if None the compiled rewards
+    :return: Q, V and number of iterations
+    """  # noqa: E501
+    num_iterations = 0
+    policy_good_enough = False
+    while not policy_good_enough:
+        Q = compiled_mdp.bellman_backup(V, gamma=gamma, rewards=rewards)
+        Vold, V = V, compiled_mdp.get_state_values(Q)
+        num_iterations += 1
+
+        policy_good_enough = np.all(np.abs(V - Vold) <= epsilon)
+    return Q, V, num_iterations
+
+
+def sparse_value_iteration(
+    discrete_environment: Union[DiscreteEnv, ModifiedMouseLabEnv, CompiledMDP],
+    gamma: float = 1.0,
+    epsilon: float = 1e-6,
+    initial_V: Dict[Union[str, int], float] = None,
+    initial_Q: Dict[Union[str, int], Dict[int, Union[int, float]]] = None,
+) -> Tuple[
+    Dict[Union[str, int], Dict[int, Union[int, float]]],
+    Dict[Union[str, int], float],
+    Dict[Union[str, int], int],
+    Dict[str, Any],
+]:
+    """
+    Perform value iteration with sparse matrices, compiling the environment's transitions and costs once.
+
+    Sweeps update all states at once (rather than in place), so Q values can differ from value_iteration's by up to epsilon.
+
+    :param discrete_environment: discrete gym environment, or compiled MDP
+    :param gamma: discount factor
+    :param epsilon: for testing convergence
+    :param initial_V: state values to start from, if None (and no initial_Q) all 0
+    :param initial_Q: Q values to start from, e.g. solution for a neighbouring cost setting
+    :return: Q, V, pi (same format as value_iteration), info (number of iterations and timings)
+    """  # noqa: E501
+    start_time = time.perf_counter()
+    if isinstance(discrete_environment, CompiledMDP):
+        compiled_mdp = discrete_environment
+    else:
+        compiled_mdp = CompiledMDP.from_env(discrete_environment)
+    compile_time = time.perf_counter() - start_time
+
+    V = np.fromiter(
+        get_initial_values(compiled_mdp.interner.states, initial_V, initial_Q).values(),
+        dtype=float,
+        count=compiled_mdp.num_states,
+    )
+    Q, V, num_iterations = _iterate_values(compiled_mdp, V, gamma, epsilon)
+
+    Q, V, pi = compiled_mdp.to_nested(Q, V)
+    return (
+        Q,
+        V,
+        pi,
+        {
+            "num_iterations": num_iterations,
+            "compile_time": compile_time,
+            "solve_time": time.perf_counter() - start_time - compile_time,
+        },
+    )
+
+
+def batched_value_iteration(
+    discrete_environment: Union[DiscreteEnv, CompiledMDP],
+    cost_function: Callable,
+    all_cost_kwargs: List[Dict[str, Any]],
+    gamma: float = 1.0,
+    epsilon: float = 1e-6,
+) -> List[
+    Tuple[
+        Dict[Union[str, int], Dict[int, Union[int, float]]],
+        Dict[Union[str, int], float],
+        Dict[Union[str, int], int],
+        Dict[str, Any],
+    ]
+]:
+    """
+    Perform value iteration for many cost settings at once, sharing one compiled transition structure.
+
+    The environment's own cost is ignored, rewards are read from P and the cost for each setting is cost_function(**cost_kwargs), as in ModifiedCliffWalkingEnv.
+
+    :param discrete_environment: discrete gym environment with P (e.g. with ExactSolveMixin), or MDP compiled with include_cost=False
+    :param cost_function: cost function constructor, e.g. distance_bonus
+    :param all_cost_kwargs: list of cost parameter settings
+    :param gamma: discount factor
+    :param epsilon: for testing convergence (of all settings)
+    :return: for each cost setting, Q, V, pi (same format as value_iteration) and info (number of iterations and timings)
+    """  # noqa: E501
+    start_time = time.perf_counter()
+    if isinstance(discrete_environment, CompiledMDP):
+        compiled_mdp = discrete_environment
+    else:
+        compiled_mdp = CompiledMDP.from_env(discrete_environment, include_cost=False)
+
+    # one row of expected rewards per cost setting
+    rewards = compiled_mdp.get_expected_rewards(
+        [
+            compiled_mdp.transition_rewards
+            + compiled_mdp.get_transition_costs(cost_function(**cost_kwargs))
+            for cost_kwargs in all_cost_kwargs
+        ]
+    )
+    compile_time = time.perf_counter() - start_time
+
+    Q, V, num_iterations = _iterate_values(
+        compiled_mdp,
+        np.zeros((len(all_cost_kwargs), compiled_mdp.num_states)),
+        gamma,
+        epsilon,
+        rewards=rewards,
+    )
+
+    solve_time = time.perf_counter() - start_time - compile_time
+    info = {
+        "num_iterations": num_iterations,
+        "compile_time": compile_time,
+        "solve_time": solve_time,
+    }
+    return [
+        (
+            *compiled_mdp.to_nested(setting_Q, setting_V),
+            {**info, "cost_params": cost_kwargs},
+        )
+        for setting_Q, setting_V, cost_kwargs in zip(Q, V, all_cost_kwargs)
+    ]
+
+
+def get_cost_grid_path(all_cost_kwargs: List[Dict[str, Any]]) -> List[int]:
+    """
+    Order cost settings along a path through parameter space, each followed by its nearest unvisited neighbour
+
+    Only numeric cost parameters are used, each scaled by its range on the grid.
+
+    :param all_cost_kwargs: list of cost parameter settings
+    :return: indices of cost settings, in path order
+    """  # noqa: E501
+    if len(all_cost_kwargs) == 0:
+        return []
+
+    numeric_parameters = [
+        key
+        for key, val in all_cost_kwargs[0].items()
+        if isinstance(val, (int, float)) and not isinstance(val, bool)
+    ]
+    points = np.asarray(
+        [
+            [cost_kwargs[key] for key in numeric_parameters]
+            for cost_kwargs in all_cost_kwargs
+        ],
+        dtype=float,
+    ).reshape(len(all_cost_kwargs), -1)
+    ranges = np.ptp(points, axis=0)
+    points = (points - points.min(axis=0)) / np.where(ranges > 0, ranges, 1)
+
+    # start at (lexicographically) smallest setting
+    path = [int(np.lexsort(points.T[::-1])[0])]
+    unvisited = np.ones(len(points), dtype=bool)
+    unvisited[path[0]] = False
+    while np.any(unvisited):
+        distances = np.linalg.norm(points - points[path[-1]], axis=1)
+        distances[~unvisited] = np.inf
+        path.append(int(np.argmin(distances)))
+        unvisited[path[-1]] = False
+    return path
+
+
+def warm_started_value_iteration(
+    discrete_environment: Union[DiscreteEnv, CompiledMDP],
+    cost_function: Callable,
+    all_cost_kwargs: List[Dict[str, Any]],
+    gamma: float = 1.0,
+    epsilon: float = 1e-6,
+) -> List[
+    Tuple[
+        Dict[Union[str, int], Dict[int, Union[int, float]]],
+        Dict[Union[str, int], float],
+        Dict[Union[str, int], int],
+        Dict[str, Any],
+    ]
+]:
+    """
+    Perform value iteration for each cost setting in turn, along a path through parameter space (see get_cost_grid_path), starting each solve from its neighbour's state values.
+
+    Unlike batched_value_iteration, only one setting's arrays are in memory at a time. As there, the environment's own cost is ignored and the cost for each setting is cost_function(**cost_kwargs).
+
+    :param discrete_environment: discrete gym environment with P (e.g. with ExactSolveMixin), or MDP compiled with include_cost=False
+    :param cost_function: cost function constructor, e.g. distance_bonus
+    :param all_cost_kwargs: list of cost parameter settings
+    :param gamma: discount factor
+    :param epsilon: for testing convergence
+    :return: for each cost setting (in the input order), Q, V, pi (same format as value_iteration) and info (number of iterations, timings and the setting warm started from)
+    """  # noqa: E501
+    if isinstance(discrete_environment, CompiledMDP):
+        compiled_mdp = discrete_environment
+    else:
+        compiled_mdp = CompiledMDP.from_env(discrete_environment, include_cost=False)
+
+    results = [None] * len(all_cost_kwargs)
+    V = np.zeros(compiled_mdp.num_states)
+    previous_idx = None
+    for cost_idx in get_cost_grid_path(all_cost_kwargs):
+        start_time = time.perf_counter()
+        rewards = compiled_mdp.get_expected_rewards(
+            compiled_mdp.transition_rewards
+            + compiled_mdp.get_transition_costs(
+                cost_function(**all_cost_kwargs[cost_idx])
+            )
+        )
+        Q, V, num_iterations = _iterate_values(
+            compiled_mdp, V, gamma, epsilon, rewards=rewards
+        )
+
+        results[cost_idx] = (
+            *compiled_mdp.to_nested(Q, V),
+            {
+                "num_iterations": num_iterations,
+                "solve_time": time.perf_counter() - start_time,
+                "cost_params": all_cost_kwargs[cost_idx],
+                "warm_start_cost_params": (
+                    all_cost_kwargs[previous_idx] if previous_idx is not None else None
+                ),
+            },
+        )
+        previous_idx = cost_idx
+    return results
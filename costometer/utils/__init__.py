@@ -6,6 +6,7 @@ from costometer.utils.analysis_utils import (
     recalculate_maps_from_mles,
 )
 from costometer.utils.cost_utils import (
+    convert_q_file,
     get_param_string,
     load_q_file,
     save_q_values_for_cost,
@@ -16,9 +17,17 @@ from costometer.utils.posterior_utils import (
     greedy_hdi_quantification,
     marginalize_out_for_data_set,
 )
+from costometer.utils.q_file_cache import QFileCache, get_q_values_bytes
+from costometer.utils.q_file_manifest import QFileManifest, get_q_file_manifest
+from costometer.utils.q_generation import save_q_values_for_cost_grid
+from costometer.utils.simulation_utils import simulate_participants
+from costometer.utils.trace_shards import TraceShards, TraceShardWriter
 from costometer.utils.trace_utils import (
+    get_participant_trace,
     get_states_for_trace,
     get_trace_from_human_row,
+    get_trace_store,
     get_trajectories_from_participant_data,
+    load_trajectories_from_participant_data,
     traces_to_df,
 )
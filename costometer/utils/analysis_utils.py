@@ -1,4 +1,5 @@
 """Utility functions for MAP calculation, priors and finding the best parameters."""
+from copy import copy
 from itertools import product
 from pathlib import Path
 from typing import Any, Callable, Dict, List, Union
@@ -15,11 +16,14 @@ from scipy import stats  # noqa
 from scipy.stats import rv_continuous
 from statsmodels.tools.eval_measures import bic
 
-from costometer.agents import SymmetricMouselabParticipant
+from costometer.agents import (
+    SoftmaxLikelihoodParticipant,
+    SymmetricMouselabParticipant,
+)
 from costometer.utils.cost_utils import get_param_string, load_q_file
 from costometer.utils.plotting_utils import generate_model_palette
 from costometer.utils.trace_utils import (
-    get_trajectories_from_participant_data,
+    load_trajectories_from_participant_data,
     traces_to_df,
 )
 
@@ -704,9 +708,13 @@ class AnalysisObject:
         optimization_data: pd.DataFrame,
         q_path: Union[str, Path] = None,
         preferred_cost: Callable = None,
+        trace_store_path: Union[str, Path] = None,
     ) -> pd.DataFrame:
         if q_path is None:
             q_path = self.irl_path.joinpath("cluster/data/q_files")
+        # processed human traces, so trials are only replayed the first time
+        if trace_store_path is None:
+            trace_store_path = self.irl_path.joinpath("data/processed/trace_stores")
         if preferred_cost is None:
             preferred_cost = eval(self.preferred_cost)
 
@@ -732,6 +740,14 @@ class AnalysisObject:
             for cost_kwarg in cost_kwargs
         }
 
+        # human traces are loaded once, and selected by pid for each setting
+        human_traces = load_trajectories_from_participant_data(
+            self.mouselab_trials,
+            trace_store_path,
+            experiment_setting=self.experiment_setting,
+        )
+        human_traces_by_pid = {trace["pid"][0]: trace for trace in human_traces}
+
         all_values = []
 
         # softmax policy
@@ -762,11 +778,12 @@ class AnalysisObject:
                         )
                     ]["trace_pid"]
 
-                    subset_traces = get_trajectories_from_participant_data(
-                        self.mouselab_trials[
-                            self.mouselab_trials["pid"].isin(curr_pids)
-                        ]
-                    )
+                    # traces_to_df removes fields from traces, so they are copied
+                    subset_traces = [
+                        copy(human_traces_by_pid[pid])
+                        for pid in sorted(set(curr_pids))
+                        if pid in human_traces_by_pid
+                    ]
                     cost_kwargs = {
                         key: val
                         for key, val in unique_setting.items()
@@ -774,11 +791,8 @@ class AnalysisObject:
                         in self.cost_details[cost_function]["cost_parameter_args"]
                     }
 
-                    participant = SymmetricMouselabParticipant(
+                    participant = SoftmaxLikelihoodParticipant(
                         experiment_setting=self.experiment_setting,
-                        num_trials=max(
-                            [len(trace["actions"]) for trace in subset_traces]
-                        ),
                         cost_function=eval(cost_function),
                         cost_kwargs=cost_kwargs,
                         policy_function=SoftmaxPolicy,
@@ -789,10 +803,12 @@ class AnalysisObject:
                         },
                     )
 
-                    for trace in subset_traces:
+                    for trace, trace_likelihood in zip(
+                        subset_traces,
+                        participant.compute_batch_likelihood(subset_traces),
+                    ):
                         trace["likelihood"] = [
-                            np.sum(trial_vals)
-                            for trial_vals in participant.compute_likelihood(trace)
+                            np.sum(trial_vals) for trial_vals in trace_likelihood
                         ]
                     curr_trial_by_trial_df = traces_to_df(subset_traces)
 
@@ -810,7 +826,7 @@ class AnalysisObject:
                     all_values.append(curr_values)
 
         # random policy
-        traces = get_trajectories_from_participant_data(self.mouselab_trials)
+        traces = human_traces
 
         participant = SymmetricMouselabParticipant(
             experiment_setting=self.experiment_setting,
@@ -1,6 +1,9 @@
 """These utilities are related to cost: parameter strings, combinations and q-values"""
+import os
 import time
 from itertools import product
+from pathlib import Path
+from shutil import rmtree
 
 import dill as pickle
 import numpy as np
@@ -10,6 +13,12 @@ from mouselab.graph_utils import annotate_mdp_graph
 from mouselab.mouselab import MouselabEnv
 from numpy.random import default_rng
 
+from costometer.envs.symmetry import CanonicalMouselabEnv
+from costometer.planning_algorithms.backward_induction import backward_induction
+from costometer.planning_algorithms.q_table import QTable
+from costometer.planning_algorithms.vi import flatten_q
+from costometer.utils.q_file_manifest import get_q_file_manifest
+
 
 def save_q_values_for_cost(
     experiment_setting,
@@ -19,6 +28,8 @@ def save_q_values_for_cost(
     structure=None,
     path=None,
     verbose=True,
+    q_format="pickle",
+    symmetric=False,
     **env_params,
 ):
     """
@@ -31,10 +42,12 @@ def save_q_values_for_cost(
     :param structure: structure dictionaries extracted from json (what we use for experiments on MTurk to define location of nodes)
     :param path: Pathlib location of place to save output file
     :param verbose: whether to print out progress updates
+    :param q_format: "pickle" to save info dictionary with dill, "qtable" to save a memory-mappable Q table directory (see QTable.save)
+    :param symmetric: whether to only solve for canonical states (see MouselabSymmetry), the cost must not change when sibling subtrees are swapped
     :param env_params: kwargs, any MouselabEnv settings other than cost parameters
     :return: info dictionary which includes"
                 Q dictionary (q_dictionary key), timing, parameters, etc.
-    """
+    """  # noqa: E501
     # prevent mutable default argument
     if cost_params is None:
         cost_params = {}
@@ -50,9 +63,21 @@ def save_q_values_for_cost(
         )
 
     # solve environment
-    _, _, _, info = timed_solve_env(
-        categorical_gym_env, verbose=verbose, save_q=True, ground_truths=ground_truths
-    )
+    if symmetric:
+        if ground_truths is not None:
+            raise ValueError("ground_truths can't be used with symmetric solving.")
+        canonical_env = CanonicalMouselabEnv(categorical_gym_env)
+        Q, _, _, info = backward_induction(canonical_env, verbose=verbose)
+        # Q files are looked up through the symmetry (see QTable)
+        info["q_dictionary"] = flatten_q(Q)
+        info["symmetry"] = canonical_env.symmetry
+    else:
+        _, _, _, info = timed_solve_env(
+            categorical_gym_env,
+            verbose=verbose,
+            save_q=True,
+            ground_truths=ground_truths,
+        )
 
     # add experiment and parameter settings to info dict
     info["env_params"] = env_params
@@ -67,14 +92,58 @@ def save_q_values_for_cost(
         )
         filename = path.joinpath(
             f"{experiment_setting}/{cost_function.__name__}/"
-            f"Q_{experiment_setting}_{parameter_string}_{time.strftime('%Y%m%d-%H%M')}.pickle"  # noqa: E501
+            f"Q_{experiment_setting}_{parameter_string}_{time.strftime('%Y%m%d-%H%M')}.{q_format}"  # noqa: E501
         )
 
-        with open(filename, "wb") as f:
-            pickle.dump(info, f)
+        # written under a temporary name first, so an interrupted job never leaves
+        # a partial Q file that would be loaded later
+        temporary_filename = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+        if q_format == "pickle":
+            with open(temporary_filename, "wb") as f:
+                pickle.dump(info, f)
+        elif q_format == "qtable":
+            save_q_table(info, temporary_filename)
+            # directories can't be replaced by os.replace
+            if filename.exists():
+                rmtree(filename)
+        else:
+            raise ValueError(f"Unknown Q file format: {q_format}")
+        os.replace(temporary_filename, filename)
     return info
 
 
+def save_q_table(info, filename):
+    """
+    Save info dictionary from save_q_values_for_cost as a memory-mappable Q table directory
+    :param info: info dictionary, including Q dictionary (q_dictionary key)
+    :param filename: directory to save to, by convention ending in .qtable
+    :return: nothing
+    """  # noqa: E501
+    QTable.from_q_dictionary(info["q_dictionary"], symmetry=info.get("symmetry")).save(
+        filename,
+        info={
+            key: val
+            for key, val in info.items()
+            if key not in ["q_dictionary", "symmetry"]
+        },
+    )
+
+
+def convert_q_file(filename):
+    """
+    Convert a pickled Q file to a Q table directory next to it, the pickle is kept
+    :param filename: path to pickled Q file
+    :return: path to Q table directory
+    """
+    filename = Path(filename)
+    with open(filename, "rb") as f:
+        info = pickle.load(f)
+
+    q_table_filename = filename.with_suffix(".qtable")
+    save_q_table(info, q_table_filename)
+    return q_table_filename
+
+
 def get_param_string(cost_params):
     if isinstance(cost_params, dict):
         parameter_string = "_".join(
@@ -94,32 +163,41 @@ def get_param_string(cost_params):
     return parameter_string
 
 
-def load_q_file(experiment_setting, cost_function, cost_params, path):
+def load_q_file(experiment_setting, cost_function, cost_params, path, q_table=False):
     """
     Load Q file given experiment / cost settings
     :param experiment_setting: experiment layout
     :param cost_function: cost function
     :param cost_params: cost parameters
-    :param path: path where data is
-    :return: dictionary containing q values
-    """
+    :param path: path where data is (the Q file manifest is kept here)
+    :param q_table: whether to return q values from pickle files as a QTable (indexed by integer state ids)
+    :return: dictionary (or QTable) containing q values, Q tables saved with q_format="qtable" and Q files solved with symmetric=True are always loaded as a QTable
+    """  # noqa: E501
     parameter_string = get_param_string(cost_params=cost_params)
 
-    files = list(
-        path.glob(
-            f"{experiment_setting}/{cost_function.__name__}/"
-            f"Q_{experiment_setting}_{parameter_string}_*.pickle"
-        )  # noqa: E501
+    # latest file is looked up in the manifest, rather than globbing every time
+    latest_file = get_q_file_manifest(path).get_latest_file(
+        experiment_setting, cost_function.__name__, parameter_string
     )
 
-    if len(files) > 1:
-        print(f"Number of files: {len(files)}\n Choosing latest file.")
-    # always a list, so why not sort
-    filename = sorted(files, reverse=True)[0]
+    if latest_file["num_files"] > 1:
+        print(f"Number of files: {latest_file['num_files']}\n Choosing latest file.")
+    filename = latest_file["path"]
+
+    if filename.suffix == ".qtable":
+        # memory mapped, so loading is quick and pages are shared between processes
+        # (converting to a dictionary would undo both)
+        return QTable.load(filename)
+
     with open(filename, "rb") as f:
         info = pickle.load(f)
 
-    return info["q_dictionary"]
+    if q_table or info.get("symmetry") is not None:
+        return QTable.from_q_dictionary(
+            info["q_dictionary"], symmetry=info.get("symmetry")
+        )
+    else:
+        return info["q_dictionary"]
 
 
 def save_combination_file(combinations, filename, location):
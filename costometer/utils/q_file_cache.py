@@ -0,0 +1,136 @@
+"""Provides a cache that loads Q files on first use and keeps the most recently used ones within a memory budget."""  # noqa: E501
+import sys
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple, Union
+
+from costometer.planning_algorithms.q_table import EncodedStateInterner, QTable
+from costometer.utils.cost_utils import get_param_string, load_q_file
+
+
+def get_q_values_bytes(q_values: Union[Dict[Tuple[Any, int], float], QTable]) -> int:
+    """
+    Estimate the memory used by loaded Q values
+
+    For Q tables this is the size of their arrays (plus the interned states, if they are not encoded), for Q dictionaries the size of the dictionary plus that of its first entry for every entry.
+
+    :param q_values: dictionary (or QTable) containing q values
+    :return: estimated size in bytes
+    """  # noqa: E501
+    if isinstance(q_values, QTable):
+        if isinstance(q_values.interner, EncodedStateInterner):
+            return q_values.values.nbytes + q_values.interner.encoded_states.nbytes
+        # states are stored in a list and a dictionary by the interner
+        state_bytes = sys.getsizeof(q_values.interner.states) + sys.getsizeof(
+            q_values.interner.state_ids
+        )
+        if len(q_values.interner) > 0:
+            state_bytes += len(q_values.interner) * sys.getsizeof(q_values.interner[0])
+        return q_values.values.nbytes + state_bytes
+
+    q_values_bytes = sys.getsizeof(q_values)
+    if len(q_values) > 0:
+        (state, action), q_value = next(iter(q_values.items()))
+        q_values_bytes += len(q_values) * (
+            sys.getsizeof((state, action))
+            + sys.getsizeof(state)
+            + sys.getsizeof(q_value)
+        )
+    return q_values_bytes
+
+
+class QFileCache:
+    """
+    Least recently used cache of Q files for one experiment setting and cost function, indexed by cost parameters.
+
+    The size of a Q file is the estimated memory its loaded Q values use (see get_q_values_bytes), not its size on disk: pickled Q dictionaries are several times larger in memory.
+    The most recently used Q file is always kept, even if it is larger than the budget.
+    """  # noqa: E501
+
+    def __init__(
+        self,
+        experiment_setting: str,
+        cost_function: Callable,
+        path: Union[str, Path],
+        max_bytes: int = None,
+        q_table: bool = False,
+    ):
+        """
+        Q file cache.
+
+        :param experiment_setting: experiment setting, e.g. high_increasing
+        :param cost_function: cost function
+        :param path: path where Q files are
+        :param max_bytes: budget in bytes for the memory used by loaded Q values, if None Q files are never evicted
+        :param q_table: whether to load Q files as QTables
+        """  # noqa: E501
+        self.experiment_setting = experiment_setting
+        self.cost_function = cost_function
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.q_table = q_table
+
+        self.q_files = OrderedDict()
+        self.cached_bytes = 0
+        self.num_loads = 0
+
+    def __len__(self) -> int:
+        return len(self.q_files)
+
+    def __contains__(self, cost_params: Dict[str, Any]) -> bool:
+        return get_param_string(cost_params) in self.q_files
+
+    def __getitem__(
+        self, cost_params: Dict[str, Any]
+    ) -> Union[Dict[Tuple[Any, int], float], QTable]:
+        """
+        Get Q values for cost parameters, loading them if they are not cached
+
+        :param cost_params: cost parameters
+        :return: dictionary (or QTable) containing q values
+        """
+        parameter_string = get_param_string(cost_params)
+        if parameter_string in self.q_files:
+            self.q_files.move_to_end(parameter_string)
+            return self.q_files[parameter_string][0]
+
+        q_values = load_q_file(
+            self.experiment_setting,
+            self.cost_function,
+            cost_params,
+            self.path,
+            q_table=self.q_table,
+        )
+        self.num_loads += 1
+        q_values_bytes = get_q_values_bytes(q_values)
+
+        self.q_files[parameter_string] = (q_values, q_values_bytes)
+        self.cached_bytes += q_values_bytes
+        self.evict()
+        return q_values
+
+    def evict(self) -> None:
+        """
+        Evict least recently used Q files until cache is within budget
+
+        :return: None
+        """
+        if self.max_bytes is None:
+            return
+
+        while self.cached_bytes > self.max_bytes and len(self.q_files) > 1:
+            _, (_, q_values_bytes) = self.q_files.popitem(last=False)
+            self.cached_bytes -= q_values_bytes
+
+    def clear(self) -> None:
+        self.q_files.clear()
+        self.cached_bytes = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # loaded Q files are not pickled (e.g. when sent to other processes),
+        # they are loaded again on first use
+        return {
+            **self.__dict__,
+            "q_files": OrderedDict(),
+            "cached_bytes": 0,
+        }
@@ -0,0 +1,216 @@
+"""Provides a persistent index of Q files, so loading them does not glob the Q file directory every time."""  # noqa: E501
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Union
+
+# Q file suffixes, in increasing preference for files saved at the same time
+Q_FILE_FORMATS = ["pickle", "qtable"]
+
+
+class QFileManifest:
+    """
+    Manifest of the latest Q file for each experiment setting, cost function and parameter string (see get_param_string).
+
+    The manifest is saved as JSON in the Q file directory.
+    Each experiment_setting/cost_function directory is only listed again when its modification time changes, so a lookup usually costs a single stat.
+    """  # noqa: E501
+
+    manifest_filename = "q_file_manifest.json"
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Q file manifest, usually obtained through get_q_file_manifest
+
+        :param path: Q file directory, as passed to save_q_values_for_cost
+        """
+        self.path = Path(path)
+        self.manifest_file = self.path.joinpath(self.manifest_filename)
+
+        self.directories = {}
+        self.files = {}
+        if self.manifest_file.is_file():
+            try:
+                with open(self.manifest_file, "r") as f:
+                    manifest = json.load(f)
+                self.directories = manifest["directories"]
+                self.files = manifest["files"]
+            except (json.JSONDecodeError, KeyError):
+                # e.g. manifest was being written by another process, rebuild it
+                pass
+
+    @staticmethod
+    def get_key(
+        experiment_setting: str, cost_function_name: str, parameter_string: str
+    ) -> str:
+        return f"{experiment_setting}/{cost_function_name}/{parameter_string}"
+
+    def save(self) -> None:
+        """
+        Save manifest, replacing the old file in one step so other processes never read a partial manifest
+
+        :return: None
+        """  # noqa: E501
+        self.path.mkdir(parents=True, exist_ok=True)
+        temporary_file = self.manifest_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary_file, "w") as f:
+            json.dump({"directories": self.directories, "files": self.files}, f)
+        os.replace(temporary_file, self.manifest_file)
+
+    def refresh_directory(
+        self, experiment_setting: str, cost_function_name: str
+    ) -> bool:
+        """
+        List an experiment_setting/cost_function directory again, if it has changed since it was last listed
+
+        :param experiment_setting: experiment setting, e.g. high_increasing
+        :param cost_function_name: name of cost function
+        :return: whether the manifest changed
+        """  # noqa: E501
+        directory_key = f"{experiment_setting}/{cost_function_name}"
+        directory = self.path.joinpath(directory_key)
+
+        try:
+            directory_mtime = directory.stat().st_mtime
+        except FileNotFoundError:
+            directory_mtime = None
+
+        recorded = self.directories.get(directory_key)
+        # a directory modified within a second of being listed could have changed
+        # again without its modification time changing, so it is listed again
+        if (
+            recorded is not None
+            and recorded["mtime"] == directory_mtime
+            and (directory_mtime is None or recorded["listed"] - directory_mtime > 1)
+        ):
+            return False
+
+        listed_time = time.time()
+        directory_files = {}
+        if directory_mtime is not None:
+            prefix = f"Q_{experiment_setting}_"
+            for entry in os.scandir(directory):
+                file_stem, _, q_format = entry.name.rpartition(".")
+                if not file_stem.startswith(prefix) or q_format not in Q_FILE_FORMATS:
+                    continue
+                # file names are Q_{experiment setting}_{parameter string}_{time}
+                parameter_string, _, timestamp = file_stem[len(prefix) :].rpartition(
+                    "_"
+                )
+                key = self.get_key(
+                    experiment_setting, cost_function_name, parameter_string
+                )
+                file_info = directory_files.setdefault(key, {"num_files": 0})
+                file_info["num_files"] += 1
+                # latest timestamp, Q tables are preferred over pickles from same time
+                if "filename" not in file_info or (
+                    timestamp,
+                    Q_FILE_FORMATS.index(q_format),
+                ) > (file_info["timestamp"], Q_FILE_FORMATS.index(file_info["format"])):
+                    file_info.update(
+                        {
+                            "filename": f"{directory_key}/{entry.name}",
+                            "format": q_format,
+                            "timestamp": timestamp,
+                            "size": get_q_file_size(Path(entry.path)),
+                            "mtime": entry.stat().st_mtime,
+                        }
+                    )
+
+        self.files = {
+            key: file_info
+            for key, file_info in self.files.items()
+            if not key.startswith(f"{directory_key}/")
+        }
+        self.files.update(directory_files)
+        self.directories[directory_key] = {
+            "mtime": directory_mtime,
+            "listed": listed_time,
+        }
+        return True
+
+    def refresh(self) -> None:
+        """
+        Refresh every experiment_setting/cost_function directory in the Q file directory, and save manifest
+
+        :return: None
+        """  # noqa: E501
+        # directories in the manifest are refreshed too, in case they were removed
+        directory_keys = {
+            tuple(directory_key.split("/")) for directory_key in self.directories
+        }
+        if self.path.is_dir():
+            directory_keys.update(
+                (experiment_directory.name, cost_directory.name)
+                for experiment_directory in self.path.iterdir()
+                if experiment_directory.is_dir()
+                for cost_directory in experiment_directory.iterdir()
+                if cost_directory.is_dir()
+            )
+
+        changed = [
+            self.refresh_directory(experiment_setting, cost_function_name)
+            for experiment_setting, cost_function_name in sorted(directory_keys)
+        ]
+        if any(changed):
+            self.save()
+
+    def get_latest_file(
+        self, experiment_setting: str, cost_function_name: str, parameter_string: str
+    ) -> Dict[str, Any]:
+        """
+        Get information on the latest Q file for a setting, refreshing its directory if it has changed
+
+        :param experiment_setting: experiment setting, e.g. high_increasing
+        :param cost_function_name: name of cost function
+        :param parameter_string: parameter string, from get_param_string
+        :return: dictionary with path, size, modification time and number of Q files for the parameters
+        """  # noqa: E501
+        if self.refresh_directory(experiment_setting, cost_function_name):
+            try:
+                self.save()
+            except OSError:
+                # e.g. read-only or shared Q file directory, manifest is kept in memory
+                pass
+
+        file_info = self.files.get(
+            self.get_key(experiment_setting, cost_function_name, parameter_string)
+        )
+        if file_info is None:
+            # IndexError, which callers catch to solve missing Q files
+            raise IndexError(
+                f"No Q file for {experiment_setting}, {cost_function_name} "
+                f"and parameters {parameter_string} in {self.path}"
+            )
+        return {**file_info, "path": self.path.joinpath(file_info["filename"])}
+
+
+def get_q_file_size(filename: Path) -> int:
+    """
+    Size of a Q file, Q tables are directories of arrays
+
+    :param filename: path to Q file
+    :return: size in bytes
+    """
+    if filename.is_dir():
+        return sum(file.stat().st_size for file in filename.iterdir())
+    else:
+        return filename.stat().st_size
+
+
+# manifests already read by this process, by Q file directory
+_manifests = {}
+
+
+def get_q_file_manifest(path: Union[str, Path]) -> QFileManifest:
+    """
+    Get Q file manifest for a Q file directory, reading it only once per process
+
+    :param path: Q file directory
+    :return: Q file manifest
+    """
+    path = Path(path).resolve()
+    if path not in _manifests:
+        _manifests[path] = QFileManifest(path)
+    return _manifests[path]
@@ -0,0 +1,243 @@
+"""Solves and saves Q values for a grid of cost parameters in parallel, skipping settings that are already saved."""  # noqa: E501
+import argparse
+import csv
+import inspect
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+from mouselab import cost_functions
+
+from costometer.utils.cost_utils import (
+    create_parameter_grid,
+    get_param_string,
+    save_q_values_for_cost,
+)
+from costometer.utils.q_file_manifest import get_q_file_manifest
+
+# columns of solve_times.csv
+SOLVE_TIME_COLUMNS = ["parameter_string", "solve_time", "timestamp"]
+
+
+def get_cost_parameter_names(cost_function: Callable) -> List[str]:
+    """
+    Names of cost parameters of a cost function, in order
+
+    :param cost_function: cost function
+    :return: list of parameter names
+    """
+    return list(inspect.signature(cost_function).parameters.keys())
+
+
+def _solve_cost_setting(
+    experiment_setting: str,
+    cost_function: Callable,
+    cost_params: Dict[str, Any],
+    path: Path,
+    **kwargs,
+) -> Dict[str, Any]:
+    """
+    Solves and saves Q values for one cost setting, in a worker process
+
+    :param experiment_setting: experiment setting, e.g. high_increasing
+    :param cost_function: cost function
+    :param cost_params: cost parameters
+    :param path: Q file directory
+    :param kwargs: other arguments to save_q_values_for_cost
+    :return: dictionary with parameter string and solve time, Q values are only saved to disk
+    """  # noqa: E501
+    start_time = time.perf_counter()
+    save_q_values_for_cost(
+        experiment_setting,
+        cost_function=cost_function,
+        cost_params=cost_params,
+        path=path,
+        **kwargs,
+    )
+    return {
+        "parameter_string": get_param_string(cost_params),
+        "solve_time": time.perf_counter() - start_time,
+        **cost_params,
+    }
+
+
+def save_q_values_for_cost_grid(
+    experiment_setting: str,
+    cost_function: Callable,
+    parameter_grid: Iterable[Iterable[float]],
+    path: Path,
+    cost_parameter_names: List[str] = None,
+    num_workers: int = None,
+    q_format: str = "pickle",
+    verbose: bool = True,
+    **kwargs,
+) -> pd.DataFrame:
+    """
+    Solves and saves Q values for each cost setting on a grid, using a process pool
+
+    Settings that already have a Q file are skipped, so an interrupted job can be run again to resume.
+    The time taken to solve each setting is appended to solve_times.csv in the experiment_setting/cost_function directory as soon as it is saved, as a row with the parameter string, solve time (in seconds) and time it was saved (the header is written when the file is created).
+    Environments registered at runtime are only available to the workers if processes are started by forking (the default on Linux).
+
+    :param experiment_setting: experiment setting, e.g. high_increasing
+    :param cost_function: cost function
+    :param parameter_grid: iterable of cost parameter combinations, e.g. from create_parameter_grid
+    :param path: Q file directory
+    :param cost_parameter_names: names of cost parameters, in the same order as in parameter_grid, if None the arguments of cost_function
+    :param num_workers: number of worker processes, if None the number of processors
+    :param q_format: "pickle" or "qtable" (see save_q_values_for_cost)
+    :param verbose: whether to print out progress updates
+    :param kwargs: other arguments to save_q_values_for_cost (e.g. ground_truths, structure or environment settings)
+    :return: dataframe with parameters and solve time of each setting solved in this call
+    """  # noqa: E501
+    path = Path(path)
+    if cost_parameter_names is None:
+        cost_parameter_names = get_cost_parameter_names(cost_function)
+
+    all_cost_params = [
+        dict(zip(cost_parameter_names, np.asarray(parameters).tolist()))
+        for parameters in parameter_grid
+    ]
+
+    # skip settings that have already been solved
+    manifest = get_q_file_manifest(path)
+    unsolved_cost_params = []
+    for cost_params in all_cost_params:
+        try:
+            manifest.get_latest_file(
+                experiment_setting,
+                cost_function.__name__,
+                get_param_string(cost_params),
+            )
+        except IndexError:
+            unsolved_cost_params.append(cost_params)
+
+    if verbose:
+        print(
+            f"Solving {len(unsolved_cost_params)} of {len(all_cost_params)} "
+            f"cost settings for {experiment_setting}"
+        )
+
+    solve_time_file = path.joinpath(
+        f"{experiment_setting}/{cost_function.__name__}/solve_times.csv"
+    )
+    solve_time_file.parent.mkdir(parents=True, exist_ok=True)
+
+    solve_times = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                _solve_cost_setting,
+                experiment_setting,
+                cost_function,
+                cost_params,
+                path,
+                q_format=q_format,
+                verbose=False,
+                **kwargs,
+            )
+            for cost_params in unsolved_cost_params
+        ]
+        for future in as_completed(futures):
+            solve_time = future.result()
+            solve_times.append(solve_time)
+
+            # header is only written once, rows are appended across runs
+            write_header = (
+                not solve_time_file.is_file() or solve_time_file.stat().st_size == 0
+            )
+            with open(solve_time_file, "a", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=SOLVE_TIME_COLUMNS)
+                if write_header:
+                    writer.writeheader()
+                writer.writerow(
+                    {
+                        "parameter_string": solve_time["parameter_string"],
+                        "solve_time": solve_time["solve_time"],
+                        "timestamp": time.strftime("%Y%m%d-%H%M%S"),
+                    }
+                )
+            if verbose:
+                print(
+                    f"Solved {solve_time['parameter_string']} "
+                    f"in {solve_time['solve_time']:.2f}s "
+                    f"({len(solve_times)}/{len(unsolved_cost_params)})"
+                )
+
+    return pd.DataFrame(solve_times)
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Solve and save Q values for a grid of cost parameters."
+    )
+    parser.add_argument("experiment_setting", help="experiment setting")
+    parser.add_argument(
+        "-c",
+        "--cost-function",
+        default="linear_depth",
+        help="name of cost function in mouselab.cost_functions",
+    )
+    parser.add_argument(
+        "-p",
+        "--path",
+        type=Path,
+        default=Path("q_files"),
+        help="Q file directory",
+    )
+    parser.add_argument(
+        "-g",
+        "--grid",
+        nargs=3,
+        type=float,
+        metavar=("START", "STOP", "STEP"),
+        help="grid of values for each cost parameter (see create_parameter_grid)",
+    )
+    parser.add_argument(
+        "-f",
+        "--parameter-file",
+        type=Path,
+        help="comma separated file of cost parameter combinations, one per line "
+        "(see save_combination_file)",
+    )
+    parser.add_argument(
+        "-w", "--num-workers", type=int, default=None, help="number of processes"
+    )
+    parser.add_argument(
+        "-q", "--q-format", choices=["pickle", "qtable"], default="pickle"
+    )
+    parser.add_argument(
+        "-s",
+        "--symmetric",
+        action="store_true",
+        help="only solve for canonical states (see MouselabSymmetry)",
+    )
+    parsed_args = parser.parse_args(args)
+
+    cost_function = getattr(cost_functions, parsed_args.cost_function)
+    if parsed_args.parameter_file is not None:
+        parameter_grid = np.loadtxt(parsed_args.parameter_file, delimiter=",", ndmin=2)
+    elif parsed_args.grid is not None:
+        parameter_grid = create_parameter_grid(
+            *parsed_args.grid,
+            num_params=len(get_cost_parameter_names(cost_function)),
+        )
+    else:
+        parser.error("one of --grid or --parameter-file is required")
+
+    save_q_values_for_cost_grid(
+        parsed_args.experiment_setting,
+        cost_function,
+        parameter_grid,
+        parsed_args.path,
+        num_workers=parsed_args.num_workers,
+        q_format=parsed_args.q_format,
+        symmetric=parsed_args.symmetric,
+    )
+
+
+if __name__ == "__main__":
+    main()
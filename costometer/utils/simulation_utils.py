@@ -0,0 +1,202 @@
+"""Simulates many participants in parallel, with a reproducible random seed for each participant."""  # noqa: E501
+import itertools
+import os
+import random
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Type, Union
+
+import numpy as np
+import pandas as pd
+
+from costometer.agents.vanilla import Participant
+from costometer.utils.q_file_cache import QFileCache
+from costometer.utils.trace_shards import TraceShards, TraceShardWriter
+
+# Q files loaded in this process, by (experiment setting, cost function, path)
+_q_file_caches: Dict[Tuple[str, str, Path], QFileCache] = {}
+
+
+def seed_participant(seed_sequence: np.random.SeedSequence) -> int:
+    """
+    Seed the global random number generators (used by environments and policies) for one participant
+
+    :param seed_sequence: participant's seed sequence
+    :return: integer seed, e.g. for gym environments' seed method
+    """  # noqa: E501
+    seed = int(seed_sequence.generate_state(1)[0])
+    random.seed(seed)
+    np.random.seed(seed)
+    return seed
+
+
+def _get_preference(
+    experiment_setting: str,
+    cost_function: Callable,
+    cost_kwargs: Dict[str, Any],
+    q_path: Union[str, Path],
+) -> Any:
+    key = (experiment_setting, cost_function.__name__, Path(q_path))
+    if key not in _q_file_caches:
+        # only the most recent Q file is kept, simulations are ordered by cost setting
+        _q_file_caches[key] = QFileCache(
+            experiment_setting, cost_function, q_path, max_bytes=0
+        )
+    return _q_file_caches[key][cost_kwargs]
+
+
+def _simulate_participant(
+    participant_class: Type[Participant],
+    participant_kwargs: Dict[str, Any],
+    cost_function: Callable,
+    cost_kwargs: Dict[str, Any],
+    policy_kwargs: Dict[str, Any],
+    pid: int,
+    seed_sequence: np.random.SeedSequence,
+) -> Dict[str, List]:
+    """
+    Simulate one participant, in a worker process
+
+    :param participant_class: participant class, e.g. SymmetricMouselabParticipant
+    :param participant_kwargs: other arguments for participant class (e.g. experiment_setting and num_trials)
+    :param cost_function: cost function
+    :param cost_kwargs: cost parameters
+    :param policy_kwargs: policy parameters, with q_path instead of preference to load Q values in the worker
+    :param pid: participant id
+    :param seed_sequence: participant's seed sequence
+    :return: simulated trace
+    """  # noqa: E501
+    seed = seed_participant(seed_sequence)
+
+    policy_kwargs = dict(policy_kwargs)
+    if "q_path" in policy_kwargs:
+        policy_kwargs["preference"] = _get_preference(
+            participant_kwargs["experiment_setting"],
+            cost_function,
+            cost_kwargs,
+            policy_kwargs.pop("q_path"),
+        )
+
+    participant = participant_class(
+        **participant_kwargs,
+        cost_function=cost_function,
+        cost_kwargs=cost_kwargs,
+        policy_kwargs=policy_kwargs,
+    )
+    for env in participant.envs:
+        # gym environments have their own random number generator
+        if hasattr(env, "seed"):
+            env.seed(seed)
+
+    trace = participant.simulate_trajectory()
+    trace["pid"] = [pid] * len(trace["states"])
+    # save info used to simulate data, used by the inference classes
+    for key, value in {**cost_kwargs, **policy_kwargs}.items():
+        if np.isscalar(value):
+            trace[f"sim_{key}"] = value
+    return trace
+
+
+def simulate_participants(
+    participant_class: Type[Participant],
+    simulation_table: Union[pd.DataFrame, Iterable[Dict[str, Any]]],
+    participant_kwargs: Dict[str, Any] = None,
+    cost_function: Callable = None,
+    num_workers: int = None,
+    seed: int = None,
+    verbose: bool = True,
+    path: Union[str, Path] = None,
+    shard_size: int = 1000,
+) -> Union[List[Dict[str, List]], TraceShards]:
+    """
+    Simulate participants for many cost and policy settings, using a process pool
+
+    Each participant gets its own seed sequence (spawned from seed), so simulations are the same whatever the number of workers.
+
+    :param participant_class: participant class, e.g. SymmetricMouselabParticipant or Participant
+    :param simulation_table: rows with cost_kwargs, policy_kwargs (with preference, or q_path to load Q values from) and num_participants, and optionally participant_kwargs that update the shared ones
+    :param participant_kwargs: arguments for participant class shared by all rows (e.g. experiment_setting and num_trials, or envs)
+    :param cost_function: cost function
+    :param num_workers: number of worker processes, if None the number of processors
+    :param seed: seed for all simulations
+    :param verbose: whether to print out progress updates
+    :param path: if provided, traces are streamed to shards in this directory (see TraceShardWriter) instead of being kept in memory
+    :param shard_size: number of participants per shard, if path is provided
+    :return: simulated traces (or trace shards, if path is provided), in order of rows then participants, with pid and sim_ fields for the inference classes
+    """  # noqa: E501
+    if isinstance(simulation_table, pd.DataFrame):
+        simulation_table = simulation_table.to_dict("records")
+    if participant_kwargs is None:
+        participant_kwargs = {}
+
+    simulations = [
+        (
+            {**participant_kwargs, **row.get("participant_kwargs", {})},
+            row["cost_kwargs"],
+            row.get("policy_kwargs", {}),
+        )
+        for row in simulation_table
+        for _ in range(row["num_participants"])
+    ]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(simulations))
+
+    traces = [None] * len(simulations)
+    writer = TraceShardWriter(path, shard_size=shard_size) if path else None
+    # finished traces waiting for earlier pids, so shards are written in pid order
+    finished_traces = {}
+    next_pid = 0
+    # participants are submitted a few per worker at a time, so (when streaming to
+    # shards) memory doesn't grow with the number of simulations
+    max_pending = (num_workers or os.cpu_count() or 1) * 4
+    pending_simulations = enumerate(zip(simulations, seed_sequences))
+    futures = {}
+    num_done = 0
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            while True:
+                num_to_submit = max_pending - len(futures) - len(finished_traces)
+                for pid, (
+                    (row_participant_kwargs, cost_kwargs, policy_kwargs),
+                    seed_sequence,
+                ) in itertools.islice(pending_simulations, max(num_to_submit, 0)):
+                    future = executor.submit(
+                        _simulate_participant,
+                        participant_class,
+                        row_participant_kwargs,
+                        cost_function,
+                        cost_kwargs,
+                        policy_kwargs,
+                        pid,
+                        seed_sequence,
+                    )
+                    futures[future] = pid
+                # finished traces always wait for a pid that is still running
+                if len(futures) == 0:
+                    break
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # futures are dropped once read, so their traces can be freed
+                    pid = futures.pop(future)
+                    if writer is None:
+                        traces[pid] = future.result()
+                    else:
+                        finished_traces[pid] = future.result()
+                        while next_pid in finished_traces:
+                            writer.add(finished_traces.pop(next_pid))
+                            next_pid += 1
+                    num_done += 1
+                    if verbose and (
+                        num_done % 100 == 0 or num_done == len(simulations)
+                    ):
+                        print(f"Simulated {num_done}/{len(simulations)} participants")
+    finally:
+        # buffered traces are written even if a simulation fails, so the shards
+        # hold every participant before it
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        return traces
+    else:
+        return TraceShards(path)
@@ -0,0 +1,307 @@
+"""Provides on-disk storage of traces in shards, so large (e.g. simulated) datasets can be written and read back without holding them in memory."""  # noqa: E501
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Union
+
+import dill as pickle
+import numpy as np
+
+from costometer.agents.compiled_traces import CompiledTraces
+from costometer.planning_algorithms.q_table import EncodedStateInterner, StateInterner
+
+# optional compiled trace fields, saved if the traces have them
+OPTIONAL_FIELDS = ["blocks", "rewards", "episodes"]
+
+
+class TraceShardWriter:
+    """
+    Writes traces to a directory of shards, each a compiled set of traces for up to shard_size participants saved as a .npz file.
+
+    States are encoded (see encode_states) once per shard, and a JSON manifest lists the shards written so far, so traces can be streamed in as they are simulated and the directory can be read (by TraceShards) even if writing stopped early.
+    Writing to a directory that already has shards adds new shards after them.
+    """  # noqa: E501
+
+    manifest_filename = "manifest.json"
+    info_filename = "info.pickle"
+
+    def __init__(self, path: Union[str, Path], shard_size: int = 1000):
+        """
+        Trace shard writer.
+
+        :param path: directory to write shards to (made if needed)
+        :param shard_size: number of participants per shard
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+
+        self.shards = []
+        self.unobserved_nodes = None
+        if self.path.joinpath(self.manifest_filename).is_file():
+            with open(self.path.joinpath(self.manifest_filename), "r") as f:
+                self.shards = json.load(f)["shards"]
+            with open(self.path.joinpath(self.info_filename), "rb") as f:
+                self.unobserved_nodes = pickle.load(f)["unobserved_nodes"]
+
+        self.buffer = []
+
+    def __enter__(self) -> "TraceShardWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(self, trace: Dict[str, List]) -> None:
+        """
+        Add one participant's trace, writing a shard once shard_size traces are buffered
+
+        :param trace: trace as outputted by simulate_trajectory, must at least include states, actions and pid
+        :return: None
+        """  # noqa: E501
+        self.buffer.append(trace)
+        if len(self.buffer) >= self.shard_size:
+            self.flush()
+
+    def add_compiled(self, compiled_traces: CompiledTraces) -> None:
+        """
+        Add compiled traces (e.g. from simulate_softmax_traces), split into shards of shard_size participants
+
+        :param compiled_traces: compiled traces
+        :return: None
+        """  # noqa: E501
+        # buffered traces come first, so participants stay in the order they are added
+        self.flush()
+        for start in range(0, compiled_traces.num_participants, self.shard_size):
+            self._write_shard(
+                compiled_traces,
+                start,
+                min(start + self.shard_size, compiled_traces.num_participants),
+            )
+
+    def flush(self) -> None:
+        """
+        Write buffered traces as a shard
+
+        :return: None
+        """
+        if len(self.buffer) > 0:
+            compiled_traces = CompiledTraces.from_traces(self.buffer)
+            self.buffer = []
+            self._write_shard(compiled_traces, 0, compiled_traces.num_participants)
+
+    def close(self) -> None:
+        self.flush()
+
+    def _write_shard(
+        self, compiled_traces: CompiledTraces, start: int, stop: int
+    ) -> None:
+        """
+        Write participants start to stop of compiled traces as a shard, and update the manifest
+
+        :param compiled_traces: compiled traces
+        :param start: first participant
+        :param stop: participant after the last
+        :return: None
+        """  # noqa: E501
+        trial_start, trial_stop = compiled_traces.participant_offsets[[start, stop]]
+        decision_start, decision_stop = compiled_traces.trial_offsets[
+            [trial_start, trial_stop]
+        ]
+
+        # only the distinct states in the shard are encoded
+        unique_state_ids, state_indices = np.unique(
+            compiled_traces.state_ids[decision_start:decision_stop],
+            return_inverse=True,
+        )
+        encoded_interner, order = EncodedStateInterner.from_states(
+            [compiled_traces.interner[state_id] for state_id in unique_state_ids]
+        )
+        encoded_ids = np.empty(len(order), dtype=np.int64)
+        encoded_ids[order] = np.arange(len(order))
+
+        arrays = {
+            "encoded_states": encoded_interner.encoded_states,
+            "state_ids": encoded_ids[state_indices],
+            "actions": compiled_traces.actions[decision_start:decision_stop],
+            "trial_offsets": compiled_traces.trial_offsets[trial_start : trial_stop + 1]
+            - decision_start,
+            "participant_offsets": compiled_traces.participant_offsets[start : stop + 1]
+            - trial_start,
+            "pids": compiled_traces.pids[start:stop],
+        }
+        for field in OPTIONAL_FIELDS:
+            field_values = getattr(compiled_traces, field)
+            if field_values is not None:
+                field_slice = (
+                    slice(decision_start, decision_stop)
+                    if field == "rewards"
+                    else slice(trial_start, trial_stop)
+                )
+                arrays[field] = field_values[field_slice]
+        for field, trial_values in compiled_traces.trial_info.items():
+            arrays[f"trial_info_{field}"] = trial_values[trial_start:trial_stop]
+
+        # "sim_" fields are saved as one array each, with a value per participant
+        trace_info = compiled_traces.trace_info[start:stop]
+        for key in trace_info[0] if len(trace_info) > 0 else []:
+            arrays[f"info_{key}"] = np.asarray([info[key] for info in trace_info])
+        for array_name, array in arrays.items():
+            if array.dtype == object:
+                raise ValueError(
+                    f"{array_name} can't be saved, only numbers and strings can be."
+                )
+
+        filename = f"shard_{len(self.shards):05d}.npz"
+        np.savez(self.path.joinpath(filename), **arrays)
+
+        if encoded_interner.unobserved_nodes is not None:
+            if self.unobserved_nodes is None:
+                self.unobserved_nodes = encoded_interner.unobserved_nodes
+            else:
+                self.unobserved_nodes = [
+                    node if node is not None else shard_node
+                    for node, shard_node in zip(
+                        self.unobserved_nodes, encoded_interner.unobserved_nodes
+                    )
+                ]
+
+        self.shards.append(
+            {
+                "filename": filename,
+                "num_participants": int(stop - start),
+                "num_trials": int(trial_stop - trial_start),
+                "num_decisions": int(decision_stop - decision_start),
+            }
+        )
+        self._save_manifest()
+
+    def _save_manifest(self) -> None:
+        with open(self.path.joinpath(self.info_filename), "wb") as f:
+            pickle.dump({"unobserved_nodes": self.unobserved_nodes}, f)
+
+        # replace the old manifest in one step, as in QFileManifest.save
+        temporary_file = self.path.joinpath(self.manifest_filename).with_suffix(
+            f".{os.getpid()}.tmp"
+        )
+        with open(temporary_file, "w") as f:
+            json.dump({"shards": self.shards}, f)
+        os.replace(temporary_file, self.path.joinpath(self.manifest_filename))
+
+
+class TraceShards:
+    """
+    Reads traces written by TraceShardWriter, one shard at a time.
+
+    Like CompiledTraces, iterating gives each participant's non-decision fields ("pid", "block" and any "sim_" fields), here reading one shard at a time, so it can stand in for traces when summarizing inference results.
+    The inference classes loop over shards with iter_shards, so only one shard is in memory at once.
+    """  # noqa: E501
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Trace shards.
+
+        :param path: directory shards were written to
+        """
+        self.path = Path(path)
+        with open(self.path.joinpath(TraceShardWriter.manifest_filename), "r") as f:
+            self.shards = json.load(f)["shards"]
+        with open(self.path.joinpath(TraceShardWriter.info_filename), "rb") as f:
+            self.unobserved_nodes = pickle.load(f)["unobserved_nodes"]
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.shards)
+
+    @property
+    def num_participants(self) -> int:
+        return sum(shard["num_participants"] for shard in self.shards)
+
+    def __len__(self) -> int:
+        return self.num_participants
+
+    def load_shard(
+        self, shard_idx: int, interner: StateInterner = None
+    ) -> CompiledTraces:
+        """
+        Load one shard as compiled traces
+
+        :param shard_idx: index of shard
+        :param interner: state interner to add states to (e.g. that of a QTable, so likelihoods need no further lookups), if None states are interned by the shard's encoded states
+        :return: compiled traces
+        """  # noqa: E501
+        with np.load(
+            self.path.joinpath(self.shards[shard_idx]["filename"]), allow_pickle=False
+        ) as shard:
+            arrays = {key: shard[key] for key in shard.files}
+
+        encoded_interner = EncodedStateInterner(
+            arrays.pop("encoded_states"), unobserved_nodes=self.unobserved_nodes
+        )
+        state_ids = arrays.pop("state_ids")
+        if interner is None:
+            interner = encoded_interner
+        elif isinstance(interner, EncodedStateInterner):
+            interner_ids = interner.get_ids_for_encoded(encoded_interner.encoded_states)
+            if np.any(interner_ids < 0):
+                raise KeyError(
+                    f"{np.sum(interner_ids < 0)} state(s) are not in the interner."
+                )
+            state_ids = interner_ids[state_ids]
+        else:
+            state_ids = interner.intern_many(encoded_interner.states)[state_ids]
+
+        trial_info = {
+            key[len("trial_info_") :]: arrays.pop(key)
+            for key in list(arrays)
+            if key.startswith("trial_info_")
+        }
+
+        info_keys = [key for key in arrays if key.startswith("info_")]
+        info_values = {
+            key[len("info_") :]: arrays.pop(key).tolist() for key in info_keys
+        }
+        trace_info = [
+            dict(zip(info_values.keys(), participant_values))
+            for participant_values in zip(*info_values.values())
+        ]
+
+        return CompiledTraces(
+            interner=interner,
+            state_ids=state_ids,
+            actions=arrays["actions"],
+            trial_offsets=arrays["trial_offsets"],
+            participant_offsets=arrays["participant_offsets"],
+            pids=arrays["pids"],
+            blocks=arrays.get("blocks"),
+            rewards=arrays.get("rewards"),
+            episodes=arrays.get("episodes"),
+            trace_info=trace_info if len(info_keys) > 0 else None,
+            trial_info=trial_info,
+        )
+
+    def iter_shards(self, interner: StateInterner = None) -> Iterator[CompiledTraces]:
+        """
+        Load shards one at a time
+
+        :param interner: see load_shard
+        :return: generator of compiled traces, one per shard
+        """
+        for shard_idx in range(self.num_shards):
+            yield self.load_shard(shard_idx, interner=interner)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for compiled_traces in self.iter_shards():
+            yield from compiled_traces
+
+    def to_traces(self) -> List[Dict[str, List]]:
+        """
+        Convert every shard back to traces, e.g. for traces_to_df (this holds all traces in memory)
+
+        :return: list of traces
+        """  # noqa: E501
+        return [
+            trace
+            for compiled_traces in self.iter_shards()
+            for trace in compiled_traces.to_traces()
+        ]
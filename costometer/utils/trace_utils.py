@@ -1,8 +1,20 @@
 """These functions are used to transform human data to traces"""
+import hashlib
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from shutil import rmtree
+from typing import Any, Dict, List, Union
+
 import pandas as pd
 from mouselab.env_utils import get_num_actions
 from mouselab.envs.registry import registry
 from mouselab.mouselab import MouselabEnv
+from tqdm import tqdm
+
+from costometer.planning_algorithms.q_table import StateInterner
+from costometer.utils.trace_shards import TraceShards, TraceShardWriter
 
 
 def get_row_property(row, column):
@@ -99,31 +111,166 @@ def get_trace_from_human_row(row, experiment_setting):
     return human_trace
 
 
+def get_participant_trace(pid_df, experiment_setting):
+    """
+    Get trajectory for one participant's trials
+
+    :param pid_df: Dataframe of one participant's mouselab-mdp trials
+    :param experiment_setting: which (registered) mouselab setting is being used
+    :return: Dictionary with same structure as a `trace` in mouselab-mdp
+    """
+    dict_trace = pid_df.apply(
+        lambda row: get_trace_from_human_row(row, experiment_setting), axis=1
+    ).values
+    return {key: [sub_dict[key] for sub_dict in dict_trace] for key in dict_trace[0]}
+
+
 def get_trajectories_from_participant_data(
-    mouselab_mdp_dataframe, experiment_setting="high_increasing"
+    mouselab_mdp_dataframe,
+    experiment_setting="high_increasing",
+    state_interner: StateInterner = None,
+    num_workers: int = 1,
+    pbar: bool = True,
 ):
     """
     Get trajectories for participants in a Mouselab MDP dataframe, given an experiment setting.
 
     :param mouselab_mdp_dataframe: Dataframe of participant mouselab-mdp trials
+    :param experiment_setting: which (registered) mouselab setting is being used
+    :param state_interner: if provided, traces also include integer ids of states from this interner ("state_ids")
+    :param num_workers: number of processes participants are split over, if None the number of processors (1, the default, runs in this process, e.g. for code already running in Ray or cluster workers)
+    :param pbar: progress bar over participants
     :return: Dictionary with same structure as a `trace` in mouselab-mdp
     """  # noqa: E501
     # split dataframes into dataframe per subject
-    mouselab_dict_traces = {
-        pid: pid_df.apply(
-            lambda row: get_trace_from_human_row(row, experiment_setting), axis=1
-        ).values
-        for pid, pid_df in mouselab_mdp_dataframe.groupby("pid")
-    }
-
-    mouselab_mdp_traces = [
-        {key: [sub_dict[key] for sub_dict in dict_trace] for key in dict_trace[0]}
-        for pid, dict_trace in mouselab_dict_traces.items()
-    ]
+    pid_dfs = [pid_df for _, pid_df in mouselab_mdp_dataframe.groupby("pid")]
+
+    if num_workers == 1:
+        mouselab_mdp_traces = [
+            get_participant_trace(pid_df, experiment_setting)
+            for pid_df in tqdm(pid_dfs, disable=not pbar)
+        ]
+    else:
+        # executor.map yields results in input (groupby) order
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            mouselab_mdp_traces = list(
+                tqdm(
+                    executor.map(
+                        get_participant_trace,
+                        pid_dfs,
+                        itertools.repeat(experiment_setting),
+                    ),
+                    total=len(pid_dfs),
+                    disable=not pbar,
+                )
+            )
+
+    if state_interner is not None:
+        for trace in mouselab_mdp_traces:
+            trace["state_ids"] = [
+                state_interner.intern_many(states).tolist()
+                for states in trace["states"]
+            ]
 
     return mouselab_mdp_traces
 
 
+def get_trace_store_key(
+    mouselab_mdp_dataframe: pd.DataFrame, experiment_setting: str
+) -> str:
+    """
+    Hash of a Mouselab MDP dataframe's contents and the experiment setting, naming its trace store
+
+    :param mouselab_mdp_dataframe: Dataframe of participant mouselab-mdp trials
+    :param experiment_setting: which (registered) mouselab setting is being used
+    :return: hexadecimal hash
+    """  # noqa: E501
+    trace_store_hash = hashlib.sha256()
+    trace_store_hash.update(experiment_setting.encode())
+    trace_store_hash.update(",".join(map(str, mouselab_mdp_dataframe.columns)).encode())
+    trace_store_hash.update(
+        pd.util.hash_pandas_object(mouselab_mdp_dataframe, index=False).values.tobytes()
+    )
+    return trace_store_hash.hexdigest()[:16]
+
+
+def get_trace_store(
+    mouselab_mdp_dataframe: pd.DataFrame,
+    path: Union[str, Path],
+    experiment_setting: str = "high_increasing",
+    num_workers: int = 1,
+) -> TraceShards:
+    """
+    Get processed traces for a Mouselab MDP dataframe, converting it (with get_trajectories_from_participant_data) only the first time
+
+    Traces are stored as trace shards (see TraceShardWriter) in a directory named after the experiment setting and get_trace_store_key, so a changed dataframe is converted again.
+    Only fields needed for inference and trial by trial analyses are kept: states (as encoded state ids), actions, rewards, blocks, episodes, ground truths and trial ids.
+
+    :param mouselab_mdp_dataframe: Dataframe of participant mouselab-mdp trials
+    :param path: directory trace stores are saved to
+    :param experiment_setting: which (registered) mouselab setting is being used
+    :param num_workers: number of processes participants are converted with (see get_trajectories_from_participant_data)
+    :return: trace shards, which can also be passed to the inference classes
+    """  # noqa: E501
+    trace_store_path = Path(path).joinpath(
+        f"{experiment_setting}_"
+        f"{get_trace_store_key(mouselab_mdp_dataframe, experiment_setting)}"
+    )
+
+    if not trace_store_path.joinpath(TraceShardWriter.manifest_filename).is_file():
+        traces = get_trajectories_from_participant_data(
+            mouselab_mdp_dataframe,
+            experiment_setting=experiment_setting,
+            num_workers=num_workers,
+        )
+
+        # written elsewhere then moved, so other jobs never read a partial store
+        temporary_path = trace_store_path.with_name(
+            f"{trace_store_path.name}.{os.getpid()}.tmp"
+        )
+        rmtree(temporary_path, ignore_errors=True)
+        with TraceShardWriter(temporary_path) as writer:
+            for trace in traces:
+                writer.add(trace)
+        try:
+            os.replace(temporary_path, trace_store_path)
+        except OSError:
+            # another job saved the same trace store first
+            rmtree(temporary_path, ignore_errors=True)
+
+    return TraceShards(trace_store_path)
+
+
+def load_trajectories_from_participant_data(
+    mouselab_mdp_dataframe: pd.DataFrame,
+    path: Union[str, Path],
+    experiment_setting: str = "high_increasing",
+    pids: List[Any] = None,
+    num_workers: int = 1,
+) -> List[Dict[str, List]]:
+    """
+    Same as get_trajectories_from_participant_data, but loaded from a trace store (see get_trace_store) after the first time
+
+    :param mouselab_mdp_dataframe: Dataframe of participant mouselab-mdp trials
+    :param path: directory trace stores are saved to
+    :param experiment_setting: which (registered) mouselab setting is being used
+    :param pids: if provided, only traces for these participants are returned
+    :param num_workers: number of processes participants are converted with the first time (see get_trajectories_from_participant_data)
+    :return: list of traces, with the fields kept in trace stores
+    """  # noqa: E501
+    traces = get_trace_store(
+        mouselab_mdp_dataframe,
+        path,
+        experiment_setting=experiment_setting,
+        num_workers=num_workers,
+    ).to_traces()
+
+    if pids is not None:
+        pids = set(pids)
+        traces = [trace for trace in traces if trace["pid"][0] in pids]
+    return traces
+
+
 def traces_to_df(traces):
     """
 
@@ -1,12 +1,24 @@
 from pathlib import Path
 from shutil import rmtree
 
+import numpy as np
+import pandas as pd
 import pytest
 from mouselab.cost_functions import linear_depth
 from mouselab.envs.registry import register
 from mouselab.envs.reward_settings import high_decreasing_reward, high_increasing_reward
 
-from costometer.utils import save_q_values_for_cost
+from costometer.planning_algorithms.q_table import QTable
+from costometer.utils import (
+    QFileCache,
+    QFileManifest,
+    convert_q_file,
+    get_param_string,
+    get_q_values_bytes,
+    load_q_file,
+    save_q_values_for_cost,
+    save_q_values_for_cost_grid,
+)
 
 save_q_test_data = [
     {
@@ -65,3 +77,146 @@ def test_save_q_values_for_cost(save_q_test_cases):
     )
     # just check file is being saved
     assert ending_file_num - beginning_file_num == 1
+
+
+def test_q_table_format(save_q_test_cases):
+    experiment_setting, path, cost_kwargs = save_q_test_cases
+    info = save_q_values_for_cost(
+        experiment_setting, path=path, q_format="qtable", **cost_kwargs
+    )
+
+    # Q tables are loaded as (memory mapped) QTables, without a Q dictionary
+    q_table = load_q_file(experiment_setting, path=path, **cost_kwargs)
+    assert isinstance(q_table, QTable)
+    for (state, action), q_value in info["q_dictionary"].items():
+        assert q_table[(state, action)] == q_value
+    assert q_table.to_q_dictionary() == info["q_dictionary"]
+
+
+@pytest.mark.parametrize("q_format", ["pickle", "qtable"])
+def test_symmetric_q_file(save_q_test_cases, q_format):
+    experiment_setting, path, cost_kwargs = save_q_test_cases
+    info = save_q_values_for_cost(experiment_setting, **cost_kwargs)
+    symmetric_info = save_q_values_for_cost(
+        experiment_setting, path=path, q_format=q_format, symmetric=True, **cost_kwargs
+    )
+    assert len(symmetric_info["q_dictionary"]) < len(info["q_dictionary"])
+
+    # every state can be looked up through its canonical state
+    q_table = load_q_file(experiment_setting, path=path, **cost_kwargs)
+    for (state, action), q_value in info["q_dictionary"].items():
+        assert np.isclose(q_table[(state, action)], q_value)
+
+
+def test_convert_q_file(save_q_test_cases):
+    experiment_setting, path, cost_kwargs = save_q_test_cases
+    info = save_q_values_for_cost(experiment_setting, path=path, **cost_kwargs)
+
+    (pickle_file,) = path.glob(
+        f"{experiment_setting}/{cost_kwargs['cost_function'].__name__}/*.pickle"
+    )
+    assert convert_q_file(pickle_file).is_dir()
+    q_table = load_q_file(experiment_setting, path=path, **cost_kwargs)
+    assert q_table.to_q_dictionary() == info["q_dictionary"]
+
+
+def test_q_file_manifest(save_q_test_cases):
+    experiment_setting, path, cost_kwargs = save_q_test_cases
+    cost_function_name = cost_kwargs["cost_function"].__name__
+    parameter_string = get_param_string(cost_kwargs["cost_params"])
+
+    save_q_values_for_cost(experiment_setting, path=path, **cost_kwargs)
+    load_q_file(experiment_setting, path=path, **cost_kwargs)
+    assert path.joinpath(QFileManifest.manifest_filename).is_file()
+
+    # a new manifest reads the saved one
+    manifest = QFileManifest(path)
+    latest_file = manifest.get_latest_file(
+        experiment_setting, cost_function_name, parameter_string
+    )
+    assert latest_file["path"].suffix == ".pickle"
+    assert latest_file["size"] == latest_file["path"].stat().st_size
+
+    # new files are picked up
+    convert_q_file(latest_file["path"])
+    latest_file = manifest.get_latest_file(
+        experiment_setting, cost_function_name, parameter_string
+    )
+    assert latest_file["path"].suffix == ".qtable"
+    assert latest_file["num_files"] == 2
+
+    with pytest.raises(IndexError):
+        manifest.get_latest_file(experiment_setting, cost_function_name, "missing")
+
+
+def test_q_file_cache(save_q_test_cases):
+    experiment_setting, path, cost_kwargs = save_q_test_cases
+    other_cost_params = {
+        key: val + 1 for key, val in cost_kwargs["cost_params"].items()
+    }
+    for cost_params in [cost_kwargs["cost_params"], other_cost_params]:
+        save_q_values_for_cost(
+            experiment_setting,
+            cost_function=cost_kwargs["cost_function"],
+            cost_params=cost_params,
+            path=path,
+        )
+
+    q_files = QFileCache(
+        experiment_setting, cost_kwargs["cost_function"], path, max_bytes=1
+    )
+    assert len(q_files) == 0
+    q_dictionary = q_files[cost_kwargs["cost_params"]]
+    assert q_files[cost_kwargs["cost_params"]] is q_dictionary
+    assert q_files.num_loads == 1
+    # budget is charged what the loaded Q values use in memory, not their file size
+    assert q_files.cached_bytes == get_q_values_bytes(q_dictionary)
+
+    # only most recently used Q file fits in budget
+    q_files[other_cost_params]
+    assert len(q_files) == 1
+    assert cost_kwargs["cost_params"] not in q_files
+    assert q_files.num_loads == 2
+
+
+def test_save_q_values_for_cost_grid(save_q_test_cases):
+    experiment_setting, path, cost_kwargs = save_q_test_cases
+    cost_directory = path.joinpath(
+        f"{experiment_setting}/{cost_kwargs['cost_function'].__name__}/"
+    )
+    parameter_grid = [[0, 1], [1, 0], [1, 1]]
+
+    # one setting is already solved
+    save_q_values_for_cost(
+        experiment_setting,
+        path=path,
+        cost_function=cost_kwargs["cost_function"],
+        cost_params={"depth_cost_weight": 1, "static_cost_weight": 1},
+    )
+    solve_times = save_q_values_for_cost_grid(
+        experiment_setting,
+        cost_kwargs["cost_function"],
+        parameter_grid,
+        path,
+        cost_parameter_names=["depth_cost_weight", "static_cost_weight"],
+        num_workers=2,
+    )
+    assert len(solve_times) == 2
+    assert len(list(cost_directory.glob("Q_*.pickle"))) == 3
+    # header, then one row per solved setting
+    solve_time_df = pd.read_csv(cost_directory.joinpath("solve_times.csv"))
+    assert list(solve_time_df) == ["parameter_string", "solve_time", "timestamp"]
+    assert set(solve_time_df["parameter_string"]) == set(
+        solve_times["parameter_string"]
+    )
+
+    # running again solves nothing
+    solve_times = save_q_values_for_cost_grid(
+        experiment_setting,
+        cost_kwargs["cost_function"],
+        parameter_grid,
+        path,
+        cost_parameter_names=["depth_cost_weight", "static_cost_weight"],
+    )
+    assert len(solve_times) == 0
+    assert len(list(cost_directory.glob("*.tmp"))) == 0
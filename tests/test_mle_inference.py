@@ -2,6 +2,7 @@ import itertools
 from copy import deepcopy
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import pytest
 from mouselab.cost_functions import linear_depth
@@ -10,7 +11,11 @@ from mouselab.envs.registry import register
 from mouselab.envs.reward_settings import high_decreasing_reward, high_increasing_reward
 from mouselab.policies import RandomPolicy, SoftmaxPolicy
 
-from costometer.agents.vanilla import SymmetricMouselabParticipant
+from costometer.agents.compiled_traces import CompiledTraces
+from costometer.agents.vanilla import (
+    SoftmaxLikelihoodParticipant,
+    SymmetricMouselabParticipant,
+)
 from costometer.inference.grid import GridInference
 from costometer.utils import load_q_file, save_q_values_for_cost
 
@@ -199,3 +204,99 @@ def test_mle_run(mle_test_cases):
 
     for key, val in correct_inference.items():
         assert results.loc[results["map"].idxmax(), key] == val
+
+
+def test_batch_temperatures(mle_test_cases):
+    traces, softmax_inference_agent_kwargs, _, _ = mle_test_cases
+
+    softmax_inference_agent_kwargs = deepcopy(softmax_inference_agent_kwargs)
+    del softmax_inference_agent_kwargs["held_constant_policy_kwargs"]["temp"]
+    softmax_inference_agent_kwargs["policy_parameters"] = {
+        "temp": Categorical([0.1, 1, 10])
+    }
+
+    mle_algorithm = GridInference(traces, **softmax_inference_agent_kwargs)
+    batch_mle_algorithm = GridInference(
+        traces, **softmax_inference_agent_kwargs, batch_temperatures=True
+    )
+    assert len(batch_mle_algorithm.optimization_space) * 3 == len(
+        mle_algorithm.optimization_space
+    )
+
+    mle_algorithm.run()
+    batch_mle_algorithm.run()
+
+    parameters = ["temp", "depth_cost_weight", "static_cost_weight"]
+    results = mle_algorithm.get_optimization_results().sort_values(parameters)
+    batch_results = batch_mle_algorithm.get_optimization_results().sort_values(
+        parameters
+    )
+    for field in ["mle", "map"] + parameters:
+        assert np.allclose(results[field], batch_results[field])
+
+
+def test_compiled_traces(mle_test_cases):
+    traces, softmax_inference_agent_kwargs, _, _ = mle_test_cases
+
+    mle_algorithm = GridInference(traces, **softmax_inference_agent_kwargs)
+    compiled_mle_algorithm = GridInference(
+        CompiledTraces.from_traces(traces), **softmax_inference_agent_kwargs
+    )
+
+    mle_algorithm.run()
+    compiled_mle_algorithm.run()
+
+    results = mle_algorithm.get_optimization_results()
+    compiled_results = compiled_mle_algorithm.get_optimization_results()
+    for field in ["mle", "map", "trace_pid"]:
+        assert np.allclose(results[field], compiled_results[field])
+    assert (
+        mle_algorithm.get_best_parameters()
+        == compiled_mle_algorithm.get_best_parameters()
+    )
+
+
+def test_likelihood_participant(mle_test_cases):
+    traces, softmax_inference_agent_kwargs, _, _ = mle_test_cases
+
+    mle_algorithm = GridInference(traces, **softmax_inference_agent_kwargs)
+    likelihood_mle_algorithm = GridInference(
+        traces,
+        **{
+            **softmax_inference_agent_kwargs,
+            "participant_class": SoftmaxLikelihoodParticipant,
+        },
+    )
+
+    mle_algorithm.run()
+    likelihood_mle_algorithm.run()
+
+    assert np.allclose(
+        mle_algorithm.get_optimization_results()["map"],
+        likelihood_mle_algorithm.get_optimization_results()["map"],
+    )
+
+
+def test_q_cache(mle_test_cases):
+    traces, softmax_inference_agent_kwargs, _, _ = mle_test_cases
+
+    mle_algorithm = GridInference(traces, **softmax_inference_agent_kwargs)
+    budget_mle_algorithm = GridInference(
+        traces, **softmax_inference_agent_kwargs, q_cache_bytes=1
+    )
+
+    mle_algorithm.run()
+    budget_mle_algorithm.run()
+
+    # configs are ordered by cost setting, so each Q file is only loaded once
+    assert budget_mle_algorithm.q_files.num_loads == np.prod(
+        [
+            len(cost_prior.vals)
+            for cost_prior in softmax_inference_agent_kwargs["cost_parameters"].values()
+        ]
+    )
+    assert len(budget_mle_algorithm.q_files) == 1
+    assert np.allclose(
+        mle_algorithm.get_optimization_results()["map"],
+        budget_mle_algorithm.get_optimization_results()["map"],
+    )
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from mouselab.envs.registry import register
+from mouselab.envs.reward_settings import high_decreasing_reward, high_increasing_reward
+
+from costometer.envs.discrete import ModifiedCliffWalkingEnv
+from costometer.envs.discrete_costs import distance_bonus
+from costometer.envs.modified_mouselab import ModifiedMouseLabEnv
+from costometer.planning_algorithms.pi import (
+    modified_policy_iteration,
+    policy_iteration,
+)
+from costometer.planning_algorithms.vi import value_iteration
+
+pi_test_data = [
+    {
+        "name": "small_increasing",
+        "branching": [2, 2],
+        "reward_inputs": ["depth"],
+        "reward_dictionary": high_increasing_reward,
+    },
+    {
+        "name": "small_decreasing",
+        "branching": [2, 2],
+        "reward_inputs": ["depth"],
+        "reward_dictionary": high_decreasing_reward,
+    },
+]
+
+
+@pytest.fixture(params=pi_test_data)
+def pi_test_cases(request):
+    register(**request.param)
+    yield request.param["name"]
+
+
+@pytest.mark.parametrize("solver", [policy_iteration, modified_policy_iteration])
+def test_policy_iteration(pi_test_cases, solver):
+    setting = pi_test_cases
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+
+    Q, V, _, _ = value_iteration(env)
+    pi_Q, pi_V, _, info = solver(env)
+
+    assert info["num_iterations"] > 0
+    for state in env.P.keys():
+        assert np.isclose(V[state], pi_V[state])
+        for action in env.actions(state):
+            assert np.isclose(Q[state][action], pi_Q[state][action])
+
+
+@pytest.mark.parametrize("gamma", [1.0, 0.9])
+@pytest.mark.parametrize("solver", [policy_iteration, modified_policy_iteration])
+def test_policy_iteration_gridworld(solver, gamma):
+    env = ModifiedCliffWalkingEnv(
+        cost_function=distance_bonus,
+        cost_kwargs={
+            "distance_cost_weight": 0.1,
+            "positions_in_question": [(3, 11)],
+            "env_shape": (4, 12),
+        },
+    )
+
+    _, V, _, _ = value_iteration(env, gamma=gamma, epsilon=1e-10)
+    _, pi_V, _, info = solver(env, gamma=gamma, epsilon=1e-10)
+
+    assert info["solve_time"] > 0
+    for state in env.P.keys():
+        assert np.isclose(V[state], pi_V[state])
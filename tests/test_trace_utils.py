@@ -0,0 +1,154 @@
+from pathlib import Path
+from shutil import rmtree
+
+import pandas as pd
+import pytest
+from mouselab.envs.registry import register
+from mouselab.envs.reward_settings import high_increasing_reward
+from mouselab.mouselab import MouselabEnv
+
+from costometer.utils.trace_utils import (
+    get_trace_store,
+    get_trajectories_from_participant_data,
+    load_trajectories_from_participant_data,
+)
+
+trace_utils_test_data = [
+    {
+        "env": {
+            "name": "small_increasing",
+            "branching": [2, 2],
+            "reward_inputs": ["depth"],
+            "reward_dictionary": high_increasing_reward,
+        },
+        "num_participants": 4,
+        "num_trials": 3,
+    },
+]
+
+
+@pytest.fixture(params=trace_utils_test_data)
+def trace_utils_test_cases(request):
+    register(**request.param["env"])
+    setting = request.param["env"]["name"]
+
+    # mouselab-mdp dataframe, with fields saved as strings as in the csv files
+    rows = []
+    for pid in range(request.param["num_participants"]):
+        for trial_index in range(request.param["num_trials"]):
+            ground_truth = MouselabEnv.new_symmetric_registered(
+                setting
+            ).ground_truth.tolist()
+            clicks = list(range(1, len(ground_truth)))[: pid + trial_index]
+            rows.append(
+                {
+                    "pid": pid,
+                    "trial_index": trial_index,
+                    "trial_id": pid * 100 + trial_index,
+                    "block": "test",
+                    "state_rewards": str(ground_truth[1:]),
+                    "queries": str(
+                        {"click": {"state": {"target": [str(c) for c in clicks]}}}
+                    ),
+                    "actions": "[]",
+                    "action_times": "[]",
+                    "rewards": "[]",
+                    "path": "[]",
+                }
+            )
+
+    yield setting, pd.DataFrame(rows)
+
+
+def test_parallel_trajectories_from_participant_data(trace_utils_test_cases):
+    setting, mouselab_mdp_dataframe = trace_utils_test_cases
+
+    # shuffled rows, participants are still returned in groupby (pid) order
+    mouselab_mdp_dataframe = mouselab_mdp_dataframe.sample(frac=1, random_state=0)
+    traces = get_trajectories_from_participant_data(
+        mouselab_mdp_dataframe, experiment_setting=setting, num_workers=1
+    )
+    parallel_traces = get_trajectories_from_participant_data(
+        mouselab_mdp_dataframe, experiment_setting=setting, num_workers=2
+    )
+
+    assert [trace["pid"][0] for trace in parallel_traces] == sorted(
+        mouselab_mdp_dataframe["pid"].unique()
+    )
+    assert len(parallel_traces) == len(traces)
+    for trace, parallel_trace in zip(traces, parallel_traces):
+        assert trace.keys() == parallel_trace.keys()
+        for field in ["states", "actions", "rewards", "pid", "i_episode", "trial_id"]:
+            assert trace[field] == parallel_trace[field]
+
+
+def test_trace_store(trace_utils_test_cases):
+    setting, mouselab_mdp_dataframe = trace_utils_test_cases
+
+    output_path = Path(__file__).parents[0].joinpath("./outputs/trace_stores")
+    rmtree(output_path, ignore_errors=True)
+
+    trace_store = get_trace_store(
+        mouselab_mdp_dataframe, output_path, experiment_setting=setting
+    )
+    assert len(trace_store) == mouselab_mdp_dataframe["pid"].nunique()
+    manifest_time = trace_store.path.joinpath("manifest.json").stat().st_mtime_ns
+
+    # same dataframe, so the store is reused rather than converted again
+    reused_trace_store = get_trace_store(
+        mouselab_mdp_dataframe, output_path, experiment_setting=setting
+    )
+    assert reused_trace_store.path == trace_store.path
+    assert (
+        reused_trace_store.path.joinpath("manifest.json").stat().st_mtime_ns
+        == manifest_time
+    )
+    assert len(list(output_path.iterdir())) == 1
+
+    # changed dataframe is converted again, to a new store
+    changed_trace_store = get_trace_store(
+        mouselab_mdp_dataframe.assign(block="train"),
+        output_path,
+        experiment_setting=setting,
+    )
+    assert changed_trace_store.path != trace_store.path
+    assert all(
+        block == "train" for trace in changed_trace_store for block in trace["block"]
+    )
+    assert len(list(output_path.iterdir())) == 2
+
+    rmtree(output_path)
+
+
+def test_load_trajectories_from_participant_data(trace_utils_test_cases):
+    setting, mouselab_mdp_dataframe = trace_utils_test_cases
+
+    output_path = Path(__file__).parents[0].joinpath("./outputs/trace_stores")
+    rmtree(output_path, ignore_errors=True)
+
+    traces = get_trajectories_from_participant_data(
+        mouselab_mdp_dataframe, experiment_setting=setting, num_workers=1
+    )
+    loaded_traces = load_trajectories_from_participant_data(
+        mouselab_mdp_dataframe, output_path, experiment_setting=setting
+    )
+    assert len(loaded_traces) == len(traces)
+    for trace, loaded_trace in zip(traces, loaded_traces):
+        for field in ["actions", "pid", "block", "i_episode", "trial_id"]:
+            assert trace[field] == loaded_trace[field]
+        assert trace["ground_truth"] == loaded_trace["ground_truth"]
+        # stores only keep the states actions were taken in
+        assert [
+            trial_states[: len(trial_actions)]
+            for trial_states, trial_actions in zip(trace["states"], trace["actions"])
+        ] == loaded_trace["states"]
+
+    # only the requested participants, in the same order
+    filtered_traces = load_trajectories_from_participant_data(
+        mouselab_mdp_dataframe, output_path, experiment_setting=setting, pids=[2, 0]
+    )
+    assert [trace["pid"][0] for trace in filtered_traces] == [0, 2]
+    for trace in filtered_traces:
+        assert trace["actions"] == traces[trace["pid"][0]]["actions"]
+
+    rmtree(output_path)
@@ -1,5 +1,6 @@
 from copy import deepcopy
 from pathlib import Path
+from shutil import rmtree
 
 import dill as pickle
 import numpy as np
@@ -9,13 +10,22 @@ from mouselab.envs.registry import register
 from mouselab.envs.reward_settings import high_decreasing_reward, high_increasing_reward
 from mouselab.policies import SoftmaxPolicy
 
-from costometer.agents.vanilla import Participant, SymmetricMouselabParticipant
+from costometer.agents.softmax_simulation import simulate_softmax_traces
+from costometer.agents.vanilla import (
+    Participant,
+    SoftmaxLikelihoodParticipant,
+    SymmetricMouselabParticipant,
+)
 from costometer.envs.discrete import (
     ModifiedCliffWalkingEnv,
     ModifiedVerySimpleGridWorld,
 )
 from costometer.envs.discrete_costs import distance_bonus
+from costometer.envs.modified_mouselab import ModifiedMouseLabEnv
+from costometer.planning_algorithms.q_table import QTable
 from costometer.planning_algorithms.vi import flatten_q, value_iteration
+from costometer.utils.simulation_utils import simulate_participants
+from costometer.utils.trace_shards import TraceShards, TraceShardWriter
 
 vanilla_agent_test_data = [
     {
@@ -215,3 +225,233 @@ def test_discrete_simulate_and_infer(discrete_env_test_cases):
     assert [len(trial) for trial in logliks] == [
         len(actions) for actions in participant.trace["actions"]
     ]
+
+
+def test_batch_likelihood(vanilla_agent_test_cases):
+    setting, additional_settings = vanilla_agent_test_cases
+    with open(
+        Path(__file__).parents[0].joinpath(f"inputs/{setting}_q_function.pickle"), "rb"
+    ) as q_file:
+        q_function = pickle.load(q_file)
+
+    participant = SymmetricMouselabParticipant(
+        setting,
+        policy_kwargs={"preference": q_function, "temp": 10},
+        **additional_settings,
+    )
+    participant.simulate_trajectory()
+
+    logliks = participant.compute_likelihood(participant.trace)
+    batch_logliks = participant.compute_batch_likelihood(participant.trace)
+
+    assert [len(trial) for trial in batch_logliks] == [
+        len(trial) for trial in logliks
+    ]
+    assert np.allclose(
+        np.exp(np.concatenate(batch_logliks)), np.exp(np.concatenate(logliks))
+    )
+
+    # participant without environments gives the same likelihoods
+    likelihood_participant = SoftmaxLikelihoodParticipant(
+        setting,
+        policy_kwargs={"preference": q_function, "temp": 10},
+        **additional_settings,
+    )
+    assert likelihood_participant.compute_likelihood(participant.trace) == batch_logliks
+
+    # list of traces gives one set of likelihoods per trace
+    assert participant.compute_batch_likelihood(
+        [participant.trace, participant.trace]
+    ) == [batch_logliks, batch_logliks]
+
+
+def test_discrete_batch_likelihood(discrete_env_test_cases):
+    discrete_class, num_trials, cost_function, cost_kwargs = discrete_env_test_cases
+    envs = [
+        discrete_class(cost_function=cost_function, cost_kwargs=cost_kwargs)
+        for _ in range(num_trials)
+    ]
+    Q, _, _, _ = value_iteration(envs[0])
+    participant = Participant(
+        envs=envs,
+        num_trials=1,
+        cost_function=None,
+        cost_kwargs={},
+        policy_function=SoftmaxPolicy,
+        policy_kwargs={"preference": flatten_q(Q)},
+    )
+    participant.simulate_trajectory()
+
+    assert np.allclose(
+        np.exp(
+            np.concatenate(participant.compute_batch_likelihood(participant.trace))
+        ),
+        np.exp(np.concatenate(participant.compute_likelihood(participant.trace))),
+    )
+
+
+def test_simulate_participants(vanilla_agent_test_cases):
+    setting, additional_settings = vanilla_agent_test_cases
+    with open(
+        Path(__file__).parents[0].joinpath(f"inputs/{setting}_q_function.pickle"), "rb"
+    ) as q_file:
+        q_function = pickle.load(q_file)
+
+    simulation_table = [
+        {
+            "cost_kwargs": {},
+            "policy_kwargs": {"preference": q_function, "temp": temp},
+            "num_participants": 2,
+        }
+        for temp in [1, 10]
+    ]
+    participant_kwargs = {"experiment_setting": setting, **additional_settings}
+
+    traces = simulate_participants(
+        SymmetricMouselabParticipant,
+        simulation_table,
+        participant_kwargs=participant_kwargs,
+        num_workers=1,
+        seed=91,
+        verbose=False,
+    )
+    # simulations don't depend on the number of workers
+    parallel_traces = simulate_participants(
+        SymmetricMouselabParticipant,
+        simulation_table,
+        participant_kwargs=participant_kwargs,
+        num_workers=2,
+        seed=91,
+        verbose=False,
+    )
+    for trace, parallel_trace in zip(traces, parallel_traces):
+        assert trace["actions"] == parallel_trace["actions"]
+        assert trace["rewards"] == parallel_trace["rewards"]
+
+    assert [trace["sim_temp"] for trace in traces] == [1, 1, 10, 10]
+    for pid, trace in enumerate(traces):
+        assert trace["pid"] == [pid] * additional_settings["num_trials"]
+
+
+def test_simulate_softmax_traces(vanilla_agent_test_cases):
+    setting, additional_settings = vanilla_agent_test_cases
+    with open(
+        Path(__file__).parents[0].joinpath(f"inputs/{setting}_q_function.pickle"), "rb"
+    ) as q_file:
+        q_function = pickle.load(q_file)
+
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+    q_table = QTable.from_q_dictionary(q_function, num_actions=env.action_space.n)
+    compiled_traces = simulate_softmax_traces(
+        q_table,
+        env.init,
+        num_participants=4,
+        num_trials=additional_settings["num_trials"],
+        temps=[0.1, 1, 10, 100],
+        seed=91,
+    )
+
+    assert compiled_traces.num_trials == 4 * additional_settings["num_trials"]
+    assert [trace["sim_temp"] for trace in compiled_traces] == [0.1, 1, 10, 100]
+    for trace in compiled_traces.to_traces():
+        for states, actions in zip(trace["states"], trace["actions"]):
+            # every trial ends with the termination action, clicks reveal nodes
+            assert actions[-1] == env.term_action
+            for state, action, next_state in zip(states, actions, states[1:]):
+                assert hasattr(state[action], "sample")
+                assert not hasattr(next_state[action], "sample")
+
+    # same simulation from the same seed
+    assert np.array_equal(
+        compiled_traces.actions,
+        simulate_softmax_traces(
+            q_table,
+            env.init,
+            num_participants=4,
+            num_trials=additional_settings["num_trials"],
+            temps=[0.1, 1, 10, 100],
+            seed=91,
+        ).actions,
+    )
+
+
+def test_trace_shards(vanilla_agent_test_cases):
+    setting, additional_settings = vanilla_agent_test_cases
+    with open(
+        Path(__file__).parents[0].joinpath(f"inputs/{setting}_q_function.pickle"), "rb"
+    ) as q_file:
+        q_function = pickle.load(q_file)
+
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+    q_table = QTable.from_q_dictionary(q_function, num_actions=env.action_space.n)
+    compiled_traces = simulate_softmax_traces(
+        q_table,
+        env.init,
+        num_participants=10,
+        num_trials=additional_settings["num_trials"],
+        temps=np.linspace(0.1, 10, 10),
+        seed=91,
+    )
+
+    output_path = Path(__file__).parents[0].joinpath("./outputs/trace_shards")
+    rmtree(output_path, ignore_errors=True)
+    with TraceShardWriter(output_path, shard_size=3) as writer:
+        writer.add_compiled(compiled_traces)
+    trace_shards = TraceShards(output_path)
+
+    assert trace_shards.num_shards == 4
+    assert len(trace_shards) == 10
+    for trace, shard_trace in zip(
+        compiled_traces.to_traces(), trace_shards.to_traces()
+    ):
+        assert trace["states"] == shard_trace["states"]
+        assert trace["actions"] == shard_trace["actions"]
+        assert trace["sim_temp"] == shard_trace["sim_temp"]
+
+    # shards loaded with the Q table's interner give the same likelihoods
+    shard_likelihoods = np.concatenate(
+        [
+            shard.compute_trial_likelihoods(q_table, 1, env.action_space.n)
+            for shard in trace_shards.iter_shards(interner=q_table.interner)
+        ]
+    )
+    assert np.allclose(
+        shard_likelihoods,
+        compiled_traces.compute_trial_likelihoods(q_table, 1, env.action_space.n),
+    )
+    rmtree(output_path, ignore_errors=True)
+
+
+def test_trace_shards_trial_info(vanilla_agent_test_cases):
+    setting, additional_settings = vanilla_agent_test_cases
+    with open(
+        Path(__file__).parents[0].joinpath(f"inputs/{setting}_q_function.pickle"), "rb"
+    ) as q_file:
+        q_function = pickle.load(q_file)
+
+    num_trials = additional_settings["num_trials"]
+    ground_truths = [
+        ModifiedMouseLabEnv.new_symmetric_registered(setting).ground_truth.tolist()
+        for _ in range(num_trials)
+    ]
+    participant = SymmetricMouselabParticipant(
+        setting,
+        ground_truths=ground_truths,
+        trial_ids=list(range(num_trials)),
+        policy_kwargs={"preference": q_function},
+        **additional_settings,
+    )
+    trace = participant.simulate_trajectory()
+    trace["pid"] = [0] * num_trials
+
+    output_path = Path(__file__).parents[0].joinpath("./outputs/trace_shards")
+    rmtree(output_path, ignore_errors=True)
+    with TraceShardWriter(output_path) as writer:
+        writer.add(trace)
+    (shard_trace,) = TraceShards(output_path).to_traces()
+
+    # ground truths and trial ids are kept, e.g. for processed human data
+    assert shard_trace["ground_truth"] == ground_truths
+    assert shard_trace["trial_id"] == list(range(num_trials))
+    assert shard_trace["actions"] == trace["actions"]
+    rmtree(output_path, ignore_errors=True)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from costometer.envs.discrete import ModifiedCliffWalkingEnv
+from costometer.envs.discrete_costs import distance_bonus
+from costometer.envs.vectorized import VectorizedDiscreteEnv
+
+
+@pytest.fixture
+def cliff_walking_env():
+    yield ModifiedCliffWalkingEnv(
+        cost_function=distance_bonus,
+        cost_kwargs={
+            "distance_cost_weight": 0.1,
+            "positions_in_question": [(3, 11)],
+            "env_shape": (4, 12),
+        },
+    )
+
+
+def test_vectorized_step(cliff_walking_env):
+    num_envs = 8
+    vectorized_env = VectorizedDiscreteEnv(cliff_walking_env, num_envs, seed=0)
+    states = vectorized_env.reset()
+    assert np.all(states == cliff_walking_env.initial_states[0])
+
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        actions = rng.integers(cliff_walking_env.nA, size=num_envs)
+        previous_dones = vectorized_env.dones
+        next_states, rewards, dones = vectorized_env.step(actions)
+
+        # cliff walking is deterministic, so each copy matches a single step
+        for env_idx in np.flatnonzero(~previous_dones):
+            cliff_walking_env.s = states[env_idx]
+            state, reward, done, _ = cliff_walking_env.step(actions[env_idx])
+            assert next_states[env_idx] == (-1 if done else state)
+            assert np.isclose(rewards[env_idx], reward)
+            assert dones[env_idx] == done
+        assert np.all(rewards[previous_dones] == 0)
+        states = next_states
+
+
+def test_vectorized_seed(cliff_walking_env):
+    first_env = VectorizedDiscreteEnv(cliff_walking_env, 4, seed=1)
+    second_env = VectorizedDiscreteEnv(cliff_walking_env, 4, seed=1)
+
+    assert np.all(first_env.reset() == second_env.reset())
+    for action in [0, 1, 2, 1]:
+        assert np.all(first_env.step(action)[0] == second_env.step(action)[0])
@@ -1,11 +1,27 @@
+import itertools
+
+import numpy as np
 import pytest
 from mouselab.distributions import Categorical
 from mouselab.envs.registry import register
 from mouselab.envs.reward_settings import high_decreasing_reward, high_increasing_reward
 from mouselab.exact_utils import timed_solve_env
 
+from costometer.envs.discrete import ModifiedCliffWalkingEnv, ModifiedGridWorld
+from costometer.envs.discrete_costs import distance_bonus, potential_distance_bonus
 from costometer.envs.modified_mouselab import ModifiedMouseLabEnv
-from costometer.planning_algorithms.vi import flatten_q, value_iteration
+from costometer.envs.symmetry import CanonicalMouselabEnv
+from costometer.planning_algorithms.backward_induction import backward_induction
+from costometer.planning_algorithms.compiled_mdp import CompiledMDP
+from costometer.planning_algorithms.q_table import QTable
+from costometer.planning_algorithms.vi import (
+    batched_value_iteration,
+    flatten_q,
+    get_cost_grid_path,
+    sparse_value_iteration,
+    value_iteration,
+    warm_started_value_iteration,
+)
 
 vi_test_data = [
     {
@@ -51,6 +67,27 @@ def test_value_iteration(vi_test_cases):
             assert info["q_dictionary"][(state, action)] == Q[state][action]
 
 
+def test_lazy_transitions(vi_test_cases):
+    setting = vi_test_cases
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+
+    # every combination of revealed and unrevealed nodes is reachable
+    possibilities = [
+        node.vals + tuple([node]) if hasattr(node, "sample") else tuple([node])
+        for node in env.init
+    ]
+    all_states = set(itertools.product(*possibilities)) | {env.terminal_state}
+    assert set(env.P.keys()) == all_states
+    assert len(env.P) == len(all_states)
+
+    for state in env.P.keys():
+        assert env.P[state].keys() == set(env.actions(state))
+        for action in env.actions(state):
+            assert [(p, s1, r) for p, s1, r, _ in env.P[state][action]] == list(
+                env.results(state, action)
+            )
+
+
 def test_flatten_q(vi_test_cases):
     setting = vi_test_cases
     env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
@@ -62,3 +99,241 @@ def test_flatten_q(vi_test_cases):
 
     for key, val in flattened_q.items():
         assert info["q_dictionary"][key] == val
+
+
+def test_q_table(vi_test_cases):
+    setting = vi_test_cases
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+
+    Q, _, _, _ = value_iteration(env)
+    _, _, _, info = timed_solve_env(env, save_q=True)
+
+    q_table = QTable.from_q_dictionary(info["q_dictionary"])
+    nested_q_table = QTable.from_nested_q(Q, num_actions=q_table.num_actions)
+
+    for key, val in info["q_dictionary"].items():
+        assert q_table[key] == val
+        assert nested_q_table[key] == val
+    assert q_table.to_q_dictionary() == info["q_dictionary"]
+
+    # array-backed copy (e.g. for the Ray object store) has the same Q values
+    encoded_q_table = nested_q_table.to_encoded_q_table()
+    for key, val in info["q_dictionary"].items():
+        assert encoded_q_table[key] == val
+
+    # one row of action values per state, -inf for unavailable actions
+    states = list(Q.keys())
+    action_values = nested_q_table.get_action_values(states)
+    for state, state_action_values in zip(states, action_values):
+        for action in range(q_table.num_actions):
+            assert state_action_values[action] == Q[state].get(action, -float("inf"))
+
+
+def test_sparse_value_iteration(vi_test_cases):
+    setting = vi_test_cases
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+
+    Q, V, pi, _ = value_iteration(env)
+    sparse_Q, sparse_V, sparse_pi, info = sparse_value_iteration(env)
+
+    assert info["num_iterations"] > 0
+    for state in env.P.keys():
+        assert np.isclose(V[state], sparse_V[state])
+        for action in env.actions(state):
+            assert np.isclose(Q[state][action], sparse_Q[state][action])
+
+
+def test_backward_induction(vi_test_cases):
+    setting = vi_test_cases
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+
+    Q, V, pi, _ = value_iteration(env)
+    induction_Q, induction_V, induction_pi, info = backward_induction(env)
+
+    # every state of a symmetric Mouselab environment is reachable
+    assert info["num_states"] == len(env.P)
+    assert sum(info["layer_sizes"]) == len(env.P)
+    for state in env.P.keys():
+        assert np.isclose(V[state], induction_V[state])
+        for action in env.actions(state):
+            assert np.isclose(Q[state][action], induction_Q[state][action])
+
+
+def test_canonical_states(vi_test_cases):
+    setting = vi_test_cases
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+    canonical_env = CanonicalMouselabEnv(env)
+
+    Q, _, _, _ = value_iteration(env)
+    canonical_Q, _, _, _ = backward_induction(canonical_env)
+    assert len(canonical_Q) <= len(Q)
+
+    q_table = QTable.from_nested_q(canonical_Q, symmetry=canonical_env.symmetry)
+    states = [state for state in env.P.keys() if state != env.terminal_state]
+    action_values = q_table.get_action_values(states)
+    for state, state_action_values in zip(states, action_values):
+        for action in env.actions(state):
+            assert np.isclose(Q[state][action], state_action_values[action])
+            assert np.isclose(Q[state][action], q_table[(state, action)])
+
+
+def test_backward_induction_cyclic():
+    env = ModifiedCliffWalkingEnv(
+        cost_function=distance_bonus,
+        cost_kwargs={
+            "distance_cost_weight": 0.1,
+            "positions_in_question": [(3, 11)],
+            "env_shape": (4, 12),
+        },
+    )
+
+    with pytest.raises(ValueError):
+        backward_induction(env)
+
+
+def test_sparse_value_iteration_gridworld():
+    env = ModifiedCliffWalkingEnv(
+        cost_function=distance_bonus,
+        cost_kwargs={
+            "distance_cost_weight": 0.1,
+            "positions_in_question": [(3, 11)],
+            "env_shape": (4, 12),
+        },
+    )
+
+    Q, V, pi, _ = value_iteration(env, epsilon=1e-10)
+    sparse_Q, sparse_V, sparse_pi, _ = sparse_value_iteration(env, epsilon=1e-10)
+
+    assert pi.keys() == sparse_pi.keys()
+    for state in env.P.keys():
+        if state in sparse_pi:
+            # actions can differ when tied
+            assert np.isclose(Q[state][sparse_pi[state]], V[state])
+        assert np.isclose(V[state], sparse_V[state])
+        for action in env.actions(state):
+            assert np.isclose(Q[state][action], sparse_Q[state][action])
+
+
+def test_grid_world():
+    # same layout as cliff walking
+    grid_world = ModifiedGridWorld(
+        shape=(4, 12), cliffs=[(3, col) for col in range(1, 11)]
+    )
+    _, V, _, _ = sparse_value_iteration(grid_world)
+    _, cliff_walking_V, _, _ = sparse_value_iteration(ModifiedCliffWalkingEnv())
+    for state in grid_world.P.keys():
+        assert np.isclose(V[state], cliff_walking_V[state])
+
+    random_grid_world = ModifiedGridWorld.new_random(
+        (10, 15), num_goals=2, wall_fraction=0.1, cliff_fraction=0.05, slip=0.1, seed=0
+    )
+    _, V, _, _ = value_iteration(random_grid_world, epsilon=1e-10)
+    _, sparse_V, _, _ = sparse_value_iteration(random_grid_world, epsilon=1e-10)
+    for state in random_grid_world.P.keys():
+        assert np.isfinite(sparse_V[state])
+        assert np.isclose(V[state], sparse_V[state])
+
+
+@pytest.mark.parametrize("cost_function", [distance_bonus, potential_distance_bonus])
+def test_vectorized_costs(cost_function):
+    cost = cost_function(
+        distance_cost_weight=0.1,
+        positions_in_question=[(3, 11), (0, 5)],
+        env_shape=(4, 12),
+    )
+    compiled_mdp = CompiledMDP.from_env(ModifiedCliffWalkingEnv(), include_cost=False)
+
+    # a plain function is evaluated transition by transition
+    assert np.allclose(
+        compiled_mdp.get_transition_costs(cost),
+        compiled_mdp.get_transition_costs(lambda *transition: cost(*transition)),
+    )
+
+
+def test_asymmetric_distance_costs():
+    positions_in_question = [(3, 11), (0, 5)]
+
+    def asymmetric_distance(position_in_question, position):
+        # e.g. moving down is twice as costly as moving up
+        difference = np.subtract(position, position_in_question)
+        return np.sum(np.maximum(difference, 0)) * 2 + np.sum(
+            np.maximum(-difference, 0)
+        )
+
+    cost = distance_bonus(
+        distance_cost_weight=0.1,
+        positions_in_question=positions_in_question,
+        env_shape=(4, 12),
+        distance_function=asymmetric_distance,
+    )
+    for state in range(4 * 12):
+        position = np.unravel_index(state, (4, 12))
+        assert np.isclose(
+            cost(None, None, state, False),
+            -min(
+                asymmetric_distance(position_in_question, position)
+                for position_in_question in positions_in_question
+            )
+            * 0.1,
+        )
+
+
+def test_batched_value_iteration():
+    all_cost_kwargs = [
+        {
+            "distance_cost_weight": distance_cost_weight,
+            "positions_in_question": [(3, 11)],
+            "env_shape": (4, 12),
+        }
+        for distance_cost_weight in [0, 0.1, 1]
+    ]
+
+    batched_results = batched_value_iteration(
+        ModifiedCliffWalkingEnv(), distance_bonus, all_cost_kwargs
+    )
+
+    for cost_kwargs, (batched_Q, batched_V, _, _) in zip(
+        all_cost_kwargs, batched_results
+    ):
+        env = ModifiedCliffWalkingEnv(
+            cost_function=distance_bonus, cost_kwargs=cost_kwargs
+        )
+        Q, V, _, _ = sparse_value_iteration(env)
+        for state in env.P.keys():
+            assert np.isclose(V[state], batched_V[state], atol=1e-5)
+            for action in env.actions(state):
+                assert np.isclose(Q[state][action], batched_Q[state][action], atol=1e-5)
+
+
+def test_warm_started_value_iteration():
+    all_cost_kwargs = [
+        {
+            "distance_cost_weight": distance_cost_weight,
+            "positions_in_question": [(3, 11)],
+            "env_shape": (4, 12),
+        }
+        for distance_cost_weight in [1, 0, 0.5, 0.1]
+    ]
+    assert get_cost_grid_path(all_cost_kwargs) == [1, 3, 2, 0]
+
+    env = ModifiedCliffWalkingEnv()
+    warm_results = warm_started_value_iteration(env, distance_bonus, all_cost_kwargs)
+    batched_results = batched_value_iteration(env, distance_bonus, all_cost_kwargs)
+
+    for (warm_Q, _, _, _), (batched_Q, _, _, _) in zip(warm_results, batched_results):
+        for state in env.P.keys():
+            for action in env.actions(state):
+                assert np.isclose(
+                    warm_Q[state][action], batched_Q[state][action], atol=1e-5
+                )
+
+
+def test_initial_values(vi_test_cases):
+    setting = vi_test_cases
+    env = ModifiedMouseLabEnv.new_symmetric_registered(setting)
+
+    Q, _, _, _ = value_iteration(env)
+    _, _, _, info = sparse_value_iteration(env)
+    # starting from the solution converges faster
+    _, _, _, warm_info = sparse_value_iteration(env, initial_Q=Q)
+    assert warm_info["num_iterations"] < info["num_iterations"]